@@ -1,7 +1,7 @@
 from src._scheduler import SequentialScheduler
 from src._common import Runner, RunnerParams
 from src._benchplan import read_fastlbp_benchplan
-from src.execute_fastlbp_bench import main as benchmark_main
+from src.execute_fastlbp_bench import main as benchmark_main, get_journal_path, reset_journal
 from src.parse_fastlbp_results import main as parse_main
 from src._config import config
 
@@ -49,15 +49,11 @@ def parse_results():
 if __name__ == "__main__":
     with redirect_stderr(sys.stdout):
         if os.path.exists(work_benchplan):
-            print(f"'{work_benchplan}' already exists. Do you really want to OVERWRITE it and start benchmarking again? [y/n]")
-            yn = input(":")
-            if yn.lower() == 'y':
-                print("Overwriting the benchplan")
-                prepare_benchplans()
-            else:
-                print("Ok, I will not overwrite and will continue working on the same benchplan. I did not change the file.")
-                parse_results()
+            # the scheduler journal knows which runs are done and which were interrupted
+            print(f"'{work_benchplan}' already exists. Resuming it. To start from scratch, delete it and '{get_journal_path(work_benchplan)}'.")
+            parse_results()
         else:
+            reset_journal(work_benchplan)
             prepare_benchplans()
        
         run_benchmark()
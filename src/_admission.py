@@ -0,0 +1,163 @@
+from typing import TYPE_CHECKING, Union
+import math
+
+if TYPE_CHECKING:
+    from _scheduler import Job
+
+"""
+Admission policies for ParallelScheduler.
+
+A policy looks at the queue and the free resources and decides which jobs to start right now.
+It never starts anything itself, the scheduler does.
+"""
+
+class AdmissionPolicy:
+    """
+    Base class. Subclasses override `select`.
+    """
+    name: str = ''
+
+    def select(self,
+               queued: list['Job'],
+               in_progress: list['Job'],
+               free_cpus: int,
+               free_mem_gb: float,
+               total_cpus: int,
+               total_mem_gb: float,
+               now: float
+               ) -> list['Job']:
+        """
+        Return jobs from `queued` that should be started now, in the order they should be started.
+        The sum of their resources must fit into `free_cpus` and `free_mem_gb`.
+
+        :param now: perf_counter time, comparable with Job.start_time
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _first_fit(jobs: list['Job'], free_cpus: int, free_mem_gb: float) -> list['Job']:
+        selected = []
+        for job in jobs:
+            if job.ncpus <= free_cpus and job.mem_gb <= free_mem_gb:
+                selected.append(job)
+                free_cpus -= job.ncpus
+                free_mem_gb -= job.mem_gb
+        return selected
+
+
+class FirstFitPolicy(AdmissionPolicy):
+    """
+    Scan the queue in order and start every job that fits. The original scheduler behaviour.
+    """
+    name = 'fifo'
+
+    def select(self, queued, in_progress, free_cpus, free_mem_gb, total_cpus, total_mem_gb, now):
+        return self._first_fit(queued, free_cpus, free_mem_gb)
+
+
+class SmallestFirstPolicy(AdmissionPolicy):
+    """
+    Start the smallest jobs first (by memory, then by cpus).
+    """
+    name = 'smallest_first'
+
+    def select(self, queued, in_progress, free_cpus, free_mem_gb, total_cpus, total_mem_gb, now):
+        jobs = sorted(queued, key=lambda j: (j.mem_gb, j.ncpus))
+        return self._first_fit(jobs, free_cpus, free_mem_gb)
+
+
+class BestFitDecreasingPolicy(AdmissionPolicy):
+    """
+    Best-fit decreasing on (cpus, mem).
+    Jobs are ordered by their dominant normalized size max(ncpus/total_cpus, mem_gb/total_mem_gb), largest first,
+    so every free slot is filled with the largest job that still fits in it.
+    """
+    name = 'best_fit'
+
+    def select(self, queued, in_progress, free_cpus, free_mem_gb, total_cpus, total_mem_gb, now):
+        def size(job: 'Job'):
+            return max(job.ncpus / max(total_cpus, 1), job.mem_gb / max(total_mem_gb, 1))
+        jobs = sorted(queued, key=size, reverse=True)
+        return self._first_fit(jobs, free_cpus, free_mem_gb)
+
+
+class EasyBackfillPolicy(AdmissionPolicy):
+    """
+    EASY backfilling.
+    Jobs are started in queue order until the first one that does not fit (the head).
+    Resources are reserved for the head at the "shadow time", the earliest time enough running jobs
+    are expected to finish. A later job may jump ahead only if it does not delay the head, i.e.
+    - it is expected to finish before the shadow time, or
+    - it fits into resources the head will not need even at the shadow time.
+
+    Expected finish times come from Job.est_time_s. Without estimates only the second rule applies.
+    """
+    name = 'backfill'
+
+    def select(self, queued, in_progress, free_cpus, free_mem_gb, total_cpus, total_mem_gb, now):
+        selected = []
+        i = 0
+        while i < len(queued):
+            job = queued[i]
+            if job.ncpus > total_cpus or job.mem_gb > total_mem_gb:
+                # can never run, do not reserve anything for it
+                i += 1
+                continue
+            if job.ncpus > free_cpus or job.mem_gb > free_mem_gb:
+                break
+            selected.append(job)
+            free_cpus -= job.ncpus
+            free_mem_gb -= job.mem_gb
+            i += 1
+
+        if i >= len(queued):
+            return selected
+        head = queued[i]
+
+        # when will the head fit?
+        def expected_end(job: 'Job'):
+            if job.est_time_s is None:
+                return math.inf
+            return job.start_time + job.est_time_s
+        shadow_time = math.inf
+        shadow_cpus, shadow_mem_gb = free_cpus, free_mem_gb
+        for job in sorted(in_progress, key=expected_end):
+            shadow_cpus += job.ncpus
+            shadow_mem_gb += job.mem_gb
+            if head.ncpus <= shadow_cpus and head.mem_gb <= shadow_mem_gb:
+                shadow_time = expected_end(job)
+                break
+        extra_cpus = shadow_cpus - head.ncpus
+        extra_mem_gb = shadow_mem_gb - head.mem_gb
+
+        for job in queued[i+1:]:
+            if job.ncpus > free_cpus or job.mem_gb > free_mem_gb:
+                continue
+            ends_before_shadow = shadow_time < math.inf and job.est_time_s is not None and now + job.est_time_s <= shadow_time
+            if not ends_before_shadow:
+                if job.ncpus > extra_cpus or job.mem_gb > extra_mem_gb:
+                    continue
+                extra_cpus -= job.ncpus
+                extra_mem_gb -= job.mem_gb
+            selected.append(job)
+            free_cpus -= job.ncpus
+            free_mem_gb -= job.mem_gb
+
+        return selected
+
+"""
+"""
+
+ADMISSION_POLICIES = {
+    cls.name: cls for cls in [FirstFitPolicy, SmallestFirstPolicy, BestFitDecreasingPolicy, EasyBackfillPolicy]
+}
+
+def get_admission_policy(policy: Union[str, AdmissionPolicy]) -> AdmissionPolicy:
+    """
+    Get a policy instance by its name (one of ADMISSION_POLICIES keys) or return `policy` if it is an instance already.
+    """
+    if isinstance(policy, AdmissionPolicy):
+        return policy
+    if policy not in ADMISSION_POLICIES:
+        raise ValueError(f"Unknown admission policy '{policy}'. Available: {list(ADMISSION_POLICIES.keys())}")
+    return ADMISSION_POLICIES[policy]()
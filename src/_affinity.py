@@ -0,0 +1,187 @@
+import os
+from dataclasses import dataclass
+from glob import glob
+
+"""
+CPU topology discovery and allocation of disjoint core sets for parallel jobs.
+Linux only: other systems fall back to one logical cpu = one core on one NUMA node,
+and pinning itself is not available there.
+"""
+
+# cpus of a pinned job, set by the scheduler in the environment of the job (see pin_from_env)
+CPUS_ENV_VAR = 'MULTIBENCH_CPUS'
+
+@dataclass
+class PhysicalCore:
+    node: int
+    package: int
+    core_id: int
+    # logical cpus (SMT siblings) of this core
+    cpus: list[int]
+
+def parse_cpu_list(s: str) -> list[int]:
+    """
+    Parse a Linux cpu list like '0-3,8,10-11'
+    """
+    cpus = []
+    for part in s.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            a, b = part.split('-')
+            cpus += list(range(int(a), int(b)+1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def format_cpu_list(cpus) -> str:
+    """
+    Inverse of parse_cpu_list: [0,1,2,3,8] -> '0-3,8'
+    """
+    cpus = sorted(cpus)
+    parts = []
+    i = 0
+    while i < len(cpus):
+        j = i
+        while j+1 < len(cpus) and cpus[j+1] == cpus[j]+1:
+            j += 1
+        parts.append(str(cpus[i]) if i == j else f"{cpus[i]}-{cpus[j]}")
+        i = j+1
+    return ','.join(parts)
+
+def _read_int(path: str, default: int = 0) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+def read_cpu_topology() -> list[PhysicalCore]:
+    """
+    Return physical cores available to this process (see os.sched_getaffinity), grouped with their SMT siblings.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+
+    cpu_to_node = {}
+    for node_dir in glob('/sys/devices/system/node/node[0-9]*'):
+        node = int(os.path.basename(node_dir)[len('node'):])
+        try:
+            with open(os.path.join(node_dir, 'cpulist')) as f:
+                for cpu in parse_cpu_list(f.read()):
+                    cpu_to_node[cpu] = node
+        except OSError:
+            pass
+
+    cores: dict[tuple[int,int], PhysicalCore] = {}
+    for cpu in available:
+        topology = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        package = _read_int(os.path.join(topology, 'physical_package_id'), 0)
+        core_id = _read_int(os.path.join(topology, 'core_id'), cpu)
+        key = (package, core_id)
+        if key not in cores:
+            cores[key] = PhysicalCore(cpu_to_node.get(cpu, 0), package, core_id, [])
+        cores[key].cpus.append(cpu)
+
+    return sorted(cores.values(), key=lambda c: (c.node, c.package, c.core_id))
+
+def set_process_affinity(pid: int, cpus: list[int]) -> bool:
+    """
+    Pin a process to `cpus`. Children started afterwards inherit the affinity.
+    Return False if pinning is not supported on this system.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(pid, cpus)
+    return True
+
+def pin_from_env() -> list[int] | None:
+    """
+    Pin this process to the cpus in CPUS_ENV_VAR, if set. Return them.
+    sched_setaffinity pins only the calling thread (and what it starts afterwards),
+    so call this before the process starts threads or the job.
+    """
+    cpus = os.environ.get(CPUS_ENV_VAR)
+    if not cpus or not set_process_affinity(0, parse_cpu_list(cpus)):
+        return None
+    return parse_cpu_list(cpus)
+
+def get_process_affinity() -> list[int] | None:
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    return sorted(os.sched_getaffinity(0))
+
+"""
+"""
+
+class CoreAllocator:
+    """
+    Hands out disjoint sets of physical cores.
+    A set is kept on a single NUMA node when possible.
+    Among the nodes that can fit the request the fullest one is chosen (best fit),
+    so that large contiguous blocks stay free for large jobs.
+    """
+    cores: list[PhysicalCore]
+    use_smt_siblings: bool
+    free: dict[int, list[PhysicalCore]]
+
+    def __init__(self, cores: list[PhysicalCore] | None = None, use_smt_siblings: bool = True):
+        """
+        :param cores: cores to allocate from, by default everything from read_cpu_topology()
+        :param use_smt_siblings: pin jobs to all SMT siblings of their cores, not only to the first logical cpu of each core
+        """
+        self.cores = cores if cores is not None else read_cpu_topology()
+        self.use_smt_siblings = use_smt_siblings
+        self.free = {}
+        for core in self.cores:
+            self.free.setdefault(core.node, []).append(core)
+
+    @property
+    def n_cores(self) -> int:
+        return len(self.cores)
+
+    @property
+    def n_free(self) -> int:
+        return sum(len(v) for v in self.free.values())
+
+    def allocate(self, ncores: int) -> list[PhysicalCore] | None:
+        """
+        Take `ncores` free physical cores. Return None if there are not enough free cores.
+        """
+        if ncores > self.n_free:
+            return None
+        if ncores <= 0:
+            return []
+
+        fitting_nodes = [n for n, free in self.free.items() if len(free) >= ncores]
+        if fitting_nodes:
+            node = min(fitting_nodes, key=lambda n: len(self.free[n]))
+            taken = self.free[node][:ncores]
+            self.free[node] = self.free[node][ncores:]
+            return taken
+
+        # spread over several nodes, the emptiest first
+        taken = []
+        for node in sorted(self.free.keys(), key=lambda n: -len(self.free[n])):
+            k = min(ncores - len(taken), len(self.free[node]))
+            taken += self.free[node][:k]
+            self.free[node] = self.free[node][k:]
+            if len(taken) == ncores:
+                break
+        return taken
+
+    def release(self, cores: list[PhysicalCore]) -> None:
+        for core in cores:
+            self.free.setdefault(core.node, []).append(core)
+        for node in self.free:
+            self.free[node].sort(key=lambda c: (c.package, c.core_id))
+
+    def get_cpus(self, cores: list[PhysicalCore]) -> list[int]:
+        """
+        Logical cpus to pin a job with these cores to
+        """
+        if self.use_smt_siblings:
+            return sorted(cpu for core in cores for cpu in core.cpus)
+        return sorted(core.cpus[0] for core in cores)
@@ -4,20 +4,34 @@ import os
 import fastlbp_imbg as fastlbp
 import itertools
 import pandas as pd
-import re
+import functools
+from typing import TYPE_CHECKING
 
 from _config import config, ensure_config_ok
 from _common import get_field_names
 from fastlbp_runner import FastlbpBenchplanRecord
+from _inputs import image_spec, mask_spec, materialize_inputs, check_format_available, DISK, MASK_GEOMETRIES, TIFF, INPUT_FORMATS
+from _pagecache import NONE, CACHE_MODES
+
+if TYPE_CHECKING:
+    from _costmodel import CostModel
 
 def shape2str(shape):
     return "x".join(map(str,shape))
 
-def get_run_label(input_shape, mask_ratio, patchsize, ncpus, nradii, repeat=None):
+def get_run_label(input_shape, mask_ratio, patchsize, ncpus, nradii, repeat=None, mask_geometry=DISK, input_format=TIFF, cache_mode=NONE):
     rep_str = ""
     if repeat:
         rep_str = f"__{repeat}"
-    return f"{shape2str(input_shape)}_m{mask_ratio:.3f}_p{patchsize}_n{ncpus}_r{nradii}" + rep_str
+    # disk masks, tiff inputs and untouched caches keep the original labels
+    geometry_str = "" if mask_geometry == DISK else mask_geometry
+    format_str = "" if input_format == TIFF else f"_{input_format}"
+    cache_str = "" if cache_mode == NONE else f"_{cache_mode}"
+    return f"{shape2str(input_shape)}_m{mask_ratio:.3f}{geometry_str}_p{patchsize}_n{ncpus}_r{nradii}{format_str}{cache_str}" + rep_str
+
+@functools.lru_cache(maxsize=None)
+def get_n_features_single_channel(nradii: int) -> int:
+    return int((fastlbp.get_p_for_r(fastlbp.get_radii(nradii))+2).sum())
 
 def get_approx_mem_usage_gb(input_shape: tuple[int], mask: bool, patchsize: int, ncpus: int, nradii: int) -> int:
     """
@@ -36,7 +50,7 @@ def get_approx_mem_usage_gb(input_shape: tuple[int], mask: bool, patchsize: int,
     lbp_output_size = (np.prod(input_shape) / gb) * 2
     
     # always uint32 in my implementation
-    n_features_single_channel = (fastlbp.get_p_for_r(fastlbp.get_radii(nradii))+2).sum() 
+    n_features_single_channel = get_n_features_single_channel(nradii)
     n_channels = input_shape[2]
     feature_array_size = input_size/(patchsize*patchsize) * n_features_single_channel * n_channels * 4
 
@@ -49,10 +63,28 @@ def get_approx_mem_usage_gb(input_shape: tuple[int], mask: bool, patchsize: int,
     assert est_mem_gb > 0, f"{input_shape}, {mask}, {patchsize}, {ncpus}, {nradii}; {input_size}, {feature_array_size}, {(input_size + mask_size + lbp_output_size + feature_array_size)}"
     return int(est_mem_gb)
 
+def get_approx_mem_usage_gb_batch(input_shapes: np.ndarray, mask: np.ndarray, patchsize: np.ndarray, nradii: np.ndarray) -> np.ndarray:
+    """
+    get_approx_mem_usage_gb for many runs at once, with the same results
+
+    :param input_shapes: (n, 3) array
+    """
+    gb = 1e9
+    input_shapes = np.asarray(input_shapes, dtype=np.int64)
+    input_size = (np.prod(input_shapes, axis=1) / gb) * 8
+    mask_size = np.where(mask, (np.prod(input_shapes[:, :2], axis=1) / gb) * 8, 0)
+    lbp_output_size = (np.prod(input_shapes, axis=1) / gb) * 2
+    n_features_single_channel = np.array([get_n_features_single_channel(int(r)) for r in nradii], dtype=np.int64)
+    feature_array_size = input_size/(np.asarray(patchsize)*np.asarray(patchsize)) * n_features_single_channel * input_shapes[:, 2] * 4
+    est_mem_gb = np.ceil((input_size + mask_size + lbp_output_size + feature_array_size) * 1.2)
+    assert (est_mem_gb > 0).all()
+    return est_mem_gb.astype(int)
+
 def create_disk_mask(img_shape, area=0.5):
     """
     Create mask of a disk shape in the center of the image with ones inside and zeros outside.  
     Size of the disk is such that num_ones_in_mask/num_image_pixels = area.  
+    Return the path of the mask (npy) in config.input_dir. An existing mask is reused if it is complete, see _inputs.py.
 
     - area parameter should be less than 0.78 ~ pi/4 in order for the disk to fit in the image.
     - if area is 1, then create a mask full of ones (np.ones).
@@ -60,101 +92,191 @@ def create_disk_mask(img_shape, area=0.5):
         For further steps that means compute the whole image, do not use mask at all.  
         Note that it differs from the mask full of ones.
     """
-    
-    if area == 0 or area == 0.0 or area is None:
+    return create_mask(img_shape, area, DISK)
+
+def create_mask(img_shape, area=0.5, geometry=DISK):
+    """
+    Like create_disk_mask, for any geometry of _inputs.MASK_GEOMETRIES: 
+    'disk', 'ring', 'disks' (a grid of disks), 'blobs' (random blobs) or 'tissue' (a random tissue-like section).
+    The mask is written block by block, so any size needs constant memory.
+    """
+    spec = mask_spec(img_shape, area, geometry)
+    if spec is None:
         return None
-    
-    mask_shape = img_shape
-    if len(img_shape) == 3:
-        mask_shape = mask_shape[:2]
-    area1 = round(area,3)
-    mask_id = shape2str(mask_shape) + f"_{area1:.3f}"
-    mask_name = f"{mask_id}.npy"
-    mask_path = os.path.abspath(f"{config.input_dir}/{mask_name}")
-    
-    if os.path.isfile(mask_path):
-        # mask exists
-        print(f"Mask {mask_id} exists")
-        return mask_path
-    
-    
-    print(f"Creating mask {mask_id}...")
-
-    if area > 0.99:
-        mask = np.ones(mask_shape, np.uint8)
-    elif area > 0.78:
-        raise NotImplementedError("Sorry, create_disk_mask only supports disks that fit into the image, i.e. mask_ratio < pi/4 ~ 0.78")
-    else:
-        h,w = mask_shape[0], mask_shape[1]
-        center = (int(h/2), int(w/2))
-        axi = np.arange(h) - center[0]
-        axj = np.arange(w) - center[1]
-        xx,yy = np.meshgrid(axi,axj, sparse=True)
-        
-        # n_mask_pixels = pi*r2
-        # area_ratio = pi*r2 / npixels
-        # r2 = npixels * area_ratio / pi
-        r2 = float(np.prod(mask_shape) * area1) / np.pi
-        mask = ((xx*xx + yy*yy) < r2).astype(np.uint8)
-    
-    assert mask.shape == mask_shape
-    assert mask.dtype == np.uint8
-    assert np.abs(mask.mean() - area1) < 0.01
-    
-    print(f"Saving mask {mask_path}")
-    np.save(mask_path, mask)
-    
-    return mask_path
+    return materialize_inputs([spec])[spec]
+
+def ensure_inputs(records: list[FastlbpBenchplanRecord], **materialize_kwargs) -> list[str]:
+    """
+    Check the inputs of benchplan runs and regenerate the broken or missing ones (see _inputs.materialize_inputs).
+    Only generated inputs are managed, other input files are only checked for existence.
+    Return the paths of missing inputs that cannot be generated
+    """
+    specs, missing = [], []
+    for rec in records:
+        for spec, path in [(image_spec(rec.input_shape, rec.input_format) if len(rec.input_shape) == 3 and rec.input_shape[2] in [1, 3] else None, rec.input_tiff_path), 
+                           (mask_spec(rec.input_shape, rec.mask_ratio, rec.mask_geometry or DISK), rec.mask_npy_path)]:
+            if not path:
+                continue
+            if spec is not None and spec.get_path(config.input_dir) == os.path.abspath(path):
+                specs.append(spec)
+            elif not os.path.exists(path):
+                missing.append(path)
+    materialize_inputs(specs, **materialize_kwargs)
+    return sorted(set(missing))
 
 """
 """
 
+BENCHPLAN_FIELDS = get_field_names(FastlbpBenchplanRecord)
+
 class FastlbpBenchplan:
-    all_runs: list[FastlbpBenchplanRecord]
+    """
+    Runs are stored column-wise, one list per FastlbpBenchplanRecord field. 
+    Adding a run only appends its parameters; input images, masks and memory estimates 
+    of all new runs are created in one batch (see materialize) the next time all_runs, to_df or save is used.
+    all_runs is a list of records built from the columns. Like the list the runs used to be stored in,
+    it may be edited (e.g. rec.result_ok = ...) or appended to: the changes are written back before the plan changes or is saved.
+    """
+    cost_model: 'CostModel | None'
+    # arguments of _inputs.materialize_inputs, e.g. max_workers and max_mem_gb
+    input_options: dict
+
+    def __init__(self, cost_model: 'CostModel | None' = None, **input_options):
+        """
+        :param cost_model: if set, approx_mem_usage_gb is the upper bound of the predicted peak memory 
+            instead of the static estimate, and approx_time_s is filled with the predicted runtime
+        :param input_options: passed to _inputs.materialize_inputs: max_workers, max_mem_gb, full_check
+        """
+        self.cost_model = cost_model
+        self.input_options = input_options
+        self._columns: dict[str, list] = {name: [] for name in BENCHPLAN_FIELDS}
+        # label without the repeat suffix -> number of runs with it
+        self._nrepeats: dict[str, int] = {}
+        # (row, raw mask ratio) of runs added by add_single_fastlbp_run that have no inputs and estimates yet.
+        # the raw ratio is needed to create the mask, mask_ratio is rounded
+        self._pending: list[tuple[int, float]] = []
+        self._runs: list[FastlbpBenchplanRecord] | None = None
 
-    def __init__(self):
-        self.all_runs = []
+    def __len__(self):
+        if self._runs is not None:
+            return len(self._runs)
+        return len(self._columns['run_label'])
+
+    @property
+    def all_runs(self) -> list[FastlbpBenchplanRecord]:
+        self.materialize()
+        if self._runs is None:
+            self._runs = [FastlbpBenchplanRecord(*row) for row in zip(*self._columns.values())]
+        return self._runs
+
+    def _sync_runs(self):
+        """
+        Write the records of all_runs back into the columns
+        """
+        if self._runs is not None:
+            self._columns = {name: [getattr(rec, name) for rec in self._runs] for name in BENCHPLAN_FIELDS}
+
+    def add_record(self, rec: FastlbpBenchplanRecord):
+        """
+        Add a run as is, e.g. read from a benchplan file
+        """
+        self._sync_runs()
+        for name in BENCHPLAN_FIELDS:
+            self._columns[name].append(getattr(rec, name))
+        self._runs = None
 
     def add_single_fastlbp_run(self, 
                                input_shape: tuple[int, int, int], 
                                mask_ratio: float, 
                                patchsize: int, 
                                ncpus: int, 
-                               nradii: int
+                               nradii: int,
+                               mask_geometry: str = DISK,
+                               input_format: str = TIFF,
+                               cache_mode: str = NONE
                                ):
-        label = get_run_label(input_shape, mask_ratio, patchsize, ncpus, nradii)
-
-        rec = FastlbpBenchplanRecord(
-            run_label= label,
-            input_shape= input_shape,
-            input_tiff_path= fastlbp.create_sample_image(*input_shape, dir=config.input_dir),
-            mask_npy_path= create_disk_mask(input_shape, mask_ratio),
-            # input_shape=input_shape,
-            mask_ratio=round(mask_ratio,3),
-            patchsize= patchsize, 
-            ncpus= ncpus, 
-            nradii= nradii,
-            approx_mem_usage_gb= get_approx_mem_usage_gb(input_shape, (mask_ratio or mask_ratio>0), patchsize, ncpus, nradii)
-        )
-        
-        nrepeat = 1
-        pattern = re.compile(rec.run_label)
-        for r in self.all_runs:
-            if pattern.match(r.run_label) is not None:
-                nrepeat += 1
-        rec.repeat = nrepeat
-        rec.run_label += f'__{nrepeat}'
-
-        self.all_runs.append(rec)
+        """
+        :param mask_geometry: see create_mask
+        :param input_format: container of the input image, see _inputs.read_image
+        :param cache_mode: page-cache state of the inputs when the run starts: 'none', 'warm', 'cold' or 'staged', see _pagecache.py
+        """
+        assert mask_geometry in MASK_GEOMETRIES, f"unknown mask geometry {mask_geometry}, one of {list(MASK_GEOMETRIES)}"
+        assert input_format in INPUT_FORMATS, f"unknown input format {input_format}, one of {INPUT_FORMATS}"
+        # fail while planning rather than in every job
+        check_format_available(input_format)
+        assert cache_mode in CACHE_MODES, f"unknown cache mode {cache_mode}, one of {CACHE_MODES}"
+        if not mask_ratio:
+            # no mask, the geometry does not matter
+            mask_geometry = DISK
+        label = get_run_label(input_shape, mask_ratio, patchsize, ncpus, nradii, mask_geometry=mask_geometry, input_format=input_format, cache_mode=cache_mode)
+        nrepeat = self._nrepeats.get(label, 0) + 1
+        self._nrepeats[label] = nrepeat
+
+        self._sync_runs()
+        self._runs = None
+        c = self._columns
+        self._pending.append((len(self), mask_ratio))
+        c['run_label'].append(f'{label}__{nrepeat}')
+        c['input_shape'].append(tuple(input_shape))
+        c['input_tiff_path'].append(None)
+        c['mask_npy_path'].append(None)
+        c['mask_ratio'].append(round(mask_ratio,3))
+        c['patchsize'].append(patchsize)
+        c['ncpus'].append(ncpus)
+        c['nradii'].append(nradii)
+        c['approx_mem_usage_gb'].append(None)
+        c['repeat'].append(nrepeat)
+        c['mask_geometry'].append(mask_geometry)
+        c['input_format'].append(input_format)
+        c['cache_mode'].append(cache_mode)
+        for name in ['approx_time_s', 'result_time', 'result_mem', 'result_ok']:
+            c[name].append(None)
+        self._runs = None
+
+    def materialize(self):
+        """
+        Create input images and masks of the runs added since the last call (each distinct one once, in parallel, see _inputs.py)
+        and fill their paths and memory (and runtime) estimates
+        """
+        if not self._pending:
+            return
+        c = self._columns
+        rows = [i for i, _ in self._pending]
+        mask_ratios = [ratio for _, ratio in self._pending]
+        shapes = [c['input_shape'][i] for i in rows]
+
+        image_specs = [image_spec(shape, c['input_format'][i]) for shape, i in zip(shapes, rows)]
+        mask_specs = [mask_spec(shape, ratio, geometry) for shape, ratio, geometry in zip(shapes, mask_ratios, [c['mask_geometry'][i] for i in rows])]
+        paths = materialize_inputs(image_specs + [spec for spec in mask_specs if spec is not None], **self.input_options)
+        mem_gb = get_approx_mem_usage_gb_batch(
+            np.array(shapes), 
+            np.array([bool(r) for r in mask_ratios]), 
+            np.array([c['patchsize'][i] for i in rows]), 
+            [c['nradii'][i] for i in rows])
+        for i, image, mask, mem in zip(rows, image_specs, mask_specs, mem_gb):
+            c['input_tiff_path'][i] = paths[image]
+            c['mask_npy_path'][i] = paths[mask] if mask is not None else None
+            c['approx_mem_usage_gb'][i] = int(mem)
+        self._pending = []
+        self._runs = None
+
+        if self.cost_model is not None:
+            for i in rows:
+                prediction = self.cost_model.predict_record(FastlbpBenchplanRecord(*[c[name][i] for name in BENCHPLAN_FIELDS]))
+                c['approx_mem_usage_gb'][i] = int(np.ceil(prediction.mem_gb_hi))
+                c['approx_time_s'][i] = round(prediction.time_s, 3)
 
     def add_combinations_fastlbp(self, 
                  shape: list[tuple[int, int, int]],
                  maskratio: list[float],
                  patchsize: list[int],
                  ncpus: list[int],
-                 nradii: list[int]
+                 nradii: list[int],
+                 maskgeometry: list[str] = (DISK,),
+                 inputformat: list[str] = (TIFF,),
+                 cachemode: list[str] = (NONE,)
                  ):
-        all_params = (shape, maskratio, patchsize, ncpus, nradii) # order is important 
+        all_params = (shape, maskratio, patchsize, ncpus, nradii, maskgeometry, inputformat, cachemode) # order is important 
         n = 0
         for single_run_params in itertools.product(*all_params):
             self.add_single_fastlbp_run(*single_run_params)
@@ -167,10 +289,13 @@ class FastlbpBenchplan:
                  maskratio: list[float],
                  patchsize: list[int],
                  ncpus: list[int],
-                 nradii: list[int]
+                 nradii: list[int],
+                 maskgeometry: list[str] = (DISK,),
+                 inputformat: list[str] = (TIFF,),
+                 cachemode: list[str] = (NONE,)
                  ):
-        all_params = (shape, maskratio, patchsize, ncpus, nradii) # order is important 
-        baseline_parameters = [shape[0], maskratio[0], patchsize[0], ncpus[0], nradii[0]]
+        all_params = (shape, maskratio, patchsize, ncpus, nradii, maskgeometry, inputformat, cachemode) # order is important 
+        baseline_parameters = [shape[0], maskratio[0], patchsize[0], ncpus[0], nradii[0], maskgeometry[0], inputformat[0], cachemode[0]]
         n = 0
         for param_id, param_list in enumerate(all_params):
             single_run_params = baseline_parameters.copy()
@@ -181,17 +306,10 @@ class FastlbpBenchplan:
         print(f"Addded {n} runs.")
 
     def to_df(self):
-        df = pd.DataFrame(self.all_runs, columns=get_field_names(FastlbpBenchplanRecord))
-
-        # deduplicate runs with the same parameters - add run number at the end of the label
-        num_of_repeat = df.groupby('run_label').cumcount().add(1)
-        df['repeat'] = num_of_repeat
-        df['run_label'] = np.where(
-            df['run_label'].duplicated(keep=False), 
-            df['run_label'] + '__' + num_of_repeat.astype(str),
-            df['run_label']
-        )
-        return df
+        # labels are unique and repeats numbered since add_single_fastlbp_run
+        self.materialize()
+        self._sync_runs()
+        return pd.DataFrame(self._columns, columns=BENCHPLAN_FIELDS)
 
     def save(self, file: str):
         # df = pd.DataFrame(self.all_runs, columns=[
@@ -211,12 +329,32 @@ class FastlbpBenchplan:
 
         self.to_df().to_csv(file, index=False)
 
+def parse_shape(s: str) -> tuple[int, ...]:
+    """
+    Parse an input shape as stored in a benchplan: '(100, 100, 3)', '100,100,3' or '100x100x3'
+    """
+    s = s.strip()
+    if '(' in s:
+        s = s[1:-1].strip()
+    delim = 'x' if 'x' in s else ','
+    return tuple(map(lambda v: int(v.strip()), s.split(delim)))
+
 def __normalize_path_field(path):
     assert isinstance(path, str) or path == np.nan, f"invalid path: '{path}' of type {type(path)}"
     if not path or path in [np.nan, 'nan', 'none', 'None', 'null']: return ''
     return path
 
-def read_fastlbp_benchplan(file: str, ensure_runnable=False):
+def __normalize_float_field(value) -> float | None:
+    """
+    With keep_default_na=False, a partly filled numeric column is read as strings, with '' for the empty cells
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if np.isfinite(value) else None
+
+def read_fastlbp_benchplan(file: str, ensure_runnable=False, cost_model: 'CostModel | None' = None):
     """
     Create a benchplan object from CSV file without validation.  
     That is, a benchplan could be unusable (e.g. wrong paths, invalid run labels)
@@ -226,26 +364,26 @@ def read_fastlbp_benchplan(file: str, ensure_runnable=False):
     and validate the labels.
 
     if ensure_runnable=True, all labels are ignored!
+    and approx_mem_usage_gb/approx_time_s are recomputed (using `cost_model` if it is set).
     """
     if ensure_runnable:
         ensure_config_ok()
 
-    bp = FastlbpBenchplan()
+    bp = FastlbpBenchplan(cost_model)
     # keep_default_na=False prevents filling fields with float(nan) and keeps empty strings instead
     df = pd.read_csv(file, keep_default_na=False)
     for rec in df.itertuples(index=False):
-        input_shape = rec.input_shape
-        if '(' in rec.input_shape:
-            input_shape = rec.input_shape.strip()[1:-1].strip()
-        delim = 'x' if 'x' in input_shape else ','
-        parsed_shape = tuple(map(lambda s: int(s.strip()), input_shape.split(delim)))
+        parsed_shape = parse_shape(rec.input_shape)
         if ensure_runnable:
             bp.add_single_fastlbp_run(
                 parsed_shape,
                 rec.mask_ratio,
                 rec.patchsize,
                 rec.ncpus,
-                rec.nradii
+                rec.nradii,
+                mask_geometry=getattr(rec, 'mask_geometry', None) or DISK,
+                input_format=getattr(rec, 'input_format', None) or TIFF,
+                cache_mode=getattr(rec, 'cache_mode', None) or NONE
                 )
         else:
             # print("X: ", rec.mask_npy_path)
@@ -262,10 +400,15 @@ def read_fastlbp_benchplan(file: str, ensure_runnable=False):
                 rec.nradii,
                 rec.approx_mem_usage_gb,
                 rec.repeat,
+                # older benchplans do not have this column
+                __normalize_float_field(getattr(rec, 'approx_time_s', None)),
+                getattr(rec, 'mask_geometry', None) or DISK,
+                getattr(rec, 'input_format', None) or TIFF,
+                getattr(rec, 'cache_mode', None) or NONE,
                 rec.result_time,
                 rec.result_mem,
                 rec.result_ok
                 )
-            bp.all_runs.append(params)
+            bp.add_record(params)
 
     return bp
@@ -1,4 +1,5 @@
 import os
+import json
 from dataclasses import dataclass, fields
 import dataclasses
 from typing import Type, Union
@@ -15,6 +16,28 @@ from _config import config
 def get_field_names(dataclass_or_instance):
     return [f.name for f in fields(dataclass_or_instance)]
 
+def read_json_file(path: str) -> dict:
+    """
+    Read a json dict. Return an empty dict if the file does not exist.
+    """
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def update_json_file(path: str, **fields) -> dict:
+    """
+    Merge `fields` into a json dict stored at `path` (create it if needed). 
+    The file is replaced atomically, so a reader never sees a half-written file.
+    """
+    data = read_json_file(path)
+    data.update(fields)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+    return data
+
 """
 """
 
@@ -36,6 +59,36 @@ class Runner:
         os.makedirs(dir, exist_ok=True)
         return dir
 
+    @staticmethod
+    def get_result_files(params: RunnerParams) -> list[str]:
+        """
+        Files with results of a run outside of its cwd. 
+        They are deleted when an interrupted run is restarted, so partial results are never parsed.
+        """
+        return []
+
+    @staticmethod
+    def get_input_files(params: RunnerParams) -> list[str]:
+        """
+        Input files of a run, as they appear in its argv. A profiling runner prepares their page-cache state, see _pagecache.py
+        """
+        return []
+
+    @staticmethod
+    def get_cache_mode(params: RunnerParams) -> str | None:
+        """
+        Page-cache mode of the inputs of a run (see _pagecache.CACHE_MODES), None to leave them as they are
+        """
+        return None
+
+    @staticmethod
+    def record_status(params: RunnerParams, status: str, **info) -> None:
+        """
+        Store a status decided by the scheduler (e.g. 'TIMEOUT') next to the results of a run, 
+        so that result parsing picks it up. `info` are additional json-serializable details.
+        """
+        pass
+
     @staticmethod
     def main():
         pass
@@ -0,0 +1,311 @@
+import os
+import json
+import socket
+import datetime
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import TYPE_CHECKING
+import numpy as np
+import fastlbp_imbg as fastlbp
+
+from _config import config
+from _benchplan import read_fastlbp_benchplan
+from fastlbp_runner import FastlbpBenchplanRecord
+
+if TYPE_CHECKING:
+    from _scheduler import Job
+
+"""
+Per-machine memory and runtime model for fastlbp runs, fitted on previous results.
+
+Both targets are modelled log-linearly:
+    log(y) = b0 + b1*log(pixels) + b2*log(channels) + b3*log(patchsize) + b4*log(nradii) + b5*log(ncpus)
+           + b6*log(mask coverage) + b7*has_mask
+so every coefficient is an exponent of a power law. Prediction intervals come from the residual
+variance and the parameter uncertainty of the least squares fit.
+"""
+
+FEATURE_NAMES = ['intercept', 'log_pixels', 'log_channels', 'log_patchsize', 'log_nradii', 'log_ncpus', 'log_mask_coverage', 'has_mask']
+
+# tiny ridge penalty, keeps the fit defined when a parameter never changes in the training data
+RIDGE = 1e-6
+
+def get_features(input_shape: tuple[int, int, int], mask_ratio: float, patchsize: int, ncpus: int, nradii: int) -> np.ndarray:
+    h, w = input_shape[0], input_shape[1]
+    channels = input_shape[2] if len(input_shape) > 2 else 1
+    mask_ratio = float(mask_ratio or 0)
+    has_mask = mask_ratio > 0
+    coverage = mask_ratio if has_mask else 1.0
+    return np.array([
+        1.0,
+        np.log(float(h) * float(w)),
+        np.log(channels),
+        np.log(patchsize),
+        np.log(nradii),
+        np.log(ncpus),
+        np.log(coverage),
+        float(has_mask)
+    ])
+
+def get_record_features(rec: FastlbpBenchplanRecord) -> np.ndarray:
+    return get_features(rec.input_shape, rec.mask_ratio, int(rec.patchsize), int(rec.ncpus), int(rec.nradii))
+
+def _to_float(value) -> float | None:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not np.isfinite(value) or value <= 0:
+        return None
+    return value
+
+def get_relative_cost(input_shape: tuple[int, int, int], mask_ratio: float, ncpus: int, nradii: int) -> float:
+    """
+    Size heuristic for ordering runs when there is no fitted model: 
+    lbp work is proportional to the number of (masked) pixels, channels and sampling points, divided between cpus.
+    Not in seconds, only relative values are meaningful.
+    """
+    h, w = input_shape[0], input_shape[1]
+    channels = input_shape[2] if len(input_shape) > 2 else 1
+    mask_ratio = float(mask_ratio or 0)
+    coverage = mask_ratio if mask_ratio > 0 else 1.0
+    npoints = float(fastlbp.get_p_for_r(fastlbp.get_radii(int(nradii))).sum())
+    return float(h) * float(w) * channels * coverage * npoints / max(int(ncpus), 1)
+
+def get_default_model_path() -> str:
+    """
+    Models are per machine: results from a laptop say nothing about a 256 GB node
+    """
+    return os.path.join(config.results_dir, f'costmodel_{socket.gethostname()}.json')
+
+"""
+"""
+
+@dataclass
+class CostPrediction:
+    mem_gb: float
+    mem_gb_lo: float
+    mem_gb_hi: float
+    time_s: float
+    time_s_lo: float
+    time_s_hi: float
+
+@dataclass
+class LogLinearFit:
+    coef: np.ndarray
+    # (X^T X + ridge)^-1, for the parameter uncertainty
+    cov_unscaled: np.ndarray
+    sigma: float
+    n: int
+
+    @staticmethod
+    def fit(X: np.ndarray, y: np.ndarray, default_sigma: float = np.log(2)) -> 'LogLinearFit':
+        """
+        :param default_sigma: residual std (in log space) to assume when there are too few samples to estimate it
+        """
+        n, p = X.shape
+        A = X.T @ X + RIDGE * np.eye(p)
+        cov_unscaled = np.linalg.inv(A)
+        coef = cov_unscaled @ X.T @ y
+        rank = np.linalg.matrix_rank(X)
+        dof = n - rank
+        if dof > 0:
+            sigma = float(np.sqrt(np.sum((y - X @ coef)**2) / dof))
+        else:
+            sigma = float(default_sigma)
+        return LogLinearFit(coef, cov_unscaled, sigma, n)
+
+    def predict(self, x: np.ndarray, z: float) -> tuple[float, float, float]:
+        """
+        Return (median, lower, upper) in the original (not log) space
+        """
+        mu = float(x @ self.coef)
+        sd = self.sigma * np.sqrt(1 + float(x @ self.cov_unscaled @ x))
+        return float(np.exp(mu)), float(np.exp(mu - z*sd)), float(np.exp(mu + z*sd))
+
+    def to_dict(self) -> dict:
+        return {'coef': self.coef.tolist(), 'cov_unscaled': self.cov_unscaled.tolist(), 'sigma': self.sigma, 'n': self.n}
+
+    @staticmethod
+    def from_dict(d: dict) -> 'LogLinearFit':
+        return LogLinearFit(np.array(d['coef']), np.array(d['cov_unscaled']), d['sigma'], d['n'])
+
+class CostModel:
+    """
+    Predicts peak memory and runtime of a fastlbp run with confidence bounds.
+    """
+    mem_fit: LogLinearFit
+    time_fit: LogLinearFit
+    confidence: float
+    hostname: str
+
+    def __init__(self, mem_fit: LogLinearFit, time_fit: LogLinearFit, confidence: float = 0.9, hostname: str = None):
+        """
+        :param confidence: two-sided confidence of the predicted [lo, hi] intervals
+        """
+        self.mem_fit = mem_fit
+        self.time_fit = time_fit
+        self.confidence = confidence
+        self.hostname = hostname or socket.gethostname()
+
+    @property
+    def n_samples(self) -> int:
+        return self.time_fit.n
+
+    @staticmethod
+    def fit(records: list[FastlbpBenchplanRecord], confidence: float = 0.9) -> 'CostModel':
+        """
+        Fit on records with result_ok == 'OK' and valid result_mem (MB) and result_time (s)
+        """
+        X, y_mem, y_time = [], [], []
+        for rec in records:
+            mem_mb, time_s = _to_float(rec.result_mem), _to_float(rec.result_time)
+            if rec.result_ok != 'OK' or mem_mb is None or time_s is None:
+                continue
+            X.append(get_record_features(rec))
+            y_mem.append(np.log(mem_mb / 1e3))
+            y_time.append(np.log(time_s))
+        if len(X) == 0:
+            raise ValueError("No successful runs with results to fit a cost model on")
+        X = np.array(X)
+        return CostModel(LogLinearFit.fit(X, np.array(y_mem)), LogLinearFit.fit(X, np.array(y_time)), confidence)
+
+    @staticmethod
+    def fit_csv(*result_csv_files: str, confidence: float = 0.9) -> 'CostModel':
+        """
+        Fit on one or more benchplans filled by parse_fastlbp_results.py
+        """
+        records = []
+        for file in result_csv_files:
+            records += read_fastlbp_benchplan(file).all_runs
+        return CostModel.fit(records, confidence)
+
+    def predict(self, input_shape: tuple[int, int, int], mask_ratio: float, patchsize: int, ncpus: int, nradii: int) -> CostPrediction:
+        x = get_features(input_shape, mask_ratio, patchsize, ncpus, nradii)
+        z = NormalDist().inv_cdf(0.5 + self.confidence/2)
+        mem, mem_lo, mem_hi = self.mem_fit.predict(x, z)
+        time, time_lo, time_hi = self.time_fit.predict(x, z)
+        return CostPrediction(mem, mem_lo, mem_hi, time, time_lo, time_hi)
+
+    def predict_record(self, rec: FastlbpBenchplanRecord) -> CostPrediction:
+        return self.predict(rec.input_shape, rec.mask_ratio, int(rec.patchsize), int(rec.ncpus), int(rec.nradii))
+
+    def save(self, file: str = None):
+        file = file or get_default_model_path()
+        data = {
+            'features': FEATURE_NAMES,
+            'hostname': self.hostname,
+            'fitted_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'confidence': self.confidence,
+            'mem_gb': self.mem_fit.to_dict(),
+            'time_s': self.time_fit.to_dict(),
+        }
+        with open(file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+
+    @staticmethod
+    def load(file: str = None) -> 'CostModel':
+        file = file or get_default_model_path()
+        with open(file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        assert data['features'] == FEATURE_NAMES, f"{file} was fitted with different features: {data['features']}"
+        if data['hostname'] != socket.gethostname():
+            print(f"Warning: cost model {file} was fitted on '{data['hostname']}', not on this machine")
+        return CostModel(LogLinearFit.from_dict(data['mem_gb']), LogLinearFit.from_dict(data['time_s']), data['confidence'], data['hostname'])
+
+class PlanRuntimeEstimator:
+    """
+    Runtime estimator for ParallelScheduler(runtime_estimator=...), fitted on the plan itself:
+    on runs that already have OK results in the plan and on jobs that finished successfully in the current run.
+    Small runs usually finish first, so the limits of the large ones get more reliable as the campaign goes.
+    """
+    records: dict[str, FastlbpBenchplanRecord]
+    min_samples: int
+    # run label -> (features, log runtime) of the successful runs known so far
+    _samples: dict[str, tuple[np.ndarray, float]]
+    # incremented whenever a sample is added or replaced
+    _version: int
+    _fit: LogLinearFit | None
+    _fit_version: int
+    # number of jobs of the (append-only) list of finished jobs already looked at
+    _n_finished_seen: int
+
+    def __init__(self, records: list[FastlbpBenchplanRecord], min_samples: int = 5):
+        """
+        :param records: all runs of the plan, including the ones with results
+        :param min_samples: do not predict anything before this many successful runs are known
+        """
+        self.records = {rec.run_label: rec for rec in records}
+        self.min_samples = min_samples
+        self._samples = {}
+        for rec in self.records.values():
+            time_s = _to_float(rec.result_time)
+            if rec.result_ok == 'OK' and time_s is not None:
+                self._samples[rec.run_label] = (get_record_features(rec), np.log(time_s))
+        self._version = 0
+        self._fit = None
+        self._fit_version = -1
+        self._n_finished_seen = 0
+
+    def _add_finished(self, finished: list['Job']) -> None:
+        """
+        Add the jobs that finished successfully since the last call. A job replaces the plan result of its run
+        """
+        for job in finished[self._n_finished_seen:]:
+            label = job.params.run_label
+            if label in self.records and job.process is not None and job.process.returncode == 0 and job.finished_time is not None:
+                self._samples[label] = (get_record_features(self.records[label]), np.log(job.finished_time - job.start_time))
+                self._version += 1
+        self._n_finished_seen = len(finished)
+
+    def __call__(self, job: 'Job', finished: list['Job']) -> float | None:
+        rec = self.records.get(job.params.run_label)
+        if rec is None:
+            return None
+        return self.predict_record(rec, finished)
+
+    def predict_record(self, rec: FastlbpBenchplanRecord, finished: list['Job'] | None = None) -> float | None:
+        """
+        :param finished: the list of finished jobs of the scheduler. It must only grow between calls
+        """
+        if finished:
+            self._add_finished(finished)
+        if len(self._samples) < self.min_samples:
+            return None
+        if self._fit is None or self._fit_version != self._version:
+            X, y = zip(*self._samples.values())
+            self._fit = LogLinearFit.fit(np.array(X), np.array(y))
+            self._fit_version = self._version
+        time_s, _, _ = self._fit.predict(get_record_features(rec), 0)
+        return time_s
+
+"""
+"""
+
+def fit(*result_csv_files: str, outfile: str = None, confidence: float = 0.9):
+    """
+    Fit a cost model on result csv files and save it (by default to results_dir/costmodel_{hostname}.json)
+    """
+    model = CostModel.fit_csv(*result_csv_files, confidence=confidence)
+    outfile = outfile or get_default_model_path()
+    model.save(outfile)
+    print(f"Fitted on {model.n_samples} runs. mem sigma {model.mem_fit.sigma:.3f}, time sigma {model.time_fit.sigma:.3f} (log space)")
+    for name, cm, ct in zip(FEATURE_NAMES, model.mem_fit.coef, model.time_fit.coef):
+        print(f"  {name:>18}: mem {cm:+.3f}, time {ct:+.3f}")
+    print(f"Saved to {outfile}")
+
+def predict(benchplan_file: str, model_file: str = None):
+    """
+    Print predictions for every run of a benchplan and the total predicted machine time
+    """
+    model = CostModel.load(model_file)
+    total_cpu_s = 0
+    for rec in read_fastlbp_benchplan(benchplan_file).all_runs:
+        p = model.predict_record(rec)
+        total_cpu_s += p.time_s * int(rec.ncpus)
+        print(f"{rec.run_label}: mem {p.mem_gb:.2f} GB [{p.mem_gb_lo:.2f}, {p.mem_gb_hi:.2f}], time {p.time_s:.1f} s [{p.time_s_lo:.1f}, {p.time_s_hi:.1f}]")
+    print(f"Total: {total_cpu_s/3600:.2f} cpu*hours")
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire({'fit': fit, 'predict': predict})
@@ -0,0 +1,577 @@
+import os
+import zlib
+import hashlib
+import time
+import shutil
+import importlib.util
+import numpy as np
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from _config import config
+from _common import read_json_file, update_json_file
+
+"""
+Materialization of benchplan inputs: random test images and masks.
+
+A plan needs a set of distinct inputs (InputSpec). materialize_inputs generates the missing or broken ones
+in a process pool, starting a generation only if the memory it needs fits into a budget.
+Every file is written to a temporary name and renamed when complete, so an interrupted run leaves no half-written input.
+
+The manifest ({input_dir}/manifest.json) records the kind, shape, size, mtime and sha256 of every generated file.
+A file is reused only if its size matches the manifest; if its mtime changed, the hash is checked too.
+Files from before the manifest existed are adopted if their header and size are consistent, else regenerated.
+File names are the same as those of fastlbp.create_sample_image and the original create_disk_mask.
+Images can also be generated in other containers (INPUT_FORMATS, see read_image) with the same pixels.
+
+Masks are written by write_mask block of rows by block of rows into a memory-mapped npy file, and their coverage
+is counted on the way, so any mask size needs constant memory. Geometries are in MASK_GEOMETRIES:
+a disk (the original create_disk_mask), a ring, a grid of disks, random blobs and a random tissue-like section.
+Random masks are seeded by their file name, so a regenerated mask is the same.
+"""
+
+MANIFEST_NAME = 'manifest.json'
+IMAGE = 'image'
+MASK = 'mask'
+
+DISK = 'disk'
+
+# disks bigger than this do not fit into the image
+MAX_DISK_RATIO = 0.78
+# inner radius of a ring relative to its outer radius
+RING_INNER = 0.5
+# 'disks' is a grid of DISKS_GRID x DISKS_GRID disks
+DISKS_GRID = 3
+BLOB_COUNT = 24
+TISSUE_OCTAVES = 4
+TISSUE_WAVES = 6
+TISSUE_ROUGHNESS = 0.35
+# of the envelope, relative to the image size
+TISSUE_SIGMA = 0.3
+# the threshold of random masks is estimated on this many rows and columns
+FIELD_GRID = 1024
+MASK_BLOCK_BYTES = 2**26
+
+# input image containers, see read_image
+TIFF = 'tiff'
+NPY = 'npy'
+TIFF_STRIPS = 'tiff_strips'
+TIFF_TILED = 'tiff_tiled'
+ZARR = 'zarr'
+INPUT_FORMATS = [TIFF, NPY, TIFF_STRIPS, TIFF_TILED, ZARR]
+# formats that are memory-mapped rather than decoded
+MMAP_FORMATS = [NPY, TIFF_STRIPS]
+TIFF_TILE = 512
+ZARR_CHUNK = 1024
+# formats that need an optional package (see requirements.txt)
+FORMAT_PACKAGES = {ZARR: 'zarr'}
+
+def check_format_available(input_format: str) -> None:
+    """
+    Raise ImportError if the optional package needed to write and read `input_format` is not installed
+    """
+    package = FORMAT_PACKAGES.get(input_format)
+    if package is not None and importlib.util.find_spec(package) is None:
+        raise ImportError(f"input format '{input_format}' needs the optional package {package}: pip install {package}")
+
+@dataclass(frozen=True)
+class InputSpec:
+    """
+    A generated input: a white noise image of `shape` (h, w, c), or a mask of `shape` (h, w) covering `mask_ratio` of it.
+    See MASK_GEOMETRIES for the shapes of masks and INPUT_FORMATS for the containers of images
+    """
+    kind: str
+    shape: tuple[int, ...]
+    mask_ratio: float | None = None
+    mask_geometry: str | None = None
+    input_format: str | None = None
+
+    def get_name(self) -> str:
+        if self.kind == IMAGE:
+            h, w, c = self.shape
+            mode = 'L' if c == 1 else 'RGB'
+            name = f"img_{mode}_{h}x{w}"
+            return {
+                TIFF: f"{name}.tiff",
+                NPY: f"{name}.npy",
+                TIFF_STRIPS: f"{name}_strips.tiff",
+                TIFF_TILED: f"{name}_tiled.tiff",
+                ZARR: f"{name}.zarr",
+            }[self.input_format]
+        geometry = "" if self.mask_geometry == DISK else f"_{self.mask_geometry}"
+        return "x".join(map(str, self.shape)) + f"_{self.mask_ratio:.3f}{geometry}.npy"
+
+    def get_path(self, input_dir: str) -> str:
+        return os.path.abspath(os.path.join(input_dir, self.get_name()))
+
+    def get_mem_gb(self) -> float:
+        """
+        Peak memory needed to generate it
+        """
+        npixels = int(np.prod(self.shape))
+        if self.kind == IMAGE:
+            # the image and the copy of PIL
+            return 2 * npixels / 1e9
+        # temporaries of one block of rows, see write_mask
+        return 4 * MASK_BLOCK_BYTES / 1e9
+
+def image_spec(input_shape, input_format: str = TIFF) -> InputSpec:
+    assert int(input_shape[2]) in [1, 3], "only 1 and 3 channel images can be generated"
+    assert input_format in INPUT_FORMATS, f"unknown input format {input_format}, one of {INPUT_FORMATS}"
+    return InputSpec(IMAGE, tuple(int(v) for v in input_shape), input_format=input_format)
+
+def mask_spec(input_shape, mask_ratio, mask_geometry: str = DISK) -> InputSpec | None:
+    """
+    None if there is no mask (mask_ratio is None or 0), see create_disk_mask
+    """
+    if mask_ratio is None or mask_ratio == 0:
+        return None
+    assert mask_geometry in MASK_GEOMETRIES, f"unknown mask geometry {mask_geometry}, one of {list(MASK_GEOMETRIES)}"
+    return InputSpec(MASK, tuple(int(v) for v in input_shape[:2]), round(float(mask_ratio), 3), mask_geometry)
+
+"""
+"""
+
+class _MaskGeometry(ABC):
+    """
+    Mask of `shape` (h, w) covering `area` of it, computed for a block of rows at a time
+    """
+    def __init__(self, shape: tuple[int, int], area: float, rng: np.random.Generator):
+        self.h, self.w = shape
+        self.npixels = self.h * self.w
+        self.area = area
+
+    @abstractmethod
+    def rows(self, i0: int, i1: int) -> np.ndarray:
+        ...
+
+class _Disk(_MaskGeometry):
+    """
+    A disk in the center, the original create_disk_mask
+    """
+    def __init__(self, shape, area, rng):
+        super().__init__(shape, area, rng)
+        if area > MAX_DISK_RATIO:
+            raise ValueError("Sorry, create_disk_mask only supports disks that fit into the image, i.e. mask_ratio < pi/4 ~ 0.78")
+        self.center = (int(self.h/2), int(self.w/2))
+        self.axj = np.arange(self.w) - self.center[1]
+        # n_mask_pixels = pi*r2
+        # area_ratio = pi*r2 / npixels
+        # r2 = npixels * area_ratio / pi
+        self.r2 = float(self.npixels * area) / np.pi
+
+    def rows(self, i0, i1):
+        ii = np.arange(i0, i1)[:, None] - self.center[0]
+        return (ii*ii + self.axj[None, :]*self.axj[None, :]) < self.r2
+
+class _Ring(_MaskGeometry):
+    """
+    A ring in the center, its inner radius is RING_INNER of the outer one
+    """
+    def __init__(self, shape, area, rng):
+        super().__init__(shape, area, rng)
+        self.r2 = float(self.npixels * area) / (np.pi * (1 - RING_INNER**2))
+        if np.sqrt(self.r2) > min(self.h, self.w) / 2:
+            raise ValueError(f"a ring of {area} does not fit into {shape}")
+        self.inner_r2 = self.r2 * RING_INNER**2
+        self.axj = np.arange(self.w) - self.w/2
+
+    def rows(self, i0, i1):
+        ii = np.arange(i0, i1)[:, None] - self.h/2
+        d2 = ii*ii + self.axj[None, :]*self.axj[None, :]
+        return (d2 < self.r2) & (d2 >= self.inner_r2)
+
+class _Disks(_MaskGeometry):
+    """
+    DISKS_GRID x DISKS_GRID equal disks, each in the center of its cell
+    """
+    def __init__(self, shape, area, rng):
+        super().__init__(shape, area, rng)
+        n = DISKS_GRID
+        self.r2 = float(self.npixels * area) / (np.pi * n * n)
+        if np.sqrt(self.r2) > min(self.h, self.w) / (2 * n):
+            raise ValueError(f"{n*n} disks of {area} do not fit into {shape}")
+        j = np.arange(self.w)
+        self.dj = j - (np.floor(j * n / self.w) + 0.5) * self.w / n
+
+    def rows(self, i0, i1):
+        n = DISKS_GRID
+        i = np.arange(i0, i1)
+        di = (i - (np.floor(i * n / self.h) + 0.5) * self.h / n)[:, None]
+        return (di*di + self.dj[None, :]*self.dj[None, :]) < self.r2
+
+class _Field(_MaskGeometry):
+    """
+    A smooth random field, thresholded at the quantile that gives `area`.
+    The field is a low-rank product f(i, j) = R[i] @ C[:, j], so that any block of rows is a single matrix product.
+    The threshold is estimated on a grid of at most FIELD_GRID x FIELD_GRID evenly spaced pixels
+    """
+    def __init__(self, shape, area, rng):
+        super().__init__(shape, area, rng)
+        self.state = rng.bit_generator.state
+        self.C = self.get_factors(np.arange(self.w), self.w, self.state, 'j').T
+        gi = np.unique(np.linspace(0, self.h - 1, min(self.h, FIELD_GRID)).astype(np.int64))
+        gj = np.unique(np.linspace(0, self.w - 1, min(self.w, FIELD_GRID)).astype(np.int64))
+        grid = self.get_factors(gi, self.h, self.state, 'i') @ self.C[:, gj]
+        self.threshold = np.quantile(grid, 1 - area)
+
+    @abstractmethod
+    def get_factors(self, x: np.ndarray, n: int, state: dict, axis: str) -> np.ndarray:
+        """
+        R (axis 'i') or C.T (axis 'j') for coordinates `x` along an axis of length `n`.
+        The parameters are drawn from a generator with `state`, so that all calls agree
+        """
+        ...
+
+    def rows(self, i0, i1):
+        return (self.get_factors(np.arange(i0, i1), self.h, self.state, 'i') @ self.C) > self.threshold
+
+class _Blobs(_Field):
+    """
+    BLOB_COUNT random gaussian bumps, i.e. blobs of random sizes that merge into irregular shapes
+    """
+    def get_factors(self, x, n, state, axis):
+        rng = np.random.default_rng()
+        rng.bit_generator.state = state
+        centers = rng.random((BLOB_COUNT, 2))
+        sigmas = rng.uniform(0.03, 0.1, BLOB_COUNT) * min(self.h, self.w)
+        weights = rng.uniform(0.5, 1, BLOB_COUNT)
+        c = centers[:, 0 if axis == 'i' else 1] * n
+        f = np.exp(-(x[:, None] - c[None, :])**2 / (2 * sigmas[None, :]**2))
+        return (f * weights[None, :] if axis == 'j' else f).astype(np.float32)
+
+class _Tissue(_Field):
+    """
+    A section-like region: a large elliptic envelope with a wavy border and holes,
+    envelope(i, j) * (1 + TISSUE_ROUGHNESS * noise(i, j)), noise being a sum of plane waves of TISSUE_OCTAVES octaves
+    """
+    def get_factors(self, x, n, state, axis):
+        rng = np.random.default_rng()
+        rng.bit_generator.state = state
+        center = rng.uniform(0.4, 0.6, 2)
+        octaves = np.repeat(np.arange(TISSUE_OCTAVES), TISSUE_WAVES)
+        # 2, 4, 8... periods per image, in random directions
+        freq = 2.0**(octaves + 1) * rng.uniform(0.75, 1.5, octaves.size)
+        angle = rng.uniform(0, 2*np.pi, octaves.size)
+        phase = rng.uniform(0, 2*np.pi, octaves.size)
+        amp = 0.5**octaves
+        amp = amp / np.sqrt((amp**2).sum() / 2)
+        if axis == 'i':
+            center = center[0]
+            omega = 2*np.pi * freq * np.cos(angle) / self.h
+        else:
+            center = center[1]
+            omega = 2*np.pi * freq * np.sin(angle) / self.w
+        envelope = np.exp(-((x / n - center) / TISSUE_SIGMA)**2 / 2)[:, None]
+        wave = omega[None, :] * x[:, None]
+        if axis == 'i':
+            # cos(a + b + phase) = cos(a) cos(b + phase) - sin(a) sin(b + phase)
+            f = np.hstack([np.ones((x.size, 1)), np.cos(wave), -np.sin(wave)])
+        else:
+            wave = wave + phase[None, :]
+            r = TISSUE_ROUGHNESS * amp[None, :]
+            f = np.hstack([np.ones((x.size, 1)), r * np.cos(wave), r * np.sin(wave)])
+        return (envelope * f).astype(np.float32)
+
+MASK_GEOMETRIES = {
+    DISK: _Disk,
+    'ring': _Ring,
+    'disks': _Disks,
+    'blobs': _Blobs,
+    'tissue': _Tissue,
+}
+
+def write_mask(spec: InputSpec, path: str) -> float:
+    """
+    Write the mask of `spec` into an npy file block of rows by block of rows, through a memory map of one block at a time,
+    so that masks of any size need constant memory. Return the coverage ratio
+    """
+    h, w = spec.shape
+    area = spec.mask_ratio
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(h, w))
+    offset = out.offset
+    del out
+    if area > 0.99:
+        geometry = None
+    else:
+        rng = np.random.default_rng(zlib.crc32(spec.get_name().encode()))
+        geometry = MASK_GEOMETRIES[spec.mask_geometry]((h, w), area, rng)
+    # keep the temporaries of a block (float64 or int64) around MASK_BLOCK_BYTES
+    block = max(1, MASK_BLOCK_BYTES // (8 * max(w, 1)))
+    ones = 0
+    for i in range(0, h, block):
+        i1 = min(h, i + block)
+        rows = np.memmap(path, np.uint8, 'r+', offset=offset + i * w, shape=(i1 - i, w))
+        if geometry is None:
+            rows[:] = 1
+        else:
+            rows[:] = geometry.rows(i, i1)
+        ones += int(np.count_nonzero(rows))
+        rows.flush()
+        del rows
+    coverage = ones / max(h * w, 1)
+    assert np.abs(coverage - area) < 0.01, f"{spec.mask_geometry} mask {spec.shape} covers {coverage:.4f} instead of {area}"
+    return coverage
+
+def make_noise_image(shape: tuple[int, int, int]) -> np.ndarray:
+    """
+    Seeded by the shape, so that images of all formats have the same pixels
+    """
+    h, w, c = shape
+    rng = np.random.default_rng([h, w, c])
+    return rng.integers(0, 256, size=(h, w) if c == 1 else (h, w, c), dtype=np.uint8)
+
+def write_image(spec: InputSpec, path: str) -> None:
+    data = make_noise_image(spec.shape)
+    if spec.input_format == TIFF:
+        from PIL import Image
+        Image.fromarray(data, 'L' if spec.shape[2] == 1 else 'RGB').save(path, format='TIFF')
+    elif spec.input_format == NPY:
+        with open(path, 'wb') as f:
+            np.save(f, data)
+    elif spec.input_format in [TIFF_STRIPS, TIFF_TILED]:
+        import tifffile
+        # uncompressed and contiguous, so that tifffile.memmap can map the strips
+        tile = (TIFF_TILE, TIFF_TILE) if spec.input_format == TIFF_TILED else None
+        tifffile.imwrite(path, data, tile=tile, photometric='minisblack' if spec.shape[2] == 1 else 'rgb')
+    elif spec.input_format == ZARR:
+        # an optional dependency, only needed for this format
+        import zarr
+        z = zarr.open(path, mode='w', shape=data.shape, dtype=data.dtype, chunks=(ZARR_CHUNK, ZARR_CHUNK) + data.shape[2:])
+        z[:] = data
+
+def read_image(path: str, input_format: str = TIFF) -> np.ndarray:
+    """
+    Open an input image as fastlbp.run_fastlbp takes it.
+
+    - tiff: decoded by skimage.io.imread into a new array, the original behaviour
+    - npy: np.load with mmap_mode='r', pages are read on first access
+    - tiff_strips: an uncompressed, contiguous TIFF, memory-mapped by tifffile.memmap
+    - tiff_tiled: a tiled TIFF, decoded tile by tile by tifffile.imread (tiles are not contiguous, so they cannot be mapped)
+    - zarr: a chunked zarr array, decoded chunk by chunk into a new array
+    """
+    if input_format == TIFF:
+        from skimage.io import imread
+        return imread(path)
+    if input_format == NPY:
+        return np.load(path, mmap_mode='r')
+    if input_format == TIFF_STRIPS:
+        import tifffile
+        return tifffile.memmap(path, mode='r')
+    if input_format == TIFF_TILED:
+        import tifffile
+        return tifffile.imread(path)
+    if input_format == ZARR:
+        import zarr
+        return zarr.open(path, mode='r')[:]
+    raise ValueError(f"unknown input format {input_format}, one of {INPUT_FORMATS}")
+
+def read_mask(path: str, input_format: str = TIFF) -> np.ndarray:
+    """
+    Masks are memory-mapped too if the image is
+    """
+    return np.load(path, mmap_mode='r' if input_format in MMAP_FORMATS else None)
+
+def _list_files(path: str) -> list[str]:
+    """
+    The file itself, or all files of a directory input (zarr) in a stable order
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+
+def _stat(path: str) -> tuple[int, int]:
+    """
+    Total size and last mtime_ns of a file or of a directory input
+    """
+    stats = [os.stat(f) for f in _list_files(path)]
+    return sum(st.st_size for st in stats), max((st.st_mtime_ns for st in stats), default=0)
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def hash_file(path: str) -> str:
+    """
+    sha256 of a file, or of the names and contents of all files of a directory input
+    """
+    h = hashlib.sha256()
+    for file in _list_files(path):
+        if file != path:
+            h.update(os.path.relpath(file, path).encode())
+        with open(file, 'rb') as f:
+            while chunk := f.read(8 * 2**20):
+                h.update(chunk)
+    return h.hexdigest()
+
+def generate_input(spec: InputSpec, path: str) -> dict:
+    """
+    Generate an input and write it atomically. Return its manifest entry. Runs in a pool worker
+    """
+    t = time.perf_counter()
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        if spec.kind == IMAGE:
+            write_image(spec, tmp_path)
+        else:
+            write_mask(spec, tmp_path)
+        # a directory cannot replace an existing one
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        _remove(tmp_path)
+    print(f"created {path} in {time.perf_counter()-t:.3f}s")
+    return _get_entry(spec, path)
+
+def _get_entry(spec: InputSpec, path: str) -> dict:
+    size, mtime_ns = _stat(path)
+    return {
+        'kind': spec.kind,
+        'shape': list(spec.shape),
+        'mask_ratio': spec.mask_ratio,
+        'mask_geometry': spec.mask_geometry,
+        'input_format': spec.input_format,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'sha256': hash_file(path),
+    }
+
+def _looks_complete(spec: InputSpec, path: str) -> bool:
+    """
+    Check the header and the size of a file that is not in the manifest
+    """
+    try:
+        if spec.kind == IMAGE:
+            if spec.input_format != TIFF:
+                # only tiff images were generated before the manifest
+                return False
+            from PIL import Image
+            h, w, c = spec.shape
+            with Image.open(path) as img:
+                ok = img.size == (w, h) and img.mode == ('L' if c == 1 else 'RGB')
+            # uncompressed
+            return ok and os.path.getsize(path) >= h * w * c
+        # fails if the data is cut short
+        mask = np.load(path, mmap_mode='r')
+        return mask.shape == spec.shape and mask.dtype == np.uint8
+    except Exception:
+        return False
+
+class Manifest:
+    """
+    {file name: entry} of the generated inputs of a directory
+    """
+    path: str
+    entries: dict[str, dict]
+
+    def __init__(self, input_dir: str):
+        self.path = os.path.join(input_dir, MANIFEST_NAME)
+        self.entries = read_json_file(self.path)
+
+    def add(self, path: str, entry: dict) -> None:
+        name = os.path.basename(path)
+        self.entries[name] = entry
+        # merge, another process may prepare inputs into the same directory
+        update_json_file(self.path, **{name: entry})
+
+    def check(self, spec: InputSpec, path: str, full: bool = False) -> bool:
+        """
+        Is the file at `path` a complete `spec`? Files that are not in the manifest yet are added if they are.
+
+        :param full: always check the hash, not only if the mtime changed
+        """
+        if not os.path.exists(path):
+            return False
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None:
+            if not _looks_complete(spec, path):
+                return False
+            self.add(path, _get_entry(spec, path))
+            return True
+        size, mtime_ns = _stat(path)
+        if size != entry['size']:
+            return False
+        if full or mtime_ns != entry['mtime_ns']:
+            if hash_file(path) != entry['sha256']:
+                return False
+            if mtime_ns != entry['mtime_ns']:
+                self.add(path, {**entry, 'mtime_ns': mtime_ns})
+        return True
+
+def materialize_inputs(specs: list[InputSpec], input_dir: str = None, max_workers: int = None, max_mem_gb: float = None,
+                       full_check: bool = False) -> dict[InputSpec, str]:
+    """
+    Make sure every input exists and is complete. Generate the missing and broken ones in parallel.
+    Return {spec: absolute path}
+
+    :param input_dir: config.input_dir by default
+    :param max_workers: number of generating processes, all cpus by default
+    :param max_mem_gb: start a generation only if the memory of all running ones stays below this (but always run at least one).
+        80% of the available memory by default
+    :param full_check: check the hashes of all existing files, not only of those that were modified
+    """
+    input_dir = input_dir or config.input_dir
+    os.makedirs(input_dir, exist_ok=True)
+    manifest = Manifest(input_dir)
+    paths = {spec: spec.get_path(input_dir) for spec in dict.fromkeys(specs)}
+    todo = [spec for spec, path in paths.items() if not manifest.check(spec, path, full_check)]
+    if not todo:
+        return paths
+
+    if max_mem_gb is None:
+        import psutil
+        max_mem_gb = 0.8 * psutil.virtual_memory().available / 1e9
+    max_workers = max_workers or os.cpu_count() or 1
+    print(f"generating {len(todo)} inputs in {input_dir} with up to {max_workers} processes and {max_mem_gb:.1f} GB")
+
+    if max_workers == 1 or len(todo) == 1:
+        for spec in todo:
+            manifest.add(paths[spec], generate_input(spec, paths[spec]))
+        return paths
+
+    # largest first, small ones fill the remaining memory
+    todo.sort(key=lambda s: s.get_mem_gb(), reverse=True)
+    running = {}
+    with ProcessPoolExecutor(max_workers) as pool:
+        while todo or running:
+            used_gb = sum(s.get_mem_gb() for s in running.values())
+            for spec in list(todo):
+                if len(running) >= max_workers:
+                    break
+                if running and used_gb + spec.get_mem_gb() > max_mem_gb:
+                    continue
+                running[pool.submit(generate_input, spec, paths[spec])] = spec
+                used_gb += spec.get_mem_gb()
+                todo.remove(spec)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                spec = running.pop(future)
+                manifest.add(paths[spec], future.result())
+    return paths
+
+def verify(input_dir: str = None) -> bool:
+    """
+    Check the hashes of all files in the manifest. Print and return whether all of them are fine
+    """
+    input_dir = input_dir or config.input_dir
+    manifest = Manifest(input_dir)
+    ok = True
+    for name, entry in manifest.entries.items():
+        # entries from before mask geometries and input formats are disks and tiffs
+        geometry = entry.get('mask_geometry', DISK if entry['kind'] == MASK else None)
+        input_format = entry.get('input_format', TIFF if entry['kind'] == IMAGE else None)
+        spec = InputSpec(entry['kind'], tuple(entry['shape']), entry['mask_ratio'], geometry, input_format)
+        path = os.path.join(input_dir, name)
+        if not manifest.check(spec, path, full=True):
+            print(f"BROKEN {path}")
+            ok = False
+    print("OK" if ok else "some inputs are broken, prepare the benchplan again to regenerate them")
+    return ok
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire({'verify': verify})
@@ -0,0 +1,110 @@
+import sqlite3
+import time
+
+"""
+Persistent job journal for ParallelScheduler.
+
+Every state change of every job is committed to an SQLite database right away,
+so after a crash or a reboot the scheduler knows which jobs are done
+and which ones were in flight and have to be cleaned up and run again.
+"""
+
+QUEUED = 'queued'
+STARTED = 'started'
+FINISHED = 'finished'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+SKIPPED_DOMINATED = 'skipped_dominated'
+
+def is_done(state: str | None, retry_failed: bool = False) -> bool:
+    """
+    Whether a job in `state` is not run again. Failed (or timed out, or dominated) jobs are run again only with `retry_failed`
+    """
+    return state == FINISHED or (state in [FAILED, TIMEOUT, SKIPPED_DOMINATED] and not retry_failed)
+
+class JobJournal:
+    path: str
+    conn: sqlite3.Connection
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    run_label TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    pid INTEGER,
+                    returncode INTEGER,
+                    start_time REAL,
+                    end_time REAL,
+                    cpus TEXT,
+                    note TEXT,
+                    updated REAL
+                )""")
+
+    def close(self):
+        self.conn.close()
+
+    def _set(self, run_label: str, **fields) -> None:
+        fields['updated'] = time.time()
+        names = list(fields.keys())
+        with self.conn:
+            self.conn.execute(
+                f"INSERT INTO jobs (run_label, {', '.join(names)}) VALUES (?, {', '.join('?' for _ in names)}) "
+                f"ON CONFLICT(run_label) DO UPDATE SET {', '.join(f'{n}=excluded.{n}' for n in names)}",
+                [run_label] + [fields[n] for n in names])
+
+    def get(self, run_label: str) -> dict | None:
+        cur = self.conn.execute("SELECT * FROM jobs WHERE run_label = ?", [run_label])
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cur.description], row))
+
+    def get_state(self, run_label: str) -> str | None:
+        entry = self.get(run_label)
+        return entry['state'] if entry is not None else None
+
+    def get_all(self, state: str = None) -> list[dict]:
+        if state is None:
+            cur = self.conn.execute("SELECT * FROM jobs ORDER BY run_label")
+        else:
+            cur = self.conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY run_label", [state])
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def mark_queued(self, run_label: str, note: str = None) -> None:
+        self._set(run_label, state=QUEUED, pid=None, returncode=None, start_time=None, end_time=None, cpus=None, note=note)
+
+    def mark_started(self, run_label: str, pid: int, cpus: str = None) -> None:
+        self._set(run_label, state=STARTED, pid=pid, returncode=None, start_time=time.time(), end_time=None, cpus=cpus, note=None)
+
+    def mark_done(self, run_label: str, returncode: int, state: str = None, note: str = None) -> None:
+        """
+        :param state: by default FINISHED if returncode is 0, FAILED otherwise
+        """
+        if state is None:
+            state = FINISHED if returncode == 0 else FAILED
+        self._set(run_label, state=state, returncode=returncode, end_time=time.time(), note=note)
+
+"""
+"""
+
+def main(journal_file: str, state: str = None):
+    """
+    Print the content of a job journal
+    """
+    journal = JobJournal(journal_file)
+    entries = journal.get_all(state)
+    for e in entries:
+        duration = f"{e['end_time'] - e['start_time']:.1f}s" if e['end_time'] and e['start_time'] else ''
+        print(f"{e['run_label']}: {e['state']} pid={e['pid']} rc={e['returncode']} {duration} {e['note'] or ''}")
+    counts = {}
+    for e in entries:
+        counts[e['state']] = counts.get(e['state'], 0) + 1
+    print(counts)
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(main)
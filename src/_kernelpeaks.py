@@ -0,0 +1,248 @@
+import os
+import sys
+
+"""
+Peak memory as tracked by the kernel, complementing the sampled memory log.
+
+Samples miss every allocation spike shorter than the poll interval. The kernel does not:
+- VmHWM in /proc/<pid>/status is the peak rss of a process (readable only while it is alive);
+- ru_maxrss of getrusage(RUSAGE_CHILDREN) is the peak rss of the largest waited-for descendant;
+- memory.peak of a cgroup v2 is the peak of all processes of the cgroup together.
+The same rusage also has exact cpu times, context switches, page faults and block i/o of all waited-for descendants.
+"""
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+def read_vm_hwm(pid: int) -> int | None:
+    """
+    Peak rss of a live process in bytes, None if it is gone or not on Linux
+    """
+    try:
+        with open(f'/proc/{pid}/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def get_children_maxrss_bytes() -> int | None:
+    """
+    Peak rss of the largest terminated and waited-for descendant of this process
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def get_children_rusage() -> dict | None:
+    """
+    Cpu times and context switches of all terminated and waited-for descendants of this process
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'cpu_user_s': round(ru.ru_utime, 3),
+        'cpu_system_s': round(ru.ru_stime, 3),
+        'ctx_voluntary': ru.ru_nvcsw,
+        'ctx_involuntary': ru.ru_nivcsw,
+        'minflt': ru.ru_minflt,
+        'majflt': ru.ru_majflt,
+        # in 512-byte blocks
+        'read_bytes': ru.ru_inblock * 512,
+        'write_bytes': ru.ru_oublock * 512,
+    }
+
+VMSTAT_KEYS = ['pswpin', 'pswpout', 'pgmajfault']
+
+def read_vmstat() -> dict[str, int] | None:
+    """
+    System-wide swap-in/out (pages) and major fault counters since boot, None if not on Linux
+    """
+    try:
+        with open('/proc/vmstat', 'rb') as f:
+            lines = f.read().split(b'\n')
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, _, value = line.partition(b' ')
+        if key.decode() in VMSTAT_KEYS:
+            values[key.decode()] = int(value)
+    return values
+
+def get_cgroup2_path(pid: int | str = 'self') -> str | None:
+    """
+    Directory of the cgroup v2 of a process, None if there is no cgroup v2
+    """
+    try:
+        with open(f'/proc/{pid}/cgroup') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith('0::'):
+            rel = line[len('0::'):].lstrip('/')
+            # on hybrid systems the v2 hierarchy is mounted at /sys/fs/cgroup/unified
+            for root in [CGROUP_ROOT, os.path.join(CGROUP_ROOT, 'unified')]:
+                if os.path.exists(os.path.join(root, 'cgroup.controllers')):
+                    path = os.path.join(root, rel)
+                    return path if os.path.isdir(path) else None
+    return None
+
+def _read_int_file(path: str) -> int | None:
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+LEAF_PREFIX = 'multibench_'
+
+def _read_words(path: str) -> list[str] | None:
+    try:
+        with open(path) as f:
+            return f.read().split()
+    except OSError:
+        return None
+
+def _write_file(path: str, value: str) -> None:
+    with open(path, 'w') as f:
+        f.write(value)
+
+def _remove_stale_cgroups(parent: str) -> None:
+    """
+    Remove empty cgroups left in `parent` by processes that are gone
+    """
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for name in names:
+        pid = name[len(LEAF_PREFIX):].split('_')[-1]
+        if name.startswith(LEAF_PREFIX) and pid.isdigit() and not os.path.exists(f'/proc/{pid}'):
+            try:
+                os.rmdir(os.path.join(parent, name))
+            except OSError:
+                pass
+
+def enter_leaf_cgroup() -> tuple[str | None, str | None]:
+    """
+    Make room for job cgroups next to this process.
+
+    cgroup v2 does not let a cgroup have both processes and children with controllers (the no-internal-process rule),
+    so job cgroups are siblings of a leaf cgroup of this process, both under a parent with the memory controller enabled.
+    If this process is alone in a cgroup with the memory controller available (e.g. it was started with
+    `systemd-run --user --scope -p Delegate=yes`), it moves itself into a leaf {LEAF_PREFIX}{pid} and enables the controller for the children.
+    Processes started later inherit the leaf, so calling this in the scheduler is enough for all its profilers.
+
+    Return (the parent for job cgroups, None) or (None, why there is none)
+    """
+    own = get_cgroup2_path()
+    if own is None:
+        return None, "no cgroup v2"
+    own = os.path.normpath(own)
+    if 'memory' in (_read_words(os.path.join(own, 'cgroup.subtree_control')) or []):
+        # the root cgroup, which is exempt from the rule
+        return own, None
+    parent = os.path.dirname(own)
+    if os.path.basename(own).startswith(LEAF_PREFIX) and 'memory' in (_read_words(os.path.join(parent, 'cgroup.subtree_control')) or []):
+        # already in a leaf
+        return parent, None
+    if 'memory' not in (_read_words(os.path.join(own, 'cgroup.controllers')) or []):
+        return None, f"the memory controller is not delegated to {own}"
+    procs = _read_words(os.path.join(own, 'cgroup.procs'))
+    if procs is None or set(procs) != {str(os.getpid())}:
+        return None, f"{own} is shared with other processes, start the scheduler in a cgroup of its own (systemd-run --user --scope -p Delegate=yes)"
+    leaf = os.path.join(own, f'{LEAF_PREFIX}{os.getpid()}')
+    try:
+        os.makedirs(leaf, exist_ok=True)
+        _write_file(os.path.join(leaf, 'cgroup.procs'), str(os.getpid()))
+        _write_file(os.path.join(own, 'cgroup.subtree_control'), '+memory')
+    except OSError as e:
+        return None, f"cannot move into a leaf cgroup in {own}: {e}"
+    return own, None
+
+class JobCgroup:
+    """
+    A cgroup v2 with the profiled process tree only, for memory.peak.
+
+    The cgroup is created before the job starts, as a sibling of the leaf cgroup of the profiler (see enter_leaf_cgroup),
+    and the job moves itself into it between fork and exec (preexec_fn), so that memory.peak covers the whole job.
+    If there is no such cgroup, path is None and reason says why.
+    """
+    path: str | None
+    reason: str | None
+
+    def __init__(self, name: str):
+        """
+        :param name: name of the cgroup, unique among concurrent jobs
+        """
+        self.path = None
+        parent, self.reason = enter_leaf_cgroup()
+        if parent is None:
+            return
+        _remove_stale_cgroups(parent)
+        path = os.path.join(parent, name)
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            self.reason = f"cannot create {path}: {e}"
+            return
+        if not os.path.exists(os.path.join(path, 'memory.peak')):
+            os.rmdir(path)
+            self.reason = "no memory.peak (Linux < 5.19)"
+            return
+        self.path = path
+
+    def wrap_preexec_fn(self, preexec_fn=None):
+        """
+        Popen preexec_fn that moves the child into the cgroup before it runs the job, then calls `preexec_fn`
+        """
+        if self.path is None:
+            return preexec_fn
+        procs_file = os.path.join(self.path, 'cgroup.procs')
+        def enter():
+            try:
+                # '0' is the writing process, i.e. the child
+                _write_file(procs_file, '0')
+            except OSError:
+                # checked by check_job, do not fail the job for a statistic
+                pass
+            if preexec_fn is not None:
+                preexec_fn()
+        return enter
+
+    def check_job(self, pid: int) -> None:
+        """
+        Drop the cgroup if the started job `pid` did not get into it
+        """
+        if self.path is None:
+            return
+        actual = get_cgroup2_path(pid)
+        # None if the job is already gone, then memory.peak tells
+        if actual is not None and os.path.realpath(actual) != os.path.realpath(self.path):
+            self.cleanup()
+            self.path = None
+            self.reason = f"the job could not move into its cgroup, it is in {actual}"
+
+    def get_peak_bytes(self) -> int | None:
+        if self.path is None:
+            return None
+        return _read_int_file(os.path.join(self.path, 'memory.peak'))
+
+    def cleanup(self) -> None:
+        """
+        Remove the cgroup. The job has to be finished.
+        """
+        if self.path is not None:
+            try:
+                os.rmdir(self.path)
+            except OSError:
+                pass
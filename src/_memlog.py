@@ -0,0 +1,378 @@
+import io
+import json
+import os
+import numpy as np
+
+from _common import read_json_file
+
+"""
+Compact binary memory log of the profiler.
+
+File layout:
+    MAGIC (8 bytes) | header length (uint32, little endian) | json header | padding to 8 bytes | records...
+The json header holds the format version and the field names. Records are fixed width
+(see get_record_dtype) and are appended in blocks, so a log can be memory-mapped as one structured array.
+A log cut short by a crash is still readable: an incomplete last record is ignored.
+
+Memory values are stored in KiB (everything /proc reports is a multiple of 1 KiB) as uint32,
+which is enough for 4 TiB per process. Only the virtual size gets uint64.
+
+The 'summary' format keeps no samples at all, only running statistics of the whole process tree
+and a downsampled timeline (see MemSummaryWriter).
+
+Memory of a process tree is aggregated in one of AGGREGATIONS (see get_tree_memory):
+- 'uss': sum of unique memory. Shared pages (an input image shared by workers, pages inherited on fork) are left out;
+- 'rss': sum of resident memory. Shared pages are counted once per process that maps them;
+- 'pss': sum of proportional memory. A page shared by n processes counts 1/n in each, so the sum is exact 
+  if all sharers are in the tree;
+- 'shared_once': sum of unique memory plus the largest shared part (rss - uss) of a single process.
+  Exact if the processes share the same pages (workers sharing the input), a lower bound otherwise.
+"""
+
+MAGIC = b'MBMEMLOG'
+VERSION = 1
+# file extensions of the two log formats. the csv one is the original
+CSV_EXT = '.log'
+BINARY_EXT = '.mlog'
+SUMMARY_EXT = '.msum'
+LOG_FORMATS = ['csv', 'binary', 'summary']
+
+SHARED_ONCE = 'shared_once'
+AGGREGATIONS = ['uss', 'rss', 'pss', SHARED_ONCE]
+
+UNIT = 1024
+# fields that may not fit into uint32 KiB
+WIDE_FIELDS = ['vms']
+
+def get_record_dtype(fields: list[str]) -> np.dtype:
+    """
+    Same columns as the csv log: time, pid, is_parent and the memory fields, in KiB. Packed, 53 bytes with full memory info
+    """
+    return np.dtype([('time', '<f8'), ('pid', '<i4'), ('is_parent', 'u1')] 
+                    + [(name, '<u8' if name in WIDE_FIELDS else '<u4') for name in fields])
+
+def _read_header(f: io.BufferedReader) -> tuple[dict, int]:
+    """
+    Return the header and the offset of the first record
+    """
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} is not a binary memory log")
+    header_len = int(np.frombuffer(f.read(4), '<u4')[0])
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    offset = len(MAGIC) + 4 + header_len
+    offset += -offset % 8
+    return header, offset
+
+class MemLogWriter:
+    """
+    Appends memory samples to a binary log. Samples are collected in a preallocated block
+    and written when the block is full or `flush_interval_s` has passed.
+    """
+    path: str
+    fields: list[str]
+    dtype: np.dtype
+    flush_interval_s: float
+
+    def __init__(self, path: str, fields: list[str], block_size: int = 4096, flush_interval_s: float = 1.0):
+        """
+        :param block_size: number of records in a block
+        :param flush_interval_s: write a block at least this often, so that a killed profiler loses little
+        """
+        self.path = path
+        self.fields = list(fields)
+        self.dtype = get_record_dtype(self.fields)
+        self.flush_interval_s = flush_interval_s
+        self._block = np.zeros(block_size, dtype=self.dtype)
+        self._n = 0
+        self._last_flush_time = 0.0
+        self._f = open(path, 'wb')
+        header = json.dumps({'version': VERSION, 'fields': self.fields, 'unit': UNIT}).encode('utf-8')
+        self._f.write(MAGIC + np.array([len(header)], '<u4').tobytes() + header)
+        self._f.write(b'\0' * (-self._f.tell() % 8))
+
+    def append(self, time: float, pid: int, is_parent: bool, values) -> None:
+        if self._n == len(self._block):
+            self.flush()
+        self._block[self._n] = (time, pid, int(is_parent), *(v // UNIT for v in values))
+        self._n += 1
+
+    def end_tick(self, time: float) -> None:
+        """
+        Call after all samples of a tick are appended
+        """
+        if time - self._last_flush_time >= self.flush_interval_s:
+            self.flush()
+            self._last_flush_time = time
+
+    def flush(self) -> None:
+        self._f.write(self._block[:self._n].tobytes())
+        self._f.flush()
+        self._n = 0
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class CsvLogWriter:
+    """
+    The original text format, with the same interface as MemLogWriter
+    """
+    path: str
+    fields: list[str]
+
+    def __init__(self, path: str, fields: list[str]):
+        self.path = path
+        self.fields = list(fields)
+        self._f = open(path, 'w', encoding='utf-8')
+        self._f.write("time,pid,is_parent," + ','.join(self.fields) + '\n')
+        self._lines = []
+
+    def append(self, time: float, pid: int, is_parent: bool, values) -> None:
+        self._lines.append(f"{time:.3f},{pid},{int(is_parent)}," + ','.join(map(str, values)) + '\n')
+
+    def end_tick(self, time: float) -> None:
+        self._f.write(''.join(self._lines))
+        self._lines.clear()
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self.end_tick(0)
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class MemSummaryWriter:
+    """
+    Streaming aggregation of memory samples in constant memory, with the same interface as MemLogWriter.
+
+    Per tick the fields are summed over the process tree. The writer keeps
+    - the peak of every sum, its time and the number of processes at that time,
+    - the largest single-process value of every field,
+    - a timeline of min/max of the sums in at most `max_buckets` time buckets. 
+      When the buckets run out, neighbours are merged and the bucket width doubles.
+    If uss and rss are logged, 'shared_once' is tracked like a field too (its proc_peak is 0).
+    Peaks are exact at the sampling resolution. The summary is a small json file, 
+    rewritten atomically every `flush_interval_s`.
+    """
+    path: str
+    fields: list[str]
+    max_buckets: int
+    flush_interval_s: float
+
+    def __init__(self, path: str, fields: list[str], max_buckets: int = 512, bucket_s: float = 1.0, flush_interval_s: float = 10.0):
+        """
+        :param max_buckets: timeline length, must be even
+        :param bucket_s: initial timeline resolution in seconds
+        """
+        assert max_buckets % 2 == 0
+        self.path = path
+        self._nin = len(fields)
+        self._shared_once = 'uss' in fields and 'rss' in fields
+        self.fields = list(fields) + ([SHARED_ONCE] if self._shared_once else [])
+        if self._shared_once:
+            self._uss_i, self._rss_i = fields.index('uss'), fields.index('rss')
+        self._tick_shared = 0
+        self.max_buckets = max_buckets
+        self.flush_interval_s = flush_interval_s
+        nf = len(self.fields)
+        self._tick_sum = np.zeros(nf, np.int64)
+        self._tick_nprocs = 0
+        self._peak = np.zeros(nf, np.int64)
+        self._peak_time = np.zeros(nf)
+        self._peak_nprocs = np.zeros(nf, np.int64)
+        self._proc_peak = np.zeros(nf, np.int64)
+        self._nprocs_max = 0
+        self._ticks = 0
+        self._last_time = 0.0
+        self._bucket_s = bucket_s
+        self._tl_min = np.zeros((max_buckets, nf), np.int64)
+        self._tl_max = np.zeros((max_buckets, nf), np.int64)
+        self._tl_nprocs = np.zeros(max_buckets, np.int64)
+        self._tl_ticks = np.zeros(max_buckets, np.int64)
+        self._last_flush_time = 0.0
+
+    def append(self, time: float, pid: int, is_parent: bool, values) -> None:
+        values = np.fromiter(values, np.int64, self._nin)
+        self._tick_sum[:self._nin] += values
+        np.maximum(self._proc_peak[:self._nin], values, out=self._proc_peak[:self._nin])
+        if self._shared_once:
+            self._tick_shared = max(self._tick_shared, values[self._rss_i] - values[self._uss_i])
+        self._tick_nprocs += 1
+
+    def _merge_buckets(self):
+        half = self.max_buckets // 2
+        nf = len(self.fields)
+        ticks = self._tl_ticks.reshape(half, 2)
+        # empty buckets must not win the min
+        tl_min = np.where(self._tl_ticks[:, None] > 0, self._tl_min, np.iinfo(np.int64).max).reshape(half, 2, nf).min(axis=1)
+        self._tl_min[:half] = np.where(ticks.sum(axis=1)[:, None] > 0, tl_min, 0)
+        self._tl_max[:half] = self._tl_max.reshape(half, 2, nf).max(axis=1)
+        self._tl_nprocs[:half] = self._tl_nprocs.reshape(half, 2).max(axis=1)
+        self._tl_ticks[:half] = ticks.sum(axis=1)
+        for a in [self._tl_min, self._tl_max, self._tl_nprocs, self._tl_ticks]:
+            a[half:] = 0
+        self._bucket_s *= 2
+
+    def end_tick(self, time: float) -> None:
+        s = self._tick_sum
+        if self._shared_once:
+            s[-1] = s[self._uss_i] + self._tick_shared
+            self._tick_shared = 0
+        higher = s > self._peak
+        self._peak[higher] = s[higher]
+        self._peak_time[higher] = time
+        self._peak_nprocs[higher] = self._tick_nprocs
+        self._nprocs_max = max(self._nprocs_max, self._tick_nprocs)
+
+        b = int(time // self._bucket_s)
+        while b >= self.max_buckets:
+            self._merge_buckets()
+            b = int(time // self._bucket_s)
+        if self._tl_ticks[b] == 0:
+            self._tl_min[b] = s
+            self._tl_max[b] = s
+        else:
+            np.minimum(self._tl_min[b], s, out=self._tl_min[b])
+            np.maximum(self._tl_max[b], s, out=self._tl_max[b])
+        self._tl_nprocs[b] = max(self._tl_nprocs[b], self._tick_nprocs)
+        self._tl_ticks[b] += 1
+
+        self._ticks += 1
+        self._last_time = time
+        self._tick_sum[:] = 0
+        self._tick_nprocs = 0
+        if time - self._last_flush_time >= self.flush_interval_s:
+            self.flush()
+            self._last_flush_time = time
+
+    def get_summary(self) -> dict:
+        used = np.nonzero(self._tl_ticks)[0]
+        return {
+            'version': VERSION,
+            'fields': self.fields,
+            'ticks': self._ticks,
+            'duration_s': self._last_time,
+            'nprocs_max': self._nprocs_max,
+            'peak': dict(zip(self.fields, self._peak.tolist())),
+            'peak_time_s': dict(zip(self.fields, self._peak_time.tolist())),
+            'peak_nprocs': dict(zip(self.fields, self._peak_nprocs.tolist())),
+            'proc_peak': dict(zip(self.fields, self._proc_peak.tolist())),
+            'timeline': {
+                'bucket_s': self._bucket_s,
+                'start_s': (used * self._bucket_s).tolist(),
+                'ticks': self._tl_ticks[used].tolist(),
+                'nprocs_max': self._tl_nprocs[used].tolist(),
+                'min': {name: self._tl_min[used, i].tolist() for i, name in enumerate(self.fields)},
+                'max': {name: self._tl_max[used, i].tolist() for i, name in enumerate(self.fields)},
+            }
+        }
+
+    def flush(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_summary(), f)
+        os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_log_writer(outfile: str, fields: list[str], log_format: str = 'csv') -> MemLogWriter | CsvLogWriter | MemSummaryWriter:
+    """
+    :param outfile: log path without extension
+    :param log_format: 'csv', 'binary' or 'summary'
+    """
+    path = get_log_path(outfile, log_format)
+    if log_format == 'binary':
+        return MemLogWriter(path, fields)
+    if log_format == 'summary':
+        return MemSummaryWriter(path, fields)
+    return CsvLogWriter(path, fields)
+
+"""
+"""
+
+def load_memlog(path: str) -> np.ndarray:
+    """
+    Memory-map a binary log as a structured array (read-only). Nothing is read until it is accessed.
+    Memory fields are in KiB.
+    """
+    with open(path, 'rb') as f:
+        header, offset = _read_header(f)
+    dtype = get_record_dtype(header['fields'])
+    n = (os.path.getsize(path) - offset) // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n,))
+
+def read_memsummary(path: str) -> dict:
+    """
+    Read a summary written by MemSummaryWriter
+    """
+    return read_json_file(path)
+
+def read_memlog_df(path: str):
+    """
+    Read a csv or binary memory log into a DataFrame with the csv log columns
+    """
+    import pandas as pd
+    if path.endswith(BINARY_EXT):
+        records = load_memlog(path)
+        columns = {name: np.asarray(records[name]) for name in ['time', 'pid', 'is_parent']}
+        for name in records.dtype.names[3:]:
+            columns[name] = records[name].astype(np.int64) * UNIT
+        return pd.DataFrame(columns)
+    return pd.read_csv(path)
+
+def get_tree_memory(mem_df, aggregation: str = 'uss'):
+    """
+    Memory of the whole process tree at every tick of a csv or binary log (a Series indexed by time), in bytes
+
+    :param aggregation: one of AGGREGATIONS, see the module docstring. Or any other logged field, which is summed
+    """
+    by_time = mem_df.groupby('time')
+    if aggregation == SHARED_ONCE:
+        shared = (mem_df['rss'] - mem_df['uss']).clip(lower=0).groupby(mem_df['time']).max()
+        return by_time['uss'].sum() + shared
+    return by_time[aggregation].sum()
+
+def get_log_path(outfile: str, log_format: str) -> str:
+    """
+    :param log_format: 'csv', 'binary' or 'summary'
+    """
+    assert log_format in LOG_FORMATS, log_format
+    return outfile + {'csv': CSV_EXT, 'binary': BINARY_EXT, 'summary': SUMMARY_EXT}[log_format]
+
+def csv_to_binary(csv_file: str, outfile: str = None):
+    """
+    Convert a csv memory log to the binary format (by default next to it, with the .mlog extension)
+    """
+    import pandas as pd
+    df = pd.read_csv(csv_file)
+    outfile = outfile or os.path.splitext(csv_file)[0] + BINARY_EXT
+    fields = [c for c in df.columns if c not in ['time', 'pid', 'is_parent']]
+    with MemLogWriter(outfile, fields) as w:
+        for row in df.itertuples(index=False):
+            w.append(row.time, row.pid, row.is_parent, [getattr(row, name) for name in fields])
+    print(f"{len(df)} records written to {outfile}")
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire({'csv_to_binary': csv_to_binary})
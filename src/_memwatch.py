@@ -0,0 +1,180 @@
+from collections import deque
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import TYPE_CHECKING
+import psutil
+
+if TYPE_CHECKING:
+    from _scheduler import Job
+
+"""
+Measured-memory admission control for ParallelScheduler.
+
+Instead of trusting static `mem_gb` reservations, the monitor samples the live memory
+of every running job tree and projects its peak from the observed growth.
+"""
+
+GB = 1e9
+
+def get_process_tree_mem(pid: int, full: bool = False) -> tuple[int, int, int]:
+    """
+    Return (rss, uss, number of processes) summed over a process and all its children, in bytes.
+    uss is only measured if `full` is True (it is slow), otherwise it is 0.
+    """
+    rss, uss, n = 0, 0, 0
+    try:
+        parent = psutil.Process(pid)
+        procs = [parent] + parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0, 0, 0
+    for p in procs:
+        try:
+            if full:
+                m = p.memory_full_info()
+                uss += m.uss
+            else:
+                m = p.memory_info()
+            rss += m.rss
+            n += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return rss, uss, n
+
+@dataclass
+class JobMemoryTrack:
+    start_time: float
+    # (time, GB) of the last samples
+    samples: deque = field(default_factory=deque)
+    current_gb: float = 0.0
+    peak_gb: float = 0.0
+
+    def slope_gb_per_s(self) -> float:
+        """
+        Least-squares growth rate over the sample window
+        """
+        if len(self.samples) < 2:
+            return 0.0
+        n = len(self.samples)
+        mt = sum(t for t, _ in self.samples) / n
+        mm = sum(m for _, m in self.samples) / n
+        var = sum((t - mt)**2 for t, _ in self.samples)
+        if var == 0:
+            return 0.0
+        return sum((t - mt)*(m - mm) for t, m in self.samples) / var
+
+class MemoryMonitor:
+    """
+    Tracks live memory of running jobs and decides how much memory is still free for new jobs.
+
+    Projected peak of a running job:
+    - during the first `warmup_s` seconds: max(static reservation job.mem_gb, observed peak);
+    - afterwards: max(observed peak, current + growth_rate * horizon_s, reserve_ratio * job.mem_gb),
+        where the extrapolated trend is capped by the static reservation.
+
+    A candidate job (with its static estimate job.mem_gb) is admitted only if
+    sum(projected peaks) + candidate + safety margin fits both into `capacity_gb`
+    and into the memory the OS reports as available minus the expected growth of running jobs.
+
+    When the projection turns out to be wrong, i.e. the system runs out of available memory
+    or measured usage exceeds the capacity, `on_overcommit` decides what happens:
+    - 'pause': no new jobs are admitted until usage goes back below the limits;
+    - 'kill_newest': additionally the most recently started job is killed and put back
+        at the head of the queue with its reservation raised to the peak observed so far.
+    """
+    capacity_gb: float
+    safety_margin_gb: float
+    warmup_s: float
+    horizon_s: float
+    window: int
+    reserve_ratio: float
+    mem_field: str
+    on_overcommit: str
+
+    tracks: dict[int, JobMemoryTrack]
+
+    def __init__(self,
+                 capacity_gb: float,
+                 safety_margin_gb: float = 2.0,
+                 warmup_s: float = 30.0,
+                 horizon_s: float = 60.0,
+                 window: int = 10,
+                 reserve_ratio: float = 0.5,
+                 mem_field: str = 'rss',
+                 on_overcommit: str = 'pause'
+                 ):
+        """
+        :param capacity_gb: memory the scheduler is allowed to use
+        :param safety_margin_gb: always keep this much memory free
+        :param warmup_s: trust the static reservation for this long after a job starts
+        :param horizon_s: extrapolate the current growth rate this far into the future
+        :param window: number of recent samples used to estimate the growth rate
+        :param reserve_ratio: never project less than this fraction of the static reservation
+        :param mem_field: 'rss' (fast, counts shared pages once per process) or 'uss' (slow, ignores shared pages)
+        :param on_overcommit: 'pause' or 'kill_newest'
+        """
+        assert mem_field in ['rss', 'uss'], mem_field
+        assert on_overcommit in ['pause', 'kill_newest'], on_overcommit
+        self.capacity_gb = capacity_gb
+        self.safety_margin_gb = safety_margin_gb
+        self.warmup_s = warmup_s
+        self.horizon_s = horizon_s
+        self.window = window
+        self.reserve_ratio = reserve_ratio
+        self.mem_field = mem_field
+        self.on_overcommit = on_overcommit
+        self.tracks = {}
+
+    def sample(self, jobs: list['Job']) -> None:
+        """
+        Measure all running jobs. Forget jobs that are not in `jobs` anymore.
+        """
+        now = perf_counter()
+        alive = set()
+        for job in jobs:
+            pid = job.process.pid
+            alive.add(pid)
+            track = self.tracks.get(pid)
+            if track is None:
+                track = self.tracks[pid] = JobMemoryTrack(job.start_time, deque(maxlen=self.window))
+            rss, uss, _ = get_process_tree_mem(pid, full=(self.mem_field == 'uss'))
+            mem_gb = (uss if self.mem_field == 'uss' else rss) / GB
+            track.samples.append((now, mem_gb))
+            track.current_gb = mem_gb
+            track.peak_gb = max(track.peak_gb, mem_gb)
+        for pid in list(self.tracks.keys()):
+            if pid not in alive:
+                del self.tracks[pid]
+
+    def get_track(self, job: 'Job') -> JobMemoryTrack | None:
+        return self.tracks.get(job.process.pid)
+
+    def get_projected_peak_gb(self, job: 'Job') -> float:
+        track = self.get_track(job)
+        if track is None:
+            return float(job.mem_gb)
+        if perf_counter() - track.start_time < self.warmup_s:
+            return max(float(job.mem_gb), track.peak_gb)
+        growth = max(track.slope_gb_per_s(), 0.0) * self.horizon_s
+        # extrapolation never goes above the worst case static estimate, unless we have already seen more
+        trend_gb = min(track.current_gb + growth, max(float(job.mem_gb), track.peak_gb))
+        return max(track.peak_gb, trend_gb, self.reserve_ratio * job.mem_gb)
+
+    def get_used_mem_gb(self) -> float:
+        return sum(t.current_gb for t in self.tracks.values())
+
+    def get_free_mem_gb(self, jobs: list['Job']) -> float:
+        """
+        Memory available for new jobs, already reduced by the safety margin
+        """
+        projected = sum(self.get_projected_peak_gb(j) for j in jobs)
+        expected_growth = sum(max(self.get_projected_peak_gb(j) - t.current_gb, 0.0)
+                              for j in jobs if (t := self.get_track(j)) is not None)
+        system_free = psutil.virtual_memory().available / GB - expected_growth
+        return min(self.capacity_gb - projected, system_free) - self.safety_margin_gb
+
+    def is_overcommitted(self) -> bool:
+        """
+        The projection was wrong: the OS is running out of memory or the jobs use more than the capacity
+        """
+        system_free = psutil.virtual_memory().available / GB
+        return system_free < self.safety_margin_gb or self.get_used_mem_gb() > self.capacity_gb
@@ -0,0 +1,123 @@
+from collections import Counter
+from dataclasses import fields
+from typing import TYPE_CHECKING, Callable, Union
+
+if TYPE_CHECKING:
+    from _scheduler import Job
+
+"""
+Queue ordering strategies for the schedulers.
+
+The queue is ordered once, when the scheduler starts. Admission policies then scan it in this order
+('fifo' and 'backfill' respect it, 'smallest_first' and 'best_fit' re-sort it by size).
+
+Orders that need job costs use `cost(job)` if it is given, else Job.est_time_s.
+Jobs without a known cost go last, in plan order.
+"""
+
+class QueueOrder:
+    """
+    Base class. Subclasses override `order`.
+    """
+    name: str = ''
+    cost: Callable[['Job'], float | None] | None
+
+    def __init__(self, cost: Callable[['Job'], float | None] | None = None):
+        """
+        :param cost: predicted cost of a job in any units (seconds, cpu*seconds, a size heuristic...).
+            Only the relative values matter.
+        """
+        self.cost = cost
+
+    def get_cost(self, job: 'Job') -> float | None:
+        if self.cost is not None:
+            return self.cost(job)
+        return job.est_time_s
+
+    def _by_cost(self, jobs: list['Job'], reverse: bool = False) -> list['Job']:
+        """
+        Stable sort by cost, unknown costs last
+        """
+        known = [j for j in jobs if self.get_cost(j) is not None]
+        unknown = [j for j in jobs if self.get_cost(j) is None]
+        return sorted(known, key=self.get_cost, reverse=reverse) + unknown
+
+    def order(self, jobs: list['Job']) -> list['Job']:
+        raise NotImplementedError()
+
+
+class PlanOrder(QueueOrder):
+    """
+    Keep the order the jobs were added in, i.e. the benchplan order. The original scheduler behaviour.
+    """
+    name = 'plan'
+
+    def order(self, jobs):
+        return list(jobs)
+
+
+class ShortestFirstOrder(QueueOrder):
+    """
+    Cheapest predicted jobs first: a partial campaign already has many data points.
+    """
+    name = 'shortest_first'
+
+    def order(self, jobs):
+        return self._by_cost(jobs)
+
+
+class LongestFirstOrder(QueueOrder):
+    """
+    Most expensive predicted jobs first (LPT). Short jobs fill the gaps at the end, which cuts the makespan.
+    """
+    name = 'longest_first'
+
+    def order(self, jobs):
+        return self._by_cost(jobs, reverse=True)
+
+
+class RoundRobinOrder(QueueOrder):
+    """
+    Take jobs from every parameter axis in turn, cheapest first within an axis.
+
+    The axis of a job is the set of its parameters that differ from the most common value
+    of that parameter in the queue, e.g. 'patchsize' for a run of a star-shaped benchplan
+    that only changes the patchsize of the baseline. So after a few jobs every curve has its first points.
+    """
+    name = 'round_robin'
+
+    @staticmethod
+    def get_axes(jobs: list['Job']) -> list[tuple[str, ...]]:
+        names = [f.name for f in fields(jobs[0].params) if f.name != 'run_label']
+        values = {name: [str(getattr(j.params, name)) for j in jobs] for name in names}
+        mode = {name: Counter(v).most_common(1)[0][0] for name, v in values.items()}
+        return [tuple(name for name in names if values[name][i] != mode[name]) for i in range(len(jobs))]
+
+    def order(self, jobs):
+        if not jobs:
+            return []
+        groups: dict[tuple[str, ...], list['Job']] = {}
+        for job, axis in zip(jobs, self.get_axes(jobs)):
+            groups.setdefault(axis, []).append(job)
+        groups = [self._by_cost(g) for g in groups.values()]
+        ordered = []
+        for i in range(max(len(g) for g in groups)):
+            ordered += [g[i] for g in groups if i < len(g)]
+        return ordered
+
+"""
+"""
+
+QUEUE_ORDERS = {
+    cls.name: cls for cls in [PlanOrder, ShortestFirstOrder, LongestFirstOrder, RoundRobinOrder]
+}
+
+def get_queue_order(order: Union[str, QueueOrder], cost: Callable[['Job'], float | None] | None = None) -> QueueOrder:
+    """
+    Get an order instance by its name (one of QUEUE_ORDERS keys) or return `order` if it is an instance already.
+    """
+    if isinstance(order, QueueOrder):
+        return order
+    if order not in QUEUE_ORDERS:
+        raise ValueError(f"Unknown queue order '{order}'. Available: {list(QUEUE_ORDERS.keys())}")
+    return QUEUE_ORDERS[order](cost)
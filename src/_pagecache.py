@@ -0,0 +1,195 @@
+import os
+import time
+import shutil
+import ctypes
+
+"""
+Page-cache state and storage placement of job inputs, prepared by the profiler before the job starts.
+
+Cache modes (the cache_mode axis of a benchplan):
+- none: leave the files as they are, the original behaviour. Timings depend on what ran before;
+- warm: read the files completely, so that the job finds them in the page cache;
+- cold: write back and drop the cached pages of the files (posix_fadvise DONTNEED), so that the job reads them from storage.
+    Pages mapped by another process stay cached, so run cold jobs that share inputs one at a time (sequential scheduler);
+- staged: copy the files into a tmpfs (STAGE_ROOT) and run the job on the copies. The copies take memory until the job ends.
+The share of input pages that are cached right before the job starts (mincore) is recorded to check the result,
+together with the filesystem type of the inputs (e.g. ext4, nfs, tmpfs, fuseblk for a network drive).
+"""
+
+NONE = 'none'
+WARM = 'warm'
+COLD = 'cold'
+STAGED = 'staged'
+CACHE_MODES = [NONE, WARM, COLD, STAGED]
+
+STAGE_ROOT = '/dev/shm'
+STAGE_PREFIX = 'multibench_'
+_READ_CHUNK = 8 * 2**20
+
+def list_files(paths: list[str]) -> list[str]:
+    """
+    Files of `paths`, directory inputs (zarr) are expanded
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+def get_size(paths: list[str]) -> int:
+    return sum(os.path.getsize(f) for f in list_files(paths))
+
+def get_cached_share(paths: list[str]) -> float | None:
+    """
+    Share of the pages of the files that are in the page cache. None if mincore is not available (not Linux)
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+        import mmap
+    except (OSError, AttributeError, ImportError):
+        return None
+    page = os.sysconf('SC_PAGE_SIZE')
+    cached, total = 0, 0
+    for file in list_files(paths):
+        size = os.path.getsize(file)
+        if size == 0:
+            continue
+        npages = (size + page - 1) // page
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            # mapping a file does not read it, and mincore does not fault pages in
+            addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+            if addr is None or addr == ctypes.c_void_p(-1).value:
+                return None
+            try:
+                vec = (ctypes.c_ubyte * npages)()
+                if libc.mincore(addr, size, vec) != 0:
+                    return None
+                # only the lowest bit is defined, it is set for resident pages
+                cached += npages - bytes(vec).count(0)
+            finally:
+                libc.munmap(addr, size)
+        finally:
+            os.close(fd)
+        total += npages
+    return cached / total if total else None
+
+def get_fstype(path: str) -> str | None:
+    """
+    Filesystem type of the mount `path` is on, from /proc/self/mounts. None if unknown
+    """
+    try:
+        with open('/proc/self/mounts', 'r') as f:
+            mounts = [line.split()[:3] for line in f]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    for _, mountpoint, fs in mounts:
+        # spaces in mount points are escaped as \040
+        mountpoint = mountpoint.replace('\\040', ' ')
+        if (path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/')) and len(mountpoint) > len(best):
+            best, fstype = mountpoint, fs
+    return fstype
+
+def warm(paths: list[str]) -> None:
+    buf = bytearray(_READ_CHUNK)
+    for file in list_files(paths):
+        with open(file, 'rb', buffering=0) as f:
+            while f.readinto(buf):
+                pass
+
+def evict(paths: list[str]) -> None:
+    if not hasattr(os, 'posix_fadvise'):
+        raise NotImplementedError("cold cache mode needs posix_fadvise, i.e. Linux")
+    for file in list_files(paths):
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            # dirty pages cannot be dropped
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def stage(paths: list[str], stage_dir: str) -> dict[str, str]:
+    """
+    Copy files and directories into `stage_dir`. Return {original path: copy}
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    staged = {}
+    for path in paths:
+        copy = os.path.join(stage_dir, os.path.basename(path.rstrip('/')))
+        if os.path.isdir(path):
+            shutil.copytree(path, copy, dirs_exist_ok=True)
+        else:
+            shutil.copyfile(path, copy)
+        staged[path] = copy
+    return staged
+
+def get_stage_dir(pid: int) -> str:
+    return os.path.join(STAGE_ROOT, f'{STAGE_PREFIX}{pid}')
+
+def remove_stale_stages() -> list[str]:
+    """
+    Remove the staged copies of profilers that are gone without unstaging (e.g. SIGKILLed). Return the removed directories
+    """
+    try:
+        names = os.listdir(STAGE_ROOT)
+    except OSError:
+        return []
+    removed = []
+    for name in names:
+        pid = name[len(STAGE_PREFIX):]
+        if name.startswith(STAGE_PREFIX) and pid.isdigit() and not os.path.exists(f'/proc/{pid}'):
+            shutil.rmtree(os.path.join(STAGE_ROOT, name), ignore_errors=True)
+            removed.append(os.path.join(STAGE_ROOT, name))
+    return removed
+
+def prepare(paths: list[str], mode: str, stage_dir: str | None = None) -> tuple[dict[str, str], dict]:
+    """
+    Bring the inputs of a job into the page-cache state of `mode`.
+    Return {original path: path to run with} (only staged files are replaced) and stats for the job summary
+
+    :param stage_dir: for staged, a directory in STAGE_ROOT named after this process by default. 
+        The caller removes it after the job (see unstage), remove_stale_stages removes it if the caller could not
+    """
+    assert mode in CACHE_MODES, f"unknown cache mode {mode}, one of {CACHE_MODES}"
+    paths = [p for p in paths if p and os.path.exists(p)]
+    t = time.perf_counter()
+    staged = {}
+    if mode == WARM:
+        warm(paths)
+    elif mode == COLD:
+        evict(paths)
+    elif mode == STAGED:
+        remove_stale_stages()
+        stage_dir = stage_dir or get_stage_dir(os.getpid())
+        staged = stage(paths, stage_dir)
+    run_paths = [staged.get(p, p) for p in paths]
+    stats = {
+        'cache_mode': mode,
+        'cache_prepare_s': round(time.perf_counter() - t, 3),
+        'input_bytes': get_size(run_paths),
+        'input_cached_share': get_cached_share(run_paths),
+        # of the original inputs, staged copies are on tmpfs
+        'input_fstype': get_fstype(paths[0]) if paths else None,
+    }
+    if stats['input_cached_share'] is not None:
+        stats['input_cached_share'] = round(stats['input_cached_share'], 4)
+    return staged, stats
+
+def unstage(staged: dict[str, str]) -> None:
+    for copy in staged.values():
+        if os.path.isdir(copy):
+            shutil.rmtree(copy, ignore_errors=True)
+        elif os.path.exists(copy):
+            os.remove(copy)
+    for stage_dir in {os.path.dirname(copy) for copy in staged.values()}:
+        if os.path.isdir(stage_dir) and not os.listdir(stage_dir):
+            os.rmdir(stage_dir)
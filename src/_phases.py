@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import contextlib
+
+"""
+Phase markers of a job, to split its runtime and memory into e.g. reading input, compute and saving.
+
+The profiler puts a file path into the MULTIBENCH_PHASE_FILE environment variable of the job.
+The job appends a json line to that file at the start and at the end of each phase, with a time.monotonic() timestamp.
+The profiler stores its own time.monotonic() at the start of the memory log (t0_monotonic in its json summary),
+so the markers can be aligned with the memory timeline.
+Without the variable (the job is not profiled) markers are not written.
+"""
+
+PHASE_FILE_ENV = 'MULTIBENCH_PHASE_FILE'
+PHASE_EXT = '.phases'
+
+def mark(phase: str, event: str, t: float | None = None) -> None:
+    """
+    Write a single marker.
+
+    :param event: 'start' or 'end'
+    :param t: time.monotonic() of the event, now by default
+    """
+    path = os.environ.get(PHASE_FILE_ENV)
+    if not path:
+        return
+    line = json.dumps({'phase': phase, 'event': event, 't': time.monotonic() if t is None else t})
+    # one short write per line in append mode, so lines of concurrent writers do not interleave
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+@contextlib.contextmanager
+def phase(name: str):
+    """
+    Mark the code in the `with` block as phase `name`
+    """
+    mark(name, 'start')
+    try:
+        yield
+    finally:
+        mark(name, 'end')
+
+def read_phases(path: str, t0_monotonic: float = 0.0) -> list[dict]:
+    """
+    Read phase markers into [{'phase', 'start_s', 'end_s'}] in the order the phases started.
+    Times are relative to `t0_monotonic`, i.e. the memory log time if it is the one the profiler recorded.
+    A phase without an end marker (the job was killed) has end_s None.
+    """
+    if not os.path.isfile(path):
+        return []
+    phases = []
+    open_phases = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                m = json.loads(line)
+            except json.JSONDecodeError:
+                # a job killed in the middle of a write
+                continue
+            t = m['t'] - t0_monotonic
+            if m['event'] == 'start':
+                open_phases[m['phase']] = len(phases)
+                phases.append({'phase': m['phase'], 'start_s': t, 'end_s': None})
+            elif m['phase'] in open_phases:
+                phases[open_phases.pop(m['phase'])]['end_s'] = t
+    return phases
@@ -0,0 +1,337 @@
+import os
+import re
+import time
+
+"""
+Low-overhead memory sampler of a process tree, reading Linux /proc directly.
+
+Compared to psutil it
+- keeps /proc/<pid>/statm, status and smaps_rollup open and re-reads them with pread into a preallocated buffer;
+- does not rediscover the process tree on every tick, only every `refresh_interval_s`
+  or when a known process exits.
+It reports the same fields as psutil's memory_info() and memory_full_info() on Linux, in bytes.
+It also keeps the last VmHWM (kernel-tracked peak rss) of every process it has seen,
+and feeds cpu times, threads, context switches and run-queue wait into a TreeCpuStats,
+storage i/o, page faults and block i/o delay into a TreeIoStats.
+"""
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# same names and order as psutil on Linux
+FAST_FIELDS = ['rss', 'vms', 'shared', 'text', 'lib', 'data', 'dirty']
+FULL_FIELDS = FAST_FIELDS + ['uss', 'pss', 'swap']
+
+SMAPS_ROLLUP_RE = re.compile(rb'^(Pss|Private_Clean|Private_Dirty|Private_Hugetlb|Swap):\s+(\d+) kB', re.MULTILINE)
+VM_HWM_RE = re.compile(rb'^VmHWM:\s+(\d+) kB', re.MULTILINE)
+CTXT_RE = re.compile(rb'^(voluntary_ctxt_switches|nonvoluntary_ctxt_switches):\s+(\d+)', re.MULTILINE)
+IO_RE = re.compile(rb'^(read_bytes|write_bytes):\s+(\d+)', re.MULTILINE)
+
+def read_schedstat(pid: int) -> float | None:
+    """
+    Time the process has spent waiting on a run queue, in seconds. None if not available
+    """
+    try:
+        with open(f'/proc/{pid}/schedstat', 'rb') as f:
+            return int(f.read().split()[1]) / 1e9
+    except (OSError, ValueError, IndexError):
+        return None
+
+class TreeCpuStats:
+    """
+    CPU accounting of a process tree from per-process cumulative counters.
+    The last values seen for every process are kept, so processes that have exited still count.
+    """
+    # pid -> (user s, system s, voluntary ctx switches, involuntary ctx switches, run-queue wait s)
+    last: dict[int, tuple[float, float, int, int, float]]
+    threads_max: int
+    cores_busy_max: float
+
+    def __init__(self):
+        self.last = {}
+        self.threads_max = 0
+        self.cores_busy_max = 0.0
+        self._tick_threads = 0
+        self._prev = None
+
+    def update(self, pid: int, user_s: float, system_s: float, threads: int, ctx_vol: int, ctx_invol: int, run_wait_s: float | None):
+        self.last[pid] = (user_s, system_s, ctx_vol, ctx_invol, run_wait_s or 0.0)
+        self._tick_threads += threads
+
+    def get_cpu_s(self) -> float:
+        return sum(v[0] + v[1] for v in self.last.values())
+
+    def end_tick(self, time: float) -> None:
+        cpu_s = self.get_cpu_s()
+        if self._prev is not None and time > self._prev[0]:
+            self.cores_busy_max = max(self.cores_busy_max, (cpu_s - self._prev[1]) / (time - self._prev[0]))
+        self._prev = (time, cpu_s)
+        self.threads_max = max(self.threads_max, self._tick_threads)
+        self._tick_threads = 0
+
+    def get_stats(self) -> dict:
+        values = list(self.last.values())
+        return {
+            'sampled_cpu_user_s': round(sum(v[0] for v in values), 3),
+            'sampled_cpu_system_s': round(sum(v[1] for v in values), 3),
+            'sampled_ctx_voluntary': sum(v[2] for v in values),
+            'sampled_ctx_involuntary': sum(v[3] for v in values),
+            'run_wait_s': round(sum(v[4] for v in values), 3),
+            'threads_max': self.threads_max,
+            'cores_busy_max': round(self.cores_busy_max, 3),
+        }
+
+def _parse_io(buf, n: int) -> tuple[int, int]:
+    io = {k: int(v) for k, v in IO_RE.findall(buf, 0, n)}
+    return io.get(b'read_bytes', 0), io.get(b'write_bytes', 0)
+
+def read_io_and_faults(pid: int) -> tuple[int, int, int, int, float] | None:
+    """
+    (storage read bytes, storage write bytes, minor faults, major faults, block i/o delay s) of a live process.
+    None if not available. I/O is zero if /proc/<pid>/io is not readable
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    stat = stat[stat.rfind(b')')+2:].split()
+    read_bytes, write_bytes = 0, 0
+    try:
+        with open(f'/proc/{pid}/io', 'rb') as f:
+            buf = f.read()
+        read_bytes, write_bytes = _parse_io(buf, len(buf))
+    except OSError:
+        pass
+    return read_bytes, write_bytes, int(stat[7]), int(stat[9]), int(stat[39]) / CLK_TCK
+
+class TreeIoStats:
+    """
+    Storage i/o and page faults of a process tree from per-process cumulative counters, like TreeCpuStats.
+    read_bytes and write_bytes count what actually went to the storage, not page cache hits.
+    Block i/o delay needs delay accounting in the kernel (the `delayacct` boot option or sysctl kernel.task_delayacct), else it is zero.
+    """
+    # pid -> (read bytes, write bytes, minor faults, major faults, block i/o delay s)
+    last: dict[int, tuple[int, int, int, int, float]]
+
+    def __init__(self):
+        self.last = {}
+
+    def update(self, pid: int, read_bytes: int, write_bytes: int, minflt: int, majflt: int, blkio_delay_s: float):
+        self.last[pid] = (read_bytes, write_bytes, minflt, majflt, blkio_delay_s)
+
+    def get_stats(self) -> dict:
+        values = list(self.last.values())
+        return {
+            'sampled_read_bytes': sum(v[0] for v in values),
+            'sampled_write_bytes': sum(v[1] for v in values),
+            'sampled_minflt': sum(v[2] for v in values),
+            'sampled_majflt': sum(v[3] for v in values),
+            'blkio_delay_s': round(sum(v[4] for v in values), 3),
+        }
+
+def is_available() -> bool:
+    return os.path.exists('/proc/self/statm') and hasattr(os, 'preadv')
+
+def _has_children_files() -> bool:
+    # needs CONFIG_PROC_CHILDREN
+    return os.path.exists(f'/proc/self/task/{os.getpid()}/children')
+
+class _ProcFiles:
+    """
+    Open /proc files of one process
+    """
+    pid: int
+    statm_fd: int
+    status_fd: int
+    stat_fd: int
+    schedstat_fd: int | None
+    io_fd: int | None
+    smaps_fd: int | None
+
+    def __init__(self, pid: int, full: bool):
+        self.pid = pid
+        self.statm_fd = os.open(f'/proc/{pid}/statm', os.O_RDONLY)
+        self.status_fd = None
+        self.stat_fd = None
+        self.schedstat_fd = None
+        self.io_fd = None
+        self.smaps_fd = None
+        try:
+            self.status_fd = os.open(f'/proc/{pid}/status', os.O_RDONLY)
+            self.stat_fd = os.open(f'/proc/{pid}/stat', os.O_RDONLY)
+            if os.path.exists(f'/proc/{pid}/schedstat'):
+                self.schedstat_fd = os.open(f'/proc/{pid}/schedstat', os.O_RDONLY)
+            try:
+                self.io_fd = os.open(f'/proc/{pid}/io', os.O_RDONLY)
+            except PermissionError:
+                # needs ptrace access to the process
+                pass
+            if full:
+                self.smaps_fd = os.open(f'/proc/{pid}/smaps_rollup', os.O_RDONLY)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        for fd in [self.statm_fd, self.status_fd, self.stat_fd, self.schedstat_fd, self.io_fd, self.smaps_fd]:
+            if fd is not None:
+                os.close(fd)
+
+class ProcTreeSampler:
+    """
+    Samples memory of a process and all its descendants.
+    """
+    root_pid: int
+    full: bool
+    refresh_interval_s: float
+    fields: list[str]
+    # pid -> last seen VmHWM (peak rss) in bytes, also of processes that are gone
+    hwm: dict[int, int]
+    cpu: TreeCpuStats
+    io: TreeIoStats
+
+    def __init__(self, root_pid: int, full: bool = False, refresh_interval_s: float = 0.5):
+        """
+        :param full: also read uss, pss and swap from smaps_rollup (slower, but still much faster than psutil)
+        :param refresh_interval_s: rediscover the process tree at most this often, unless a process exits
+        """
+        self.root_pid = root_pid
+        self.full = full
+        self.refresh_interval_s = refresh_interval_s
+        self.fields = FULL_FIELDS if full else FAST_FIELDS
+        self._files: dict[int, _ProcFiles] = {}
+        self._buf = bytearray(4096)
+        self._last_refresh = -float('inf')
+        self._need_refresh = True
+        self._use_children_files = _has_children_files()
+        self.hwm = {}
+        self.cpu = TreeCpuStats()
+        self.io = TreeIoStats()
+
+    def close(self):
+        for files in self._files.values():
+            files.close()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_children(self, pid: int) -> list[int]:
+        children = []
+        try:
+            for tid in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{tid}/children', 'rb') as f:
+                    children += [int(c) for c in f.read().split()]
+        except OSError:
+            pass
+        return children
+
+    def _get_descendants_by_scan(self) -> list[int]:
+        # without CONFIG_PROC_CHILDREN: read the parent of every process on the system
+        parents = {}
+        for entry in os.scandir('/proc'):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry.name}/stat', 'rb') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # comm may contain spaces and parentheses, fields after it are well-defined
+            ppid = int(stat[stat.rfind(b')')+2:].split(b' ', 2)[1])
+            parents.setdefault(ppid, []).append(int(entry.name))
+        descendants = []
+        stack = [self.root_pid]
+        while stack:
+            children = parents.get(stack.pop(), [])
+            descendants += children
+            stack += children
+        return descendants
+
+    def _get_descendants(self) -> list[int]:
+        if not self._use_children_files:
+            return self._get_descendants_by_scan()
+        descendants = []
+        stack = [self.root_pid]
+        while stack:
+            children = self._get_children(stack.pop())
+            descendants += children
+            stack += children
+        return descendants
+
+    def _refresh(self) -> None:
+        pids = [self.root_pid] + self._get_descendants()
+        # tracked processes that are no longer descendants were reparented when their parent exited.
+        # keep sampling them until they exit themselves (see sample)
+        for pid in pids:
+            if pid not in self._files:
+                try:
+                    self._files[pid] = _ProcFiles(pid, self.full)
+                except OSError:
+                    # already gone
+                    pass
+        self._last_refresh = time.perf_counter()
+        self._need_refresh = False
+
+    def _read(self, fd: int) -> int:
+        return os.preadv(fd, [self._buf], 0)
+
+    def _sample_one(self, files: _ProcFiles) -> list[int]:
+        n = self._read(files.statm_fd)
+        if n == 0:
+            raise ProcessLookupError()
+        size, resident, shared, text, lib, data, dirty = map(int, self._buf[:n].split())
+        values = [resident*PAGE_SIZE, size*PAGE_SIZE, shared*PAGE_SIZE, text*PAGE_SIZE, lib*PAGE_SIZE, data*PAGE_SIZE, dirty*PAGE_SIZE]
+        if files.smaps_fd is not None:
+            n = self._read(files.smaps_fd)
+            kb = {'Pss': 0, 'Private_Clean': 0, 'Private_Dirty': 0, 'Private_Hugetlb': 0, 'Swap': 0}
+            for m in SMAPS_ROLLUP_RE.finditer(self._buf, 0, n):
+                kb[m.group(1).decode()] = int(m.group(2))
+            uss = (kb['Private_Clean'] + kb['Private_Dirty'] + kb['Private_Hugetlb']) * 1024
+            values += [uss, kb['Pss'] * 1024, kb['Swap'] * 1024]
+        n = self._read(files.status_fd)
+        m = VM_HWM_RE.search(self._buf, 0, n)
+        if m is not None:
+            self.hwm[files.pid] = int(m.group(1)) * 1024
+        ctxt = {k: int(v) for k, v in CTXT_RE.findall(self._buf, 0, n)}
+        n = self._read(files.stat_fd)
+        stat = self._buf[:n]
+        # comm may contain spaces and parentheses, fields after it are well-defined. the first one is field 3 (state)
+        stat = stat[stat.rfind(b')')+2:].split()
+        run_wait_s = None
+        if files.schedstat_fd is not None:
+            n = self._read(files.schedstat_fd)
+            run_wait_s = int(self._buf[:n].split()[1]) / 1e9
+        self.cpu.update(files.pid, int(stat[11]) / CLK_TCK, int(stat[12]) / CLK_TCK, int(stat[17]),
+                        ctxt.get(b'voluntary_ctxt_switches', 0), ctxt.get(b'nonvoluntary_ctxt_switches', 0), run_wait_s)
+        read_bytes, write_bytes = 0, 0
+        if files.io_fd is not None:
+            n = self._read(files.io_fd)
+            read_bytes, write_bytes = _parse_io(self._buf, n)
+        self.io.update(files.pid, read_bytes, write_bytes, int(stat[7]), int(stat[9]), int(stat[39]) / CLK_TCK)
+        return values
+
+    def sample(self) -> list[tuple[int, bool, list[int]]]:
+        """
+        Return (pid, is_root, values in the order of `fields`) for every live process of the tree
+        """
+        if self._need_refresh or time.perf_counter() - self._last_refresh > self.refresh_interval_s:
+            self._refresh()
+        result = []
+        for pid, files in list(self._files.items()):
+            try:
+                values = self._sample_one(files)
+            except (OSError, ValueError):
+                # exited. its tracked children stay tracked, but its children are reparented (to init or a subreaper)
+                # and processes they start later are not descendants of root_pid, so they are not found.
+                # refresh to find new processes of the rest of the tree
+                self._files.pop(pid).close()
+                self._need_refresh = True
+                continue
+            result.append((pid, pid == self.root_pid, values))
+        self.cpu.end_tick(time.perf_counter())
+        return result
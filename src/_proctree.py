@@ -0,0 +1,113 @@
+import os
+import signal
+import subprocess
+import psutil
+
+"""
+Process tree isolation for scheduler jobs.
+
+Every job is started in its own session (process group on Windows) and tagged with environment variables.
+Children inherit both, so the whole tree of a job (profiler, fastlbp, multiprocessing workers)
+can be killed at once, and leftovers of a dead scheduler can be found later.
+"""
+
+# run label of the job a process belongs to
+JOB_ENV_VAR = 'MULTIBENCH_JOB'
+# '{pid}:{create_time}' of the scheduler that started the job
+SCHEDULER_ENV_VAR = 'MULTIBENCH_SCHEDULER'
+
+def get_scheduler_tag() -> str:
+    me = psutil.Process()
+    return f"{me.pid}:{me.create_time():.3f}"
+
+def get_job_popen_kwargs(run_label: str) -> dict:
+    """
+    Popen kwargs that isolate a job in its own process group and tag it
+    """
+    env = os.environ.copy()
+    env[JOB_ENV_VAR] = run_label
+    env[SCHEDULER_ENV_VAR] = get_scheduler_tag()
+    kwargs = {'env': env}
+    if os.name == 'posix':
+        kwargs['start_new_session'] = True
+    else:
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    return kwargs
+
+def _is_scheduler_alive(tag: str) -> bool:
+    try:
+        pid, create_time = tag.split(':')
+        p = psutil.Process(int(pid))
+        # a different process could have got the same pid
+        return abs(p.create_time() - float(create_time)) < 0.01
+    except (ValueError, psutil.NoSuchProcess):
+        return False
+
+def find_orphans() -> list[psutil.Process]:
+    """
+    Return tagged job processes whose scheduler is not running anymore
+    """
+    orphans = []
+    me = os.getpid()
+    for p in psutil.process_iter(['pid', 'environ']):
+        env = p.info['environ']
+        if p.pid == me or not env or JOB_ENV_VAR not in env:
+            continue
+        if not _is_scheduler_alive(env.get(SCHEDULER_ENV_VAR, '')):
+            orphans.append(p)
+    return orphans
+
+def kill_process_tree(pid: int, graceful_timeout_s: float = 5.0, popen: subprocess.Popen | None = None) -> None:
+    """
+    Kill a process, its process group and all its descendants.
+
+    With graceful_timeout_s > 0 everything gets SIGTERM first (so that e.g. the profiler can flush its logs)
+    and SIGKILL only if it is still alive after the timeout. Blocks until everything is dead.
+
+    :param popen: pass the Popen object if `pid` is our own child. 
+        It is then waited for through Popen, so that its return code is not lost.
+    """
+    try:
+        parent = psutil.Process(pid)
+        # collect the tree first: once the parent is dead its children are reparented and can't be found this way
+        procs = parent.children(recursive=True)
+        if popen is None:
+            procs.append(parent)
+    except psutil.NoSuchProcess:
+        procs = []
+    try:
+        # jobs are session leaders, so the whole group can be signalled at once
+        is_group_leader = os.name == 'posix' and os.getpgid(pid) == pid
+    except ProcessLookupError:
+        is_group_leader = False
+
+    def send(sig):
+        if is_group_leader:
+            try:
+                os.killpg(pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+        elif popen is not None:
+            popen.send_signal(sig)
+        for p in procs:
+            try:
+                p.send_signal(sig)
+            except psutil.NoSuchProcess:
+                pass
+
+    def wait(timeout_s):
+        _, alive = psutil.wait_procs(procs, timeout=timeout_s)
+        if popen is not None:
+            try:
+                popen.wait(timeout_s)
+            except subprocess.TimeoutExpired:
+                alive.append(popen)
+        return alive
+
+    if graceful_timeout_s > 0:
+        send(signal.SIGTERM)
+        if not wait(graceful_timeout_s):
+            return
+    # on Windows SIGTERM is TerminateProcess, which is as final as SIGKILL
+    send(signal.SIGKILL if os.name == 'posix' else signal.SIGTERM)
+    wait(5.0)
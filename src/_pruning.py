@@ -0,0 +1,120 @@
+import os
+from typing import TYPE_CHECKING
+
+from _common import read_json_file
+
+if TYPE_CHECKING:
+    from _scheduler import Job
+    from fastlbp_runner import FastlbpBenchplanRecord
+
+"""
+Dominance-based pruning of fastlbp runs that will certainly fail.
+
+Memory and runtime of fastlbp grow with the image size, the number of channels and the number of radii,
+and shrink with the patchsize. So if a run ran out of memory or time, every run with
+the same ncpus and mask ratio, a larger or equal image, more or equal radii and a smaller or equal patchsize
+will fail as well. Such runs are said to be dominated by the failed one and are not executed.
+"""
+
+# run statuses (result_ok values) that make dominated runs hopeless
+OOM = 'OOM'
+TIMEOUT = 'TIMEOUT'
+SKIPPED_DOMINATED = 'SKIPPED_DOMINATED'
+
+# a process killed by the kernel OOM killer gets SIGKILL.
+# -9 from Popen, 137 from a shell, 247 from a python parent that did sys.exit(-9)
+OOM_RETURNCODES = [-9, 128 + 9, 256 - 9]
+OOM_MESSAGES = ['MemoryError', 'Cannot allocate memory', 'std::bad_alloc']
+
+def _get_hw_c(shape) -> tuple[int, int, int]:
+    return int(shape[0]), int(shape[1]), int(shape[2]) if len(shape) > 2 else 1
+
+def dominates(failed: 'FastlbpBenchplanRecord', other: 'FastlbpBenchplanRecord') -> bool:
+    """
+    True if `other` costs at least as much memory and time as `failed` in every parameter
+    """
+    if int(failed.ncpus) != int(other.ncpus) or round(float(failed.mask_ratio or 0), 3) != round(float(other.mask_ratio or 0), 3):
+        return False
+    # masks of the same ratio cover different patches, depending on their shape
+    if float(failed.mask_ratio or 0) > 0 and failed.mask_geometry != other.mask_geometry:
+        return False
+    # reading the input costs differently in every format and cache state
+    if failed.input_format != other.input_format or failed.cache_mode != other.cache_mode:
+        return False
+    fh, fw, fc = _get_hw_c(failed.input_shape)
+    oh, ow, oc = _get_hw_c(other.input_shape)
+    return (oh >= fh and ow >= fw and oc >= fc
+            and int(other.nradii) >= int(failed.nradii)
+            and int(other.patchsize) <= int(failed.patchsize))
+
+def is_oom_failure(returncode: int | None, files: list[str]) -> bool:
+    """
+    Guess whether a job died because it ran out of memory.
+
+    :param returncode: return code of the job process
+    :param files: result files of the job. Stderr logs (*.err) are searched for out-of-memory errors,
+        json summaries (*.json) of the profiler for the return code of the profiled process
+    """
+    if returncode in OOM_RETURNCODES:
+        return True
+    for file in files:
+        if not os.path.isfile(file):
+            continue
+        if file.endswith('.json'):
+            if read_json_file(file).get('returncode') in OOM_RETURNCODES:
+                return True
+        elif file.endswith('.err'):
+            with open(file, 'r', errors='replace') as f:
+                text = f.read()
+            if any(m in text for m in OOM_MESSAGES):
+                return True
+    return False
+
+def find_dominated(failed: list['FastlbpBenchplanRecord'], candidates: list['FastlbpBenchplanRecord']) -> dict[str, str]:
+    """
+    Return {candidate run label: label of a failed run that dominates it}
+    """
+    dominated = {}
+    for rec in candidates:
+        for f in failed:
+            if f.run_label != rec.run_label and dominates(f, rec):
+                dominated[rec.run_label] = f.run_label
+                break
+    return dominated
+
+def prune_benchplan(records: list['FastlbpBenchplanRecord'], prune_on: tuple[str, ...] = (OOM, TIMEOUT)) -> dict[str, str]:
+    """
+    Plan-level pruning: find runs without results that are dominated by runs that already failed with a `prune_on` status.
+    Return {run label: label of the failed run}
+    """
+    failed = [rec for rec in records if rec.result_ok in prune_on]
+    todo = [rec for rec in records if rec.result_ok not in ['OK'] + list(prune_on)]
+    return find_dominated(failed, todo)
+
+"""
+"""
+
+class DominancePruner:
+    """
+    Scheduler-level pruning, for ParallelScheduler(pruner=...).
+    Called whenever a job fails with OOM or TIMEOUT, returns the queued jobs it dominates.
+    """
+    records: dict[str, 'FastlbpBenchplanRecord']
+    prune_on: tuple[str, ...]
+
+    def __init__(self, records: list['FastlbpBenchplanRecord'], prune_on: tuple[str, ...] = (OOM, TIMEOUT)):
+        """
+        :param records: all runs of the plan
+        :param prune_on: failure statuses that trigger pruning.
+            Do not prune on TIMEOUT when the limits depend on the predicted runtime: larger runs get larger limits.
+        """
+        self.records = {rec.run_label: rec for rec in records}
+        self.prune_on = tuple(prune_on)
+
+    def __call__(self, failed_job: 'Job', status: str, queued: list['Job']) -> list['Job']:
+        failed = self.records.get(failed_job.params.run_label)
+        if status not in self.prune_on or failed is None:
+            return []
+        return [j for j in queued
+                if j.params.run_label in self.records and j.params.run_label != failed.run_label
+                and dominates(failed, self.records[j.params.run_label])]
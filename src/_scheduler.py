@@ -1,9 +1,13 @@
 import os
+import math
+import signal
 import subprocess
+import threading
 from dataclasses import dataclass
-from typing import Any, Type
+from typing import Any, Callable, Type, Union
 import io
 from time import perf_counter, sleep
+import psutil
 # import pyinstrument
 
 import logging
@@ -15,6 +19,14 @@ logging.basicConfig(
 
 from _config import config
 from _common import Runner, RunnerParams
+from _admission import AdmissionPolicy, get_admission_policy
+from _ordering import QueueOrder, get_queue_order
+from _affinity import CoreAllocator, PhysicalCore, format_cpu_list, CPUS_ENV_VAR
+from _memwatch import MemoryMonitor, get_process_tree_mem
+from _journal import JobJournal
+import _journal
+from _proctree import find_orphans, get_job_popen_kwargs, kill_process_tree, JOB_ENV_VAR
+from _pruning import is_oom_failure, OOM, TIMEOUT, SKIPPED_DOMINATED
 
 """
 """
@@ -24,16 +36,30 @@ class Job:
     ncpus: int
     mem_gb: int
     params: RunnerParams
+    est_time_s: float | None
+    # the effective limit once the job is started
+    timeout_s: float | None
+    # the job's own limit it was queued with (see add_job)
+    queued_timeout_s: float | None
+    cores: list[PhysicalCore] | None
+    cpus: list[int] | None
+    kill_reason: str | None
     start_time: float | None
     finished_time: float | None
     process: subprocess.Popen | None
     stdout: io.IOBase | None
     stderr: io.IOBase | None
 
-    def __init__(self, ncpus: int, mem_gb: int, params: RunnerParams):
+    def __init__(self, ncpus: int, mem_gb: int, params: RunnerParams, est_time_s: float | None = None, timeout_s: float | None = None):
         self.ncpus = ncpus
         self.mem_gb = mem_gb
         self.params = params
+        self.est_time_s = est_time_s
+        self.timeout_s = timeout_s
+        self.queued_timeout_s = timeout_s
+        self.cores = None
+        self.cpus = None
+        self.kill_reason = None
         self.start_time = None
         self.finished_time = None
         self.process = None
@@ -41,7 +67,7 @@ class Job:
         self.stderr = None
     
     def copy(self):
-        newjob = Job(self.ncpus, self.mem_gb, self.params) 
+        newjob = Job(self.ncpus, self.mem_gb, self.params, self.est_time_s, self.queued_timeout_s)
         return newjob
 
 class ParallelScheduler:
@@ -49,10 +75,26 @@ class ParallelScheduler:
     logger.setLevel(logging.INFO)
 
     runner_class: Type[Runner]
+    admission_policy: AdmissionPolicy
+    queue_order: QueueOrder
+    core_allocator: CoreAllocator | None
+    memory_monitor: MemoryMonitor | None
+    journal: JobJournal | None
+    retry_failed: bool
+    kill_orphans: bool
+    timeout_s: float | None
+    timeout_factor: float | None
+    min_timeout_s: float
+    runtime_estimator: Callable[[Job, list[Job]], float | None] | None
+    pruner: Callable[[Job, str, list[Job]], list[Job]] | None
+    pruned: list[Job]
+    total_cpus: int
+    total_mem_gb: int
     free_cpus: int
     free_mem_gb: int
     poll_interval_s: float
     print_interval_s: float
+    event_driven: bool
 
     queued : list[Job]
     in_progress : list[Job]
@@ -66,13 +108,84 @@ class ParallelScheduler:
                  available_cpus: int, 
                  available_mem_gb: int, 
                  poll_interval_s: float = 10, 
-                 print_interval_s: float = 60
+                 print_interval_s: float = 60,
+                 event_driven: bool = True,
+                 admission_policy: Union[str, AdmissionPolicy] = 'fifo',
+                 pin_cpus: bool = False,
+                 memory_monitor: MemoryMonitor | None = None,
+                 journal: JobJournal | None = None,
+                 retry_failed: bool = False,
+                 kill_orphans: bool = True,
+                 timeout_s: float | None = None,
+                 timeout_factor: float | None = None,
+                 min_timeout_s: float = 60,
+                 runtime_estimator: Callable[[Job, list[Job]], float | None] | None = None,
+                 pruner: Callable[[Job, str, list[Job]], list[Job]] | None = None,
+                 queue_order: Union[str, QueueOrder] = 'plan'
                  ):
+        """
+        :param poll_interval_s: max time between two scheduler updates. 
+            In event-driven mode the scheduler also wakes up as soon as any job exits.
+        :param print_interval_s: status is printed every print_interval_s, independently of job completions
+        :param event_driven: if True, start a waiter thread for each job and wake up the scheduler 
+            the moment a job exits instead of sleeping for the whole poll_interval_s
+        :param admission_policy: which queued jobs to start when resources are free. 
+            A policy instance or one of 'fifo', 'smallest_first', 'best_fit', 'backfill' (see _admission.py)
+        :param pin_cpus: give each job a disjoint set of physical cores (on one NUMA node if possible)
+            and pin the job process tree to it. Linux only. 
+            `available_cpus` is capped by the number of physical cores available to the scheduler.
+        :param memory_monitor: if set, admit jobs based on measured memory of running jobs 
+            instead of their static `mem_gb` reservations (see _memwatch.py)
+        :param journal: if set, record every job state change there and skip jobs the journal knows as done.
+            Jobs that were in flight when a previous run died are cleaned up and run again.
+        :param retry_failed: with a journal, run again jobs that failed in a previous run
+        :param kill_orphans: at start, kill processes left over by jobs of a dead scheduler. 
+            If False, refuse to start while they exist.
+        :param timeout_s: default wall-clock limit for a job, in seconds. A job can have its own limit (see add_job).
+        :param timeout_factor: also limit a job to timeout_factor * its predicted runtime (but at least min_timeout_s).
+            The prediction is `runtime_estimator(job, finished_jobs)` if given, else job.est_time_s.
+        :param runtime_estimator: called when a job starts with the job and all finished jobs. 
+            Returns the predicted runtime in seconds or None.
+        Jobs over their limit are killed and recorded as 'TIMEOUT' with the elapsed time and memory so far.
+        :param pruner: called as `pruner(failed_job, status, queued_jobs)` when a job fails with 'OOM' or 'TIMEOUT'.
+            Returns the queued jobs that will certainly fail as well (see _pruning.DominancePruner).
+            They are removed from the queue and recorded as 'SKIPPED_DOMINATED'.
+        :param queue_order: how the queue is ordered when the scheduler starts. 
+            An order instance or one of 'plan', 'shortest_first', 'longest_first', 'round_robin' (see _ordering.py)
+        """
         self.runner_class = runner_class
+        self.admission_policy = get_admission_policy(admission_policy)
+        self.queue_order = get_queue_order(queue_order)
+        self.total_cpus = available_cpus
+        self.total_mem_gb = available_mem_gb
         self.free_cpus = available_cpus
         self.free_mem_gb = available_mem_gb
         self.poll_interval_s = poll_interval_s
         self.print_interval_s = print_interval_s
+        self.event_driven = event_driven
+        self.memory_monitor = memory_monitor
+        # memory is short while no job runs, i.e. because of other processes
+        self._waiting_for_memory = False
+        self.journal = journal
+        self.retry_failed = retry_failed
+        self.kill_orphans = kill_orphans
+        self.timeout_s = timeout_s
+        self.timeout_factor = timeout_factor
+        self.min_timeout_s = min_timeout_s
+        self.runtime_estimator = runtime_estimator
+        self.pruner = pruner
+        self.pruned = []
+        self._job_exited = threading.Event()
+
+        self.core_allocator = None
+        if pin_cpus:
+            if not hasattr(os, 'sched_setaffinity'):
+                self.logger.warning('pin_cpus=True is not supported on this system. Jobs will not be pinned.')
+            else:
+                self.core_allocator = CoreAllocator()
+                if available_cpus > self.core_allocator.n_cores:
+                    self.logger.warning(f'available_cpus={available_cpus} but only {self.core_allocator.n_cores} physical cores can be pinned. Using {self.core_allocator.n_cores}.')
+                    self.total_cpus = self.free_cpus = self.core_allocator.n_cores
         
         self.queued = []
         self.in_progress = []
@@ -80,73 +193,310 @@ class ParallelScheduler:
         self.last_poll_time = 0
         self.last_print_time = 0
         self.start_time = 0
+        self._usage_time = 0
+        self._used_cpu_s = 0.0
+        self._used_mem_gb_s = 0.0
         self.logger.info('init')
 
+    def _account_usage(self) -> None:
+        # integrate reserved resources over time. call before every change of free_cpus/free_mem_gb
+        now = perf_counter()
+        dt = now - self._usage_time
+        self._used_cpu_s += (self.total_cpus - self.free_cpus) * dt
+        self._used_mem_gb_s += self._get_used_mem_gb() * dt
+        self._usage_time = now
+
+    def _get_used_mem_gb(self) -> float:
+        if self.memory_monitor is not None:
+            return self.memory_monitor.get_used_mem_gb()
+        return self.total_mem_gb - self.free_mem_gb
+
+    def _fits_empty_machine(self, job: Job) -> bool:
+        """
+        Whether the job could be admitted with no job running and no other process using memory
+        """
+        if self.memory_monitor is not None:
+            mem_gb = self.memory_monitor.capacity_gb - self.memory_monitor.safety_margin_gb
+        else:
+            mem_gb = self.total_mem_gb
+        return job.ncpus <= self.total_cpus and job.mem_gb <= mem_gb
+
+    def _get_free_mem_gb(self) -> float:
+        if self.memory_monitor is not None:
+            return self.memory_monitor.get_free_mem_gb(self.in_progress)
+        return self.free_mem_gb
+
+    def get_utilization(self) -> dict[str, float]:
+        """
+        Time-weighted utilization of reserved CPUs and memory since the start of `run()`, in [0,1].
+        With a memory monitor, memory utilization is based on the measured usage.
+        """
+        if len(self.in_progress) > 0 or len(self.queued) > 0:
+            # otherwise the clock stops at the last finished job
+            self._account_usage()
+        wall = self._usage_time - self.start_time
+        return {
+            'wall_s': wall,
+            'cpu': self._used_cpu_s / (self.total_cpus * wall) if self.total_cpus > 0 and wall > 0 else 0.0,
+            'mem': self._used_mem_gb_s / (self.total_mem_gb * wall) if self.total_mem_gb > 0 and wall > 0 else 0.0,
+            'cpu_hours': self._used_cpu_s / 3600,
+            'mem_gb_hours': self._used_mem_gb_s / 3600,
+        }
+
     def _start_job(self, job: Job) -> Job:
         assert self.free_cpus >= job.ncpus
-        assert self.free_mem_gb >= job.mem_gb
+        # with a memory monitor the static reservations are only informative and may go below zero
+        assert self.memory_monitor is not None or self.free_mem_gb >= job.mem_gb
+        self._account_usage()
         self.free_cpus -= job.ncpus
         self.free_mem_gb -= job.mem_gb
         cwd = self.runner_class.get_cwd(job.params)
         new_job = job.copy()
         new_job.stdout = open(os.path.join(cwd, job.params.run_label + '.out'), 'w')
         new_job.stderr = open(os.path.join(cwd, job.params.run_label + '.err'), 'w')
+        # the job gets its own process group, so that its whole process tree can be killed at once
+        popen_kwargs = get_job_popen_kwargs(job.params.run_label)
+        if self.core_allocator is not None and job.ncpus > 0:
+            new_job.cores = self.core_allocator.allocate(job.ncpus)
+            assert new_job.cores is not None
+            new_job.cpus = self.core_allocator.get_cpus(new_job.cores)
+            # the job pins itself before it starts anything (see _affinity.pin_from_env), 
+            # so everything it spawns runs on these cpus from the start
+            popen_kwargs['env'][CPUS_ENV_VAR] = format_cpu_list(new_job.cpus)
         new_job.process = subprocess.Popen(
             args=self.runner_class.get_argv(job.params), 
             cwd=cwd,
             stdout=new_job.stdout, 
-            stderr=new_job.stderr
+            stderr=new_job.stderr,
+            **popen_kwargs
         )
         new_job.start_time = perf_counter()
-        self.logger.info(f"Started job '{new_job.params.run_label}' with pid {new_job.process.pid}")
+        new_job.timeout_s = self._get_timeout_s(job)
+        timeout_info = f" and timeout {new_job.timeout_s:.0f}s" if new_job.timeout_s is not None else ""
+        self.logger.info(f"Started job '{new_job.params.run_label}' with pid {new_job.process.pid}{timeout_info}")
+        if new_job.cpus is not None:
+            self.logger.info(f"Pinned job '{new_job.params.run_label}' to cpus {format_cpu_list(new_job.cpus)}")
+        if self.journal is not None:
+            self.journal.mark_started(new_job.params.run_label, new_job.process.pid, 
+                                      format_cpu_list(new_job.cpus) if new_job.cpus is not None else None)
+        if self.event_driven:
+            threading.Thread(target=self._wait_for_job, args=(new_job,), daemon=True).start()
         return new_job
+
+    def _wait_for_job(self, job: Job) -> None:
+        # runs in a separate thread. Popen.wait is thread-safe w.r.t. Popen.poll in the main loop.
+        job.process.wait()
+        self._job_exited.set()
     
     def _finalize_job(self, job: Job) -> None:
         assert job.process.poll() is not None
+        self._account_usage()
         self.free_cpus += job.ncpus
         self.free_mem_gb += job.mem_gb
+        if job.cores is not None:
+            self.core_allocator.release(job.cores)
         job.finished_time = perf_counter()
         job.stdout.close()
         job.stderr.close()
+        if self.journal is not None:
+            if job.kill_reason == 'overcommit':
+                self.journal.mark_queued(job.params.run_label, note='requeued after memory overcommit')
+            elif job.kill_reason == 'interrupt':
+                # leave it 'started', the next run will clean it up and run it again
+                pass
+            elif job.kill_reason == 'timeout':
+                self.journal.mark_done(job.params.run_label, job.process.returncode, _journal.TIMEOUT)
+            elif self._get_failure_status(job) == OOM:
+                self.journal.mark_done(job.params.run_label, job.process.returncode, _journal.FAILED, note=OOM)
+            else:
+                self.journal.mark_done(job.params.run_label, job.process.returncode)
         self.logger.info(f'finalized job {job.params.run_label}')
     
     def _process_jobs_in_queue(self) -> None:
         self.logger.debug(f'_process_jobs_in_queue (q{len(self.queued)}, pr{len(self.in_progress)})')
-        i = 0
-        while i < len(self.queued):
-            # TODO: THIS LOOP IS MALFUNCTIONING. need to adjust indexing after pop. still works tho
-            job = self.queued[i]
-            if self.free_cpus >= job.ncpus and self.free_mem_gb >= job.mem_gb:
-                new_job = self._start_job(job)
-                self.in_progress.append(new_job)
-                self.queued.pop(i)
-            i += 1
+        selected = self.admission_policy.select(
+            self.queued, self.in_progress, 
+            self.free_cpus, self._get_free_mem_gb(), 
+            self.total_cpus, self.total_mem_gb, 
+            perf_counter())
+        for job in selected:
+            self.queued.remove(job)
+            new_job = self._start_job(job)
+            self.in_progress.append(new_job)
 
     def _process_jobs_in_progress(self) -> None:
         self.logger.debug(f'_process_jobs_in_progress  (q{len(self.queued)}, pr{len(self.in_progress)})')
         i = 0
         while i < len(self.in_progress):
-            # TODO: THIS LOOP IS MALFUNCTIONING. need to adjust indexing after pop. still works tho
             job = self.in_progress[i]
             if job.process.poll() is not None:
                 self._finalize_job(job)
-                self.finished.append(job)
+                if job.kill_reason != 'overcommit':
+                    # jobs killed because of overcommit are already back in the queue
+                    self.finished.append(job)
                 self.in_progress.pop(i)
-            i += 1
+                self._prune_dominated(job)
+            else:
+                i += 1
+
+    def _get_failure_status(self, job: Job) -> str | None:
+        """
+        OOM or TIMEOUT if the job failed in a way that says something about the jobs it dominates
+        """
+        if job.kill_reason == 'timeout':
+            return TIMEOUT
+        if job.kill_reason is None and job.process.returncode != 0:
+            files = self.runner_class.get_result_files(job.params) + [job.stderr.name]
+            if is_oom_failure(job.process.returncode, files):
+                return OOM
+        return None
+
+    def _prune_dominated(self, job: Job) -> None:
+        status = self._get_failure_status(job)
+        if status is None:
+            return
+        if status == OOM:
+            self.runner_class.record_status(job.params, OOM)
+        if self.pruner is None:
+            return
+        for pruned_job in self.pruner(job, status, self.queued):
+            label = pruned_job.params.run_label
+            self.queued.remove(pruned_job)
+            self.pruned.append(pruned_job)
+            self.logger.info(f"P {label} (dominated by '{job.params.run_label}' that failed with {status})")
+            self.runner_class.record_status(pruned_job.params, SKIPPED_DOMINATED, 
+                                            dominated_by=job.params.run_label, dominated_reason=status)
+            if self.journal is not None:
+                self.journal.mark_done(label, None, _journal.SKIPPED_DOMINATED, note=f"dominated by {job.params.run_label} ({status})")
+
+    def _kill_job(self, job: Job, reason: str, graceful_timeout_s: float = 0) -> None:
+        """
+        Kill the whole process tree of a job. The job is finalized later as usual.
+        """
+        job.kill_reason = reason
+        kill_process_tree(job.process.pid, graceful_timeout_s, popen=job.process)
+
+    def _get_timeout_s(self, job: Job) -> float | None:
+        limits = []
+        if job.timeout_s is not None:
+            limits.append(job.timeout_s)
+        elif self.timeout_s is not None:
+            limits.append(self.timeout_s)
+        if self.timeout_factor is not None:
+            est_time_s = None
+            if self.runtime_estimator is not None:
+                est_time_s = self.runtime_estimator(job, self.finished)
+            if est_time_s is None:
+                est_time_s = job.est_time_s
+            if est_time_s is not None:
+                limits.append(max(self.timeout_factor * est_time_s, self.min_timeout_s))
+        return min(limits) if limits else None
+
+    def _process_timeouts(self) -> None:
+        now = perf_counter()
+        for job in self.in_progress:
+            if job.timeout_s is None or job.kill_reason is not None or now - job.start_time <= job.timeout_s:
+                continue
+            if job.process.poll() is not None:
+                # finished just in time
+                continue
+            elapsed_s = now - job.start_time
+            rss, _, _ = get_process_tree_mem(job.process.pid)
+            self.logger.warning(f"Job '{job.params.run_label}' exceeded its {job.timeout_s:.0f}s limit. Killing it.")
+            self._kill_job(job, 'timeout', graceful_timeout_s=5.0)
+            self.runner_class.record_status(job.params, 'TIMEOUT', 
+                                            timeout_s=round(job.timeout_s, 3), 
+                                            elapsed_s=round(elapsed_s, 3), 
+                                            mem_gb_at_timeout=round(rss / 1e9, 3))
+
+    def _terminate_all(self, reason: str, graceful_timeout_s: float = 5.0) -> None:
+        """
+        Kill all running jobs and finalize them
+        """
+        for job in self.in_progress:
+            self.logger.warning(f"Killing job '{job.params.run_label}' ({reason})")
+            self._kill_job(job, reason, graceful_timeout_s)
+        for job in self.in_progress:
+            self._finalize_job(job)
+        self.in_progress.clear()
+
+    def _check_orphans(self) -> None:
+        """
+        Processes left by jobs of a scheduler that died would steal cpus and memory from our jobs
+        """
+        orphans = find_orphans()
+        if len(orphans) == 0:
+            return
+        for p in orphans:
+            try:
+                label = p.info['environ'].get(JOB_ENV_VAR)
+                self.logger.warning(f"Orphan process {p.pid} of job '{label}' from a previous run: {' '.join(p.cmdline())}, {p.cpu_percent(0.1):.0f}% cpu")
+            except psutil.NoSuchProcess:
+                pass
+        if not self.kill_orphans:
+            raise RuntimeError(f"{len(orphans)} processes from a previous run are still alive. Kill them or use kill_orphans=True.")
+        self.logger.warning(f"Killing {len(orphans)} orphan processes")
+        for p in orphans:
+            kill_process_tree(p.pid, graceful_timeout_s=1.0)
+
+    def _handle_overcommit(self) -> None:
+        monitor = self.memory_monitor
+        self.logger.warning(f"Memory overcommitted: jobs use {monitor.get_used_mem_gb():.1f} GB. Pausing admissions.")
+        if monitor.on_overcommit != 'kill_newest':
+            return
+        running = [j for j in self.in_progress if j.kill_reason is None]
+        if len(running) < 2:
+            # killing the only job gains nothing
+            return
+        newest = max(running, key=lambda j: j.start_time)
+        track = monitor.get_track(newest)
+        peak_gb = track.peak_gb if track is not None else 0
+        self.logger.warning(f"Killing the newest job '{newest.params.run_label}' (peak {peak_gb:.1f} GB) and putting it back to the queue")
+        self._kill_job(newest, 'overcommit')
+        # a copy has the limit the job was queued with, not the effective one of this attempt
+        requeued = newest.copy()
+        requeued.mem_gb = max(newest.mem_gb, int(math.ceil(peak_gb)))
+        self.queued.insert(0, requeued)
 
     def _print_info(self):
         now = perf_counter()
-        self.logger.info(f"{now-self.start_time:.3f}s : {len(self.queued)} queued, {len(self.in_progress)} in progress, {len(self.finished)} finished. Avail.CPU: {self.free_cpus}, avail.Mem: {self.free_mem_gb} GB")
+        mem_info = f"avail.Mem: {self.free_mem_gb} GB"
+        if self.memory_monitor is not None:
+            mem_info = f"measured Mem: {self.memory_monitor.get_used_mem_gb():.1f} GB, admissible Mem: {self._get_free_mem_gb():.1f} GB"
+        self.logger.info(f"{now-self.start_time:.3f}s : {len(self.queued)} queued, {len(self.in_progress)} in progress, {len(self.finished)} finished{f', {len(self.pruned)} pruned' if self.pruned else ''}. Avail.CPU: {self.free_cpus}, {mem_info}")
 
     def _update(self) -> None:
         self.logger.debug('start _update')
+        self._process_timeouts()
         self._process_jobs_in_progress()
-        self._process_jobs_in_queue()
+        overcommitted = False
+        waiting_for_memory = False
+        if self.memory_monitor is not None:
+            self.memory_monitor.sample(self.in_progress)
+            overcommitted = self.memory_monitor.is_overcommitted()
+            if overcommitted and len(self.in_progress) == 0:
+                # nothing of ours to pause or kill. wait until the memory is back, sampled again on the next update
+                waiting_for_memory = True
+                if not self._waiting_for_memory:
+                    self.logger.warning(f"Less than {self.memory_monitor.safety_margin_gb} GB of memory is available while no job is running. Waiting.")
+            elif overcommitted:
+                self._handle_overcommit()
+        if not overcommitted:
+            self._process_jobs_in_queue()
 
         # prevent infinite loop
-        if len(self.in_progress) == 0 and len(self.queued) > 0:
-            self.logger.warn('Cannot run anything -- not enough resources -- clearing the queue and aborting.')
-            self.queued.clear()
+        if len(self.in_progress) == 0 and len(self.queued) > 0 and not waiting_for_memory:
+            if self.memory_monitor is not None and self._fits_empty_machine(self.queued[0]):
+                # measured memory is taken by other processes for now. wait until they are done, as above
+                waiting_for_memory = True
+                if not self._waiting_for_memory:
+                    self.logger.warning(f"Not enough free memory for '{self.queued[0].params.run_label}' while no job is running. Waiting.")
+            else:
+                self.logger.warn('Cannot run anything -- not enough resources -- clearing the queue and aborting.')
+                self.queued.clear()
+        if self._waiting_for_memory and not waiting_for_memory:
+            self.logger.info("Memory is available again")
+        self._waiting_for_memory = waiting_for_memory
 
         now = perf_counter()
         if now - self.last_print_time > self.print_interval_s:
@@ -155,19 +505,91 @@ class ParallelScheduler:
         self.last_poll_time = now
         self.logger.debug('finish _update')
 
-    def add_job(self, ncpus: int, mem_gb: int, params: RunnerParams):
+    def _wait(self) -> None:
+        """
+        Sleep until the next update is due.  
+        In event-driven mode return as soon as any job exits; 
+        never sleep past the next status print or job deadline.
+        """
+        if not self.event_driven:
+            sleep(self.poll_interval_s)
+            return
+        now = perf_counter()
+        deadlines = [j.start_time + j.timeout_s for j in self.in_progress if j.timeout_s is not None and j.kill_reason is None]
+        timeout = min([self.poll_interval_s, self.last_print_time + self.print_interval_s - now] + [d - now for d in deadlines])
+        self._job_exited.wait(max(timeout, 0))
+        self._job_exited.clear()
+
+    def _print_utilization(self):
+        u = self.get_utilization()
+        self.logger.info(f"Utilization over {u['wall_s']:.3f}s with '{self.admission_policy.name}' admission: "
+                         f"CPU {100*u['cpu']:.1f}% ({u['cpu_hours']:.3f} cpu*h), "
+                         f"Mem {100*u['mem']:.1f}% ({u['mem_gb_hours']:.3f} GB*h)")
+
+    def _check_journal(self, params: RunnerParams) -> bool:
+        """
+        Return False if the journal says the job is already done. 
+        Clean up after a job that was interrupted in a previous run.
+        """
+        label = params.run_label
+        entry = self.journal.get(label)
+        state = entry['state'] if entry is not None else None
+        if _journal.is_done(state, self.retry_failed):
+            self.logger.info(f"S {label} ({state} according to the journal)")
+            return False
+        if state == _journal.STARTED:
+            self.logger.warning(f"Job '{label}' (pid {entry['pid']}) was interrupted in a previous run. Removing its partial results and running it again.")
+            for file in self.runner_class.get_result_files(params):
+                if os.path.isfile(file):
+                    os.remove(file)
+        self.journal.mark_queued(label)
+        return True
+
+    def add_job(self, ncpus: int, mem_gb: int, params: RunnerParams, est_time_s: float | None = None, timeout_s: float | None = None):
+        """
+        :param est_time_s: expected job runtime in seconds, if known. Used by some admission policies.
+        :param timeout_s: wall-clock limit for this job, overrides the scheduler default
+        """
+        if self.journal is not None and not self._check_journal(params):
+            return
         self.logger.info("A " + params.run_label)
-        self.queued.append(Job(ncpus, mem_gb, params))
+        self.queued.append(Job(ncpus, mem_gb, params, est_time_s, timeout_s))
 
     def run(self):
+        self._check_orphans()
         self.start_time = perf_counter()
+        self._usage_time = self.start_time
+        self._used_cpu_s = 0.0
+        self._used_mem_gb_s = 0.0
         self.logger.info(f"Starting Scheduler with {self.runner_class.__name__} runner.")
+        self.queued = self.queue_order.order(self.queued)
+        if self.queue_order.name != 'plan':
+            self.logger.info(f"Queue ordered '{self.queue_order.name}': {', '.join(j.params.run_label for j in self.queued[:5])}{', ...' if len(self.queued) > 5 else ''}")
         self.logger.info(f"{len(self.queued)} jobs queued. Avail.CPU: {self.free_cpus}, avail.Mem: {self.free_mem_gb} GB.")
+
+        # make SIGTERM/SIGHUP unwind the stack like Ctrl+C does, so that jobs are killed below
+        def on_signal(signum, frame):
+            raise SystemExit(128 + signum)
+        handled_signals = [signal.SIGTERM] + ([signal.SIGHUP] if hasattr(signal, 'SIGHUP') else [])
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            previous_handlers = {s: signal.signal(s, on_signal) for s in handled_signals}
         
-        while len(self.queued) > 0:
+        try:
             self._update()
-            sleep(self.poll_interval_s)
+            while len(self.queued) > 0 or len(self.in_progress) > 0:
+                self._wait()
+                self._update()
+        except BaseException:
+            self.logger.warning("Scheduler interrupted. Killing all running jobs.")
+            self._terminate_all('interrupt')
+            raise
+        finally:
+            for s, handler in previous_handlers.items():
+                signal.signal(s, handler)
 
+        self._print_info()
+        self._print_utilization()
         self.logger.info("Scheduler Queue empty. Exiting.")
 
 """
@@ -177,9 +599,9 @@ class SequentialScheduler(ParallelScheduler):
     logger = logging.getLogger('sequential_scheduler')
     logger.setLevel(logging.INFO)
 
-    def add_job(self, ncpus: int, mem_gb: int, params: RunnerParams):
-        self.logger.info("A " + params.run_label)
-        self.queued.append(Job(0, 0, params))
+    def add_job(self, ncpus: int, mem_gb: int, params: RunnerParams, est_time_s: float | None = None, timeout_s: float | None = None):
+        # jobs run one by one, resources do not matter
+        super().add_job(0, 0, params, est_time_s, timeout_s)
 
     # override
     def _process_jobs_in_queue(self) -> None:
@@ -189,14 +611,7 @@ class SequentialScheduler(ParallelScheduler):
             return
         
         # skip resources check!
-        i = 0
-        while i < len(self.queued):
-            # TODO: THIS LOOP IS MALFUNCTIONING. need to adjust indexing after pop. still works tho
-            job = self.queued[i]
-            new_job = self._start_job(job)
+        if len(self.queued) > 0:
+            new_job = self._start_job(self.queued.pop(0))
             self.in_progress.append(new_job)
-            self.queued.pop(i)
-            # this will prevent scheduling if there is already a job in progress
-            break 
-            i += 1
 
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+
+"""
+Statistical stack sampler for the Python side of a job.
+
+A daemon thread captures the stacks of all other threads (sys._current_frames()) every `interval_s`
+and counts them in the collapsed format of flamegraph.pl / speedscope / inferno:
+    role;thread;module:function;module:function... count
+Collapsed files of several processes and of repeated runs are merged by adding the counts (see merge).
+
+The job starts the sampler with start_from_env() if MULTIBENCH_STACK_DIR is set (the profiler sets it).
+Every process writes its own file into that directory: main_<pid>.collapsed, and worker_<pid>.collapsed for
+processes forked from it (e.g. fastlbp's multiprocessing pool), which start their own sampler after the fork.
+Files are written soon after the sampler starts and then every `flush_interval_s`, because pool workers are often
+terminated rather than exit, so a worker may lose its last seconds of samples. Workers that exit normally flush on exit.
+"""
+
+STACK_DIR_ENV = 'MULTIBENCH_STACK_DIR'
+STACK_INTERVAL_ENV = 'MULTIBENCH_STACK_INTERVAL_S'
+COLLAPSED_EXT = '.collapsed'
+DEFAULT_INTERVAL_S = 0.02
+# the first flush, so that short-lived workers leave a file
+FIRST_FLUSH_S = 0.25
+
+class StackSampler:
+    """
+    Samples the stacks of all threads of this process, except its own
+    """
+    path: str
+    interval_s: float
+    role: str
+    flush_interval_s: float
+    # collapsed stack -> number of samples
+    counts: dict[str, int]
+    samples: int
+
+    def __init__(self, path: str, interval_s: float = DEFAULT_INTERVAL_S, role: str = 'main', flush_interval_s: float = 2.0):
+        """
+        :param path: collapsed stacks file. Stats (samples, cpu time of the sampler) go next to it, with a .json extension
+        :param role: first frame of every stack, to tell the processes apart in merged files
+        """
+        self.path = path
+        self.interval_s = interval_s
+        self.role = role
+        self.flush_interval_s = flush_interval_s
+        self.counts = {}
+        self.samples = 0
+        self._cpu_s = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_names = {}
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='multibench-stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def _get_key(self, ident: int, frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename).removesuffix('.py')}:{code.co_name}")
+            frame = frame.f_back
+        thread = self._thread_names.get(ident, str(ident))
+        # ';' separates frames, ' ' the count
+        return ';'.join([self.role, thread] + stack[::-1]).replace(' ', '_')
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in self._thread_names:
+                self._thread_names = {t.ident: t.name for t in threading.enumerate()}
+            key = self._get_key(ident, frame)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        cpu0 = time.thread_time()
+        next_flush = time.monotonic() + min(self.flush_interval_s, FIRST_FLUSH_S)
+        while not self._stop.wait(self.interval_s):
+            self._sample()
+            if time.monotonic() >= next_flush:
+                self._cpu_s = time.thread_time() - cpu0
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval_s
+        self._cpu_s = time.thread_time() - cpu0
+
+    def flush(self) -> None:
+        write_collapsed(self.path, dict(self.counts))
+        stats_path = os.path.splitext(self.path)[0] + '.json'
+        with open(stats_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'samples': self.samples, 'interval_s': self.interval_s, 'cpu_s': self._cpu_s}, f)
+        os.replace(stats_path + '.tmp', stats_path)
+
+"""
+"""
+
+_active: StackSampler | None = None
+
+def start_from_env(role: str = 'main') -> StackSampler | None:
+    """
+    Start sampling this process if MULTIBENCH_STACK_DIR is set, and every process forked from it.
+    Return the sampler or None
+    """
+    global _active
+    stack_dir = os.environ.get(STACK_DIR_ENV)
+    if not stack_dir or _active is not None:
+        return None
+    interval_s = float(os.environ.get(STACK_INTERVAL_ENV, DEFAULT_INTERVAL_S))
+    _active = StackSampler(os.path.join(stack_dir, f'{role}_{os.getpid()}{COLLAPSED_EXT}'), interval_s, role)
+    _active.start()
+    if role == 'main':
+        os.register_at_fork(after_in_child=_start_in_child)
+    else:
+        # multiprocessing children leave with os._exit, which skips atexit but runs multiprocessing finalizers.
+        # a finalizer registered now would be dropped: the child clears the finalizer registry when it bootstraps,
+        # right before it runs the after-fork callbacks. so register it from such a callback
+        import multiprocessing.util
+        multiprocessing.util.register_after_fork(_active, _register_finalizer)
+    import atexit
+    atexit.register(_active.stop)
+    return _active
+
+def _register_finalizer(sampler: StackSampler) -> None:
+    import multiprocessing.util
+    multiprocessing.util.Finalize(None, sampler.stop, exitpriority=100)
+
+def _start_in_child() -> None:
+    global _active
+    # the sampler thread of the parent does not exist here. 
+    # its copy must not write the parent's file on exit
+    if _active is not None:
+        _active._thread = None
+    _active = None
+    start_from_env('worker')
+
+"""
+"""
+
+def read_collapsed(path: str) -> dict[str, int]:
+    counts = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                counts[stack] = counts.get(stack, 0) + int(count)
+    return counts
+
+def write_collapsed(path: str, counts: dict[str, int]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(counts.items()):
+            f.write(f"{stack} {count}\n")
+    os.replace(tmp_path, path)
+
+def merge(outfile: str, *files: str) -> dict[str, int]:
+    """
+    Merge collapsed stack files (processes of a run, repeats of a configuration...) into `outfile`
+    """
+    total = {}
+    for file in files:
+        for stack, count in read_collapsed(file).items():
+            total[stack] = total.get(stack, 0) + count
+    write_collapsed(outfile, total)
+    return total
+
+def collect_dir(stack_dir: str, outfile: str) -> dict:
+    """
+    Merge all files a job wrote into `stack_dir` into `outfile` and remove the directory.
+    Return the totals of the sampler stats
+    """
+    files = sorted(os.path.join(stack_dir, f) for f in os.listdir(stack_dir) if f.endswith(COLLAPSED_EXT))
+    merge(outfile, *files)
+    stats = {'stack_samples': 0, 'stack_sampler_cpu_s': 0.0, 'stack_nprocs': len(files)}
+    for file in files:
+        stats_path = os.path.splitext(file)[0] + '.json'
+        if os.path.isfile(stats_path):
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                s = json.load(f)
+            stats['stack_samples'] += s['samples']
+            stats['stack_sampler_cpu_s'] += s['cpu_s']
+    stats['stack_sampler_cpu_s'] = round(stats['stack_sampler_cpu_s'], 3)
+    shutil.rmtree(stack_dir, ignore_errors=True)
+    return stats
+
+def top(file: str, n: int = 20, role: str = None):
+    """
+    Print the functions with the most samples on top of the stack (self time)
+
+    :param role: only count stacks of 'main' or 'worker' processes
+    """
+    self_counts = {}
+    total = 0
+    for stack, count in read_collapsed(file).items():
+        frames = stack.split(';')
+        if role is not None and frames[0] != role:
+            continue
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        total += count
+    for frame, count in sorted(self_counts.items(), key=lambda kv: -kv[1])[:n]:
+        print(f"{100 * count / total:6.2f}% {count:8d}  {frame}")
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire({'merge': merge, 'top': top})
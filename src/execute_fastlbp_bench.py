@@ -1,3 +1,5 @@
+import os
+import numpy as np
 import pandas as pd
 
 import logging
@@ -10,13 +12,37 @@ logging.basicConfig(
 from _config import config, ensure_config_ok
 from fastlbp_runner import FastlbpBenchplanRecord, FastlbpRunner, FastlbpRunnerParams, fastlbp_benchplan_to_runner
 from _scheduler import ParallelScheduler, SequentialScheduler, Job
+from _memwatch import MemoryMonitor
+from _costmodel import CostModel, PlanRuntimeEstimator, get_relative_cost
+from _ordering import get_queue_order
+from _journal import JobJournal
+import _journal
+from _pruning import DominancePruner, prune_benchplan, OOM, TIMEOUT, SKIPPED_DOMINATED
 from profiler import Profiler, make_profiling_runner
-from _benchplan import read_fastlbp_benchplan
+from _benchplan import read_fastlbp_benchplan, ensure_inputs
+from _pagecache import COLD, STAGED, get_size, remove_stale_stages
+from _kernelpeaks import enter_leaf_cgroup
 
 
+def get_journal_path(bench_plan_path: str) -> str:
+    return bench_plan_path + '.journal.sqlite'
+
+def reset_journal(bench_plan_path: str):
+    """
+    Forget the job history of a benchplan. Call it when the benchplan is (re)created.
+    """
+    journal_path = get_journal_path(bench_plan_path)
+    if os.path.exists(journal_path):
+        logging.info(f"removing old journal '{journal_path}'")
+        os.remove(journal_path)
+
 def main(bench_plan_path: str, avail_cpus: int, avail_mem_gb: int, check_interval: float = 10.0, print_interval: float = 60.0,
-         prof_poll_interval:float = 5, prof_full_memory: bool = True, parallel: bool = False, 
-         skip_ok: bool = True):
+         prof_poll_interval:float = 5, prof_min_poll_interval: float = None, prof_stack_interval: float = None, prof_full_memory: bool = True, prof_sampler: str = 'auto', prof_log_format: str = 'csv', parallel: bool = False, 
+         skip_ok: bool = True, event_driven: bool = True, admission: str = 'fifo', order: str = 'plan',
+         pin_cpus: bool = False, dynamic_mem: bool = False, mem_safety_margin_gb: float = 2.0, on_overcommit: str = 'pause',
+         cost_model: str = None, use_journal: bool = True, retry_failed: bool = False,
+         timeout_s: float = None, timeout_factor: float = None, min_timeout_s: float = 60, prune_dominated: bool = True,
+         check_inputs: bool = True):
     """
     Execute a fastlbp benchmarking plan running a memory profiler for each job.
 
@@ -26,9 +52,44 @@ def main(bench_plan_path: str, avail_cpus: int, avail_mem_gb: int, check_interva
     @param check_interval: float, loop will update job status every check_interval seconds
     @param print_interval: float, loop will print status every print_interval seconds
     @param prof_poll_interval: float, memory profiler update interval in seconds
+    @param prof_min_poll_interval: float, default None. If set, the profiler samples adaptively: every prof_min_poll_interval seconds
+        while memory or the number of processes of a job changes (startup, forks, phase transitions), 
+        backing off exponentially up to prof_poll_interval during steady compute
+    @param prof_stack_interval: float, default None. If set, sample python stacks of every run and of its fastlbp workers 
+        at this interval (e.g. 0.02) into mem_*.collapsed files for flamegraphs. Merge repeats with `python _stacksampler.py merge`
     @param prof_full_memory: bool, whether to use quick or full and slow memory info. USS is in full only.
+    @param prof_sampler: str, default 'auto'. Memory profiler backend: 'psutil', 'proc' (Linux, reads /proc directly, 
+        cheap enough for 10-50 ms intervals) or 'auto'. Its cpu overhead is recorded in the json summary of each job
+    @param prof_log_format: str, default 'csv'. Memory log format: 'csv' (mem_*.log), 'binary' (mem_*.mlog, 
+        much smaller and faster to parse) or 'summary' (mem_*.msum, only peaks and a downsampled timeline, see _memlog.py)
     @param parallel: bool, default False. Shall we use sequential or parallel scheduler
     @param skip_ok: bool, default True. Shall we execute all runs, or only not runned yet? If true, skip all runs with status OK
+    @param event_driven: bool, default True. Start the next job as soon as a job exits instead of waiting for the next check_interval
+    @param admission: str, default 'fifo'. Parallel scheduler admission policy: 'fifo', 'smallest_first', 'best_fit' or 'backfill'
+    @param order: str, default 'plan'. Queue order: 'plan' (benchplan order), 'shortest_first' (quick data points first), 
+        'longest_first' (shorter makespan) or 'round_robin' (alternate between parameter axes, cheapest first).
+        Runs are ranked by predicted runtime from the cost model, approx_time_s or OK runs of this plan,
+        and by a size heuristic if some runs have no prediction
+    @param pin_cpus: bool, default False. Pin each parallel job to its own set of physical cores (Linux only). Cores are recorded in result_cores
+    @param dynamic_mem: bool, default False. Admit parallel jobs based on measured memory of running jobs instead of approx_mem_usage_gb reservations
+    @param mem_safety_margin_gb: float, default 2.0. With dynamic_mem, always keep this much memory free
+    @param on_overcommit: str, default 'pause'. With dynamic_mem, what to do when memory runs out anyway: 'pause' admissions or 'kill_newest' job and requeue it
+    @param cost_model: str, default None. Path to a cost model fitted by _costmodel.py. If set, job memory reservations and runtime estimates come from its predictions
+    @param use_journal: bool, default True. Record job states in '{bench_plan_path}.journal.sqlite' and resume from it: 
+        finished jobs are skipped, jobs interrupted by a crash are cleaned up and run again
+    @param retry_failed: bool, default False. With use_journal, run again jobs that failed (or timed out, or were skipped as dominated) in a previous run.
+        By default they are not run again, while without the journal every run that is not OK is
+    @param timeout_s: float, default None. Kill every job running longer than this many seconds and record it as TIMEOUT
+    @param timeout_factor: float, default None. Kill a job running longer than timeout_factor times its predicted runtime.
+        The prediction comes from runs of this plan that have already finished (see PlanRuntimeEstimator), 
+        or from the cost model / approx_time_s until there are enough of them
+    @param min_timeout_s: float, default 60. With timeout_factor, never kill a job earlier than this
+    @param prune_dominated: bool, default True. Do not run jobs that will certainly fail because a smaller job 
+        (same ncpus and mask, smaller or equal image and nradii, larger or equal patchsize) ran out of memory or time, 
+        in this or in a previous run. They get result_ok = SKIPPED_DOMINATED. 
+        With timeout_factor only out-of-memory failures are used, because limits grow with the predicted runtime
+    @param check_inputs: bool, default True. Before running, check the generated input images and masks against 
+        the manifest of the input directory and regenerate the missing or broken ones (see _inputs.py)
     """
     # check type as well
     assert int(avail_cpus) >= 0, "avail_cpus should be int. did you forget '--'?"
@@ -43,22 +104,70 @@ def main(bench_plan_path: str, avail_cpus: int, avail_mem_gb: int, check_interva
     bp = read_fastlbp_benchplan(bench_plan_path)
     logging.info('================')
     logging.info(f"read {len(bp.all_runs)} rows")
+    journal = None
+    if use_journal:
+        journal = JobJournal(get_journal_path(bench_plan_path))
+        logging.info(f"using journal '{journal.path}'")
+
+    if check_inputs:
+        # only inputs of runs the scheduler will run: not OK, and not done according to the journal (see ParallelScheduler._check_journal)
+        missing = ensure_inputs([rec for rec in bp.all_runs if not (skip_ok and rec.result_ok == 'OK') 
+                                 and not (journal is not None and _journal.is_done(journal.get_state(rec.run_label), retry_failed))])
+        if missing:
+            if journal is not None:
+                journal.close()
+            raise FileNotFoundError(f"missing inputs that cannot be generated: {missing}")
     
     # print(str(bp.all_runs))
 
     profiler = Profiler(
         poll_interval_s=prof_poll_interval, 
+        min_poll_interval_s=prof_min_poll_interval,
+        stack_interval_s=prof_stack_interval,
         full_mem_info=prof_full_memory,
+        sampler=prof_sampler,
+        log_format=prof_log_format,
     )
+    # staged copies of profilers killed in a previous run
+    for stage_dir in remove_stale_stages():
+        logging.info(f"removed stale staged inputs '{stage_dir}'")
+    # job cgroups for memory.peak are siblings of the leaf cgroup the profilers inherit from here
+    _, cgroup_reason = enter_leaf_cgroup()
+    if cgroup_reason is not None:
+        logging.info(f"no job cgroups, memory peaks are sampled and per process only: {cgroup_reason}")
+    model = None
+    if cost_model is not None:
+        model = CostModel.load(cost_model)
+        logging.info(f"using cost model '{cost_model}' fitted on {model.n_samples} runs")
+
     FastlbpProfilingRunner = make_profiling_runner(FastlbpRunner, profiler, results_dir=config.results_dir)
 
+    # ordering costs, filled when the jobs are added
+    order_costs = {}
+    queue_order = get_queue_order(order, cost=lambda job: order_costs.get(job.params.run_label))
+
+    prune_on = (OOM, TIMEOUT) if timeout_factor is None else (OOM,)
+    pruner = DominancePruner(bp.all_runs, prune_on) if prune_dominated else None
+
     if parallel:
         scheduler = ParallelScheduler(
             FastlbpProfilingRunner,
             avail_cpus,
             avail_mem_gb,
             check_interval,
-            print_interval
+            print_interval,
+            event_driven=event_driven,
+            admission_policy=admission,
+            pin_cpus=pin_cpus,
+            memory_monitor=MemoryMonitor(avail_mem_gb, mem_safety_margin_gb, on_overcommit=on_overcommit) if dynamic_mem else None,
+            journal=journal,
+            retry_failed=retry_failed,
+            timeout_s=timeout_s,
+            timeout_factor=timeout_factor,
+            min_timeout_s=min_timeout_s,
+            runtime_estimator=PlanRuntimeEstimator(bp.all_runs) if timeout_factor is not None else None,
+            pruner=pruner,
+            queue_order=queue_order
         )
     else:
         scheduler = SequentialScheduler(
@@ -66,18 +175,62 @@ def main(bench_plan_path: str, avail_cpus: int, avail_mem_gb: int, check_interva
             avail_cpus,
             avail_mem_gb,
             check_interval,
-            print_interval
+            print_interval,
+            event_driven=event_driven,
+            journal=journal,
+            retry_failed=retry_failed,
+            timeout_s=timeout_s,
+            timeout_factor=timeout_factor,
+            min_timeout_s=min_timeout_s,
+            runtime_estimator=PlanRuntimeEstimator(bp.all_runs) if timeout_factor is not None else None,
+            pruner=pruner,
+            queue_order=queue_order
         )
 
+    # runs dominated by runs that failed in previous executions of this plan
+    dominated = prune_benchplan(bp.all_runs, prune_on) if prune_dominated else {}
+    if dominated:
+        logging.info(f"skipping {len(dominated)} runs dominated by failed runs")
+
+    plan_estimator = PlanRuntimeEstimator(bp.all_runs)
+    queued_runs = []
     for benchplan_record in bp.all_runs:
         rec = benchplan_record
         if skip_ok and rec.result_ok == 'OK':
             continue
-        scheduler.add_job(rec.ncpus, rec.approx_mem_usage_gb, params=fastlbp_benchplan_to_runner(rec))
+        if rec.run_label in dominated:
+            FastlbpProfilingRunner.record_status(fastlbp_benchplan_to_runner(rec), SKIPPED_DOMINATED, dominated_by=dominated[rec.run_label])
+            if journal is not None:
+                journal.mark_done(rec.run_label, None, _journal.SKIPPED_DOMINATED, note=f"dominated by {dominated[rec.run_label]}")
+            continue
+        mem_gb, est_time_s = rec.approx_mem_usage_gb, rec.approx_time_s
+        if model is not None:
+            prediction = model.predict_record(rec)
+            mem_gb, est_time_s = int(np.ceil(prediction.mem_gb_hi)), prediction.time_s
+        params = fastlbp_benchplan_to_runner(rec)
+        if rec.cache_mode == STAGED:
+            # tmpfs copies of the inputs take memory while the job runs
+            mem_gb = int(mem_gb) + int(np.ceil(get_size(FastlbpRunner.get_input_files(params)) / 1e9))
+        scheduler.add_job(rec.ncpus, mem_gb, params=params, est_time_s=est_time_s)
+        queued_runs.append(rec)
+        order_costs[rec.run_label] = est_time_s if est_time_s is not None else plan_estimator.predict_record(rec)
+
+    if any(order_costs[rec.run_label] is None for rec in queued_runs):
+        # do not mix seconds with heuristic units
+        for rec in queued_runs:
+            order_costs[rec.run_label] = get_relative_cost(rec.input_shape, rec.mask_ratio, int(rec.ncpus), int(rec.nradii))
+
+    if parallel and any(rec.cache_mode == COLD for rec in queued_runs):
+        logging.warning("cold runs are scheduled in parallel: a job that reads the same input may bring it back into the page cache. "
+                        "check result_input_cached_share, or run them with the sequential scheduler")
 
     logging.info(f"job queue created. starting the profiling scheduler with {avail_cpus} CPUs and {avail_mem_gb} GB of memory")
 
-    scheduler.run()
+    try:
+        scheduler.run()
+    finally:
+        if journal is not None:
+            journal.close()
     logging.info("DONE!")
     
 
@@ -1,5 +1,8 @@
+import time
+# start of the 'import' phase of a run
+_IMPORT_START = time.monotonic()
+
 import numpy as np
-from skimage.io import imread
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = None
 from typing import Union
@@ -10,6 +13,11 @@ import fastlbp_imbg as fastlbp
 
 from _config import config
 from _common import Runner, RunnerParams
+import _phases
+import _stacksampler
+from _inputs import read_image, read_mask, DISK, TIFF, NPY, ZARR
+from _pagecache import NONE
+from _affinity import pin_from_env
 
 """
 """
@@ -27,6 +35,14 @@ class FastlbpBenchplanRecord:
     approx_mem_usage_gb: int
 
     repeat: int = 1
+    # predicted runtime in seconds, if a cost model was used
+    approx_time_s: float = None
+    # shape of the mask, see _inputs.MASK_GEOMETRIES
+    mask_geometry: str = DISK
+    # container of the input image, see _inputs.read_image
+    input_format: str = TIFF
+    # page-cache state of the inputs when the run starts, see _pagecache.py
+    cache_mode: str = NONE
 
     # results
     result_time: float = None
@@ -42,6 +58,8 @@ class FastlbpRunnerParams(RunnerParams):
     patchsize: int
     ncpus: int
     nradii: int
+    input_format: str = TIFF
+    cache_mode: str = NONE
 
 
 class FastlbpRunner(Runner):
@@ -51,52 +69,77 @@ class FastlbpRunner(Runner):
     @staticmethod
     def get_argv(params: FastlbpRunnerParams):
         argv = [ config.fastlbp_pybin, os.path.join(config.src_root, 'fastlbp_runner.py') ]
-        argv += [ params.run_label, params.input_tiff_file, str(params.mask_npy_path), str(params.patchsize), str(params.ncpus), str(params.nradii)]
+        argv += [ params.run_label, params.input_tiff_file, str(params.mask_npy_path), str(params.patchsize), str(params.ncpus), str(params.nradii), params.input_format]
         return argv
+
+    @staticmethod
+    def get_input_files(params: FastlbpRunnerParams) -> list[str]:
+        return [path for path in [params.input_tiff_file, str(params.mask_npy_path)] if path and path != 'None']
+
+    @staticmethod
+    def get_cache_mode(params: FastlbpRunnerParams) -> str | None:
+        # default runs are not prepared at all
+        return params.cache_mode if params.cache_mode != NONE else None
     
     @staticmethod
-    def main(run_label: str, input_tiff_path: str, mask_npy_path: Union[str, None], patchsize: int, ncpus: int, nradii: int):
+    def main(run_label: str, input_tiff_path: str, mask_npy_path: Union[str, None], patchsize: int, ncpus: int, nradii: int, input_format: str = TIFF):
         """
         A single Fastlbp run
         
         :param run_label: unique ID of this run
-        :param input_tiff_path: path to tiff
+        :param input_tiff_path: path to the input image, a tiff unless `input_format` says otherwise
         :param mask_npy_path: path to mask in npy format or `None` if no mask is needed
         :param patchsize: patchsize lbp param
         :param ncpus: ncpus lbp param
         :param nradii: calculate lbp using first `nradii` radiuses from default radii list (see fastlbp.get_radii) with default npoints (fastlbp.get_p_for_r)
+        :param input_format: 'tiff' (decoded by skimage), 'npy' or 'tiff_strips' (memory-mapped, the mask too), 'tiff_tiled' or 'zarr' (decoded by chunks), 
+            see _inputs.read_image. With a memory-mapped input, 'read_input' only maps the file and the pages are read by fastlbp during 'compute'
+
+        Phases 'import', 'read_input', 'read_mask' and 'compute' are marked, see _phases.py.
+        fastlbp saves its output at the end of run_fastlbp, so 'compute' includes saving.
+        Python stacks of this process and of the fastlbp workers are sampled if MULTIBENCH_STACK_DIR is set, see _stacksampler.py.
         """
+        # before the stack sampler thread and the fastlbp workers, so that they run on the cpus of the job too.
+        # a no-op under the profiler, which pinned itself already
+        pin_from_env()
+        _stacksampler.start_from_env()
+        _phases.mark('import', 'start', _IMPORT_START)
+        _phases.mark('import', 'end')
+
         assert fastlbp.__version__ == "0.1.4"
-        assert input_tiff_path.endswith(".tiff")
+        assert input_tiff_path.endswith({NPY: ".npy", ZARR: ".zarr"}.get(input_format, ".tiff")), f"{input_tiff_path} is not {input_format}"
         assert mask_npy_path is None or mask_npy_path=="" or mask_npy_path=="None" or mask_npy_path.endswith(".npy")
         
-        print("Reading input file")
+        print(f"Reading input file as {input_format}")
         print("mask_npy_path is ", mask_npy_path)
         
-        img_data = imread(input_tiff_path)
+        with _phases.phase('read_input'):
+            img_data = read_image(input_tiff_path, input_format)
         
         use_mask = False
         mask_data = None
         if mask_npy_path is not None and len(mask_npy_path)>0 and mask_npy_path != "None":
             use_mask = True
             print("Reading mask")
-            mask_data = np.load(mask_npy_path)
+            with _phases.phase('read_mask'):
+                mask_data = read_mask(mask_npy_path, input_format)
         
         radii_list = fastlbp.get_radii(nradii)
         npoints_list = fastlbp.get_p_for_r(radii_list)
 
         print("Starting fastlbp")
         
-        output_abs_path, effective_mask = fastlbp.run_fastlbp(
-            img_data, radii_list, npoints_list, 
-            patchsize, 
-            ncpus=ncpus, 
-            outfile_name=f"{run_label}_output.npy",  # output file name, will be in the ./data/out
-            img_name=run_label,    # human-friendly name, optional
-            save_intermediate_results=False,  # do not use cache
-            overwrite_output=True,     # no error if output file already exists,
-            img_mask=mask_data
-        )
+        with _phases.phase('compute'):
+            output_abs_path, effective_mask = fastlbp.run_fastlbp(
+                img_data, radii_list, npoints_list, 
+                patchsize, 
+                ncpus=ncpus, 
+                outfile_name=f"{run_label}_output.npy",  # output file name, will be in the ./data/out
+                img_name=run_label,    # human-friendly name, optional
+                save_intermediate_results=False,  # do not use cache
+                overwrite_output=True,     # no error if output file already exists,
+                img_mask=mask_data
+            )
 
 """
 """
@@ -109,7 +152,9 @@ def fastlbp_benchplan_to_runner(benchplan_record: FastlbpBenchplanRecord) -> Fas
         r.mask_npy_path if r.mask_npy_path else '', 
         r.patchsize, 
         r.ncpus, 
-        r.nradii
+        r.nradii,
+        r.input_format or TIFF,
+        r.cache_mode or NONE
     )
 
 """
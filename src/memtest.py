@@ -1,15 +1,31 @@
 import numpy as np
-from multiprocessing import Process
+import os
+import sys
+import subprocess
+import tempfile
+import multiprocessing
 from multiprocessing.shared_memory import SharedMemory
 from multiprocessing.managers import SharedMemoryManager
 from time import sleep, perf_counter
 
 """
-memtest v1
+memtest v2
 
 Launch several parallel processes with shared memory to test the profiler.
+`python memtest.py check` profiles a run and checks the peak of every memory aggregation mode 
+(see _memlog.AGGREGATIONS) against the sizes the run was given.
+
+Memory layout of a run (M = main_mem_mb, S = shared_mem_mb, C = child_mem_mb, n = n_children, all MiB):
+1. the main process allocates M, then S to share, then copies it into a shared memory block: M + 2S, all unique;
+2. the copy is deleted: M + S;
+3. n children are forked. They inherit M (shared with the main process), read the whole shared block
+   and allocate C each: M + S + nC, of which only nC is unique.
+The shared memory manager is started first, so that it does not inherit (and keep) a copy of anything.
 """
 
+# children are forked, so that they share the main data with the main process
+mp = multiprocessing.get_context('fork')
+
 def fill_memory(size_mb: int, base2: bool = True):
     if base2:
         return np.ones((size_mb, 1024, 1024), dtype=np.uint8)
@@ -20,6 +36,8 @@ def child(t0, child_number, shared_mem, child_mem_mb, shared_shape, write_to_sha
     print(f"{perf_counter()-t0:.3f}: c{child_number}: get shared data")
     # shared_data = np.ndarray(shared_shape, np.uint8, shared_mem.buf)
     shared_data = np.frombuffer(shared_mem.buf, np.uint8).reshape(shared_shape)
+    # map all shared pages into this process
+    print(f"{perf_counter()-t0:.3f}: c{child_number}: read shared data ({shared_data.sum()/1e6})")
     sleep(0.5)
 
     if write_to_shared:
@@ -36,16 +54,16 @@ def child(t0, child_number, shared_mem, child_mem_mb, shared_shape, write_to_sha
 
 def main(main_mem_mb:int = 200, child_mem_mb: int = 100, shared_mem_mb:int = 500, n_children:int = 4, write_to_shared:bool = True):
     t0 = perf_counter()
-    
-    print(f"{perf_counter()-t0:.3f}: Main data")
-    main_data = fill_memory(main_mem_mb)
 
-    sleep(0.5)
+    with SharedMemoryManager(ctx=mp) as smm:
+        print(f"{perf_counter()-t0:.3f}: Main data")
+        main_data = fill_memory(main_mem_mb)
 
-    print(f"{perf_counter()-t0:.3f}: data to share")
-    data_to_share = fill_memory(shared_mem_mb)
+        sleep(0.5)
+
+        print(f"{perf_counter()-t0:.3f}: data to share")
+        data_to_share = fill_memory(shared_mem_mb)
 
-    with SharedMemoryManager() as smm:
         print(f"{perf_counter()-t0:.3f}: shared memory")
         shared_mem = smm.SharedMemory(data_to_share.size)
         shared_data = np.ndarray(data_to_share.shape, data_to_share.dtype, shared_mem.buf)
@@ -57,7 +75,7 @@ def main(main_mem_mb:int = 200, child_mem_mb: int = 100, shared_mem_mb:int = 500
         sleep(0.5)
 
         print(f"{perf_counter()-t0:.3f}: Start children")
-        children = [ Process(target=child, args=(t0, i, shared_mem, child_mem_mb, shared_data.shape, write_to_shared)) for i in range(n_children) ]
+        children = [ mp.Process(target=child, args=(t0, i, shared_mem, child_mem_mb, shared_data.shape, write_to_shared)) for i in range(n_children) ]
         for cp in children:
             cp.start()
         for cp in children:
@@ -72,6 +90,80 @@ def main(main_mem_mb:int = 200, child_mem_mb: int = 100, shared_mem_mb:int = 500
     print(f"{perf_counter()-t0:.3f}: Exiting ({main_data.sum()/1e6})")
     return
 
+"""
+"""
+
+def get_expected_peaks(main_mem_mb: int, child_mem_mb: int, shared_mem_mb: int, n_children: int) -> dict[str, float]:
+    """
+    Expected peak of every aggregation mode in MiB, without interpreter overheads. See the module docstring
+    """
+    M, C, S, n = main_mem_mb, child_mem_mb, shared_mem_mb, n_children
+    early = M + 2*S
+    return {
+        'uss': max(early, n*C),
+        'rss': max(early, M + S + n*(M + S + C)),
+        'pss': max(early, M + S + n*C),
+        'shared_once': max(early, M + S + n*C),
+    }
+
+def replay_summary(mem_df, fields: list[str]) -> dict:
+    """
+    Feed a csv log into a MemSummaryWriter, return its peaks
+    """
+    from _memlog import MemSummaryWriter
+    with tempfile.TemporaryDirectory() as tmp:
+        with MemSummaryWriter(os.path.join(tmp, 'replay.msum'), fields) as summary:
+            for time, tick in mem_df.groupby('time'):
+                for row in tick.itertuples(index=False):
+                    summary.append(time, row.pid, row.is_parent, [getattr(row, f) for f in fields])
+                summary.end_tick(time)
+            return summary.get_summary()['peak']
+
+def check(main_mem_mb: int = 200, child_mem_mb: int = 150, shared_mem_mb: int = 300, n_children: int = 4, 
+          tolerance: float = 0.05, overhead_mb_per_proc: float = 40, poll_interval_s: float = 0.05, sampler: str = 'auto'):
+    """
+    Profile a memtest run and check that every aggregation mode reports the expected peak, 
+    in the csv log and in the summary. Exit with 1 if one of them does not.
+    The defaults make the children phase the peak, where the modes disagree most.
+
+    :param tolerance: relative error allowed
+    :param overhead_mb_per_proc: interpreter memory allowed on top of the expected peak, per process
+        (the main process, the shared memory manager and the children)
+    """
+    from profiler import Profiler
+    from _memlog import AGGREGATIONS, read_memlog_df, get_tree_memory, get_log_path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outfile = os.path.join(tmp, 'memtest')
+        prof = Profiler(outfile, poll_interval_s=poll_interval_s, full_mem_info=True, sampler=sampler)
+        argv = [sys.executable, os.path.abspath(__file__), f'--main_mem_mb={main_mem_mb}', f'--child_mem_mb={child_mem_mb}', 
+                f'--shared_mem_mb={shared_mem_mb}', f'--n_children={n_children}']
+        returncode = prof.profile_memory_writing(argv, stdout=subprocess.DEVNULL)
+        assert returncode == 0, f"memtest failed with return code {returncode}"
+        mem_df = read_memlog_df(get_log_path(outfile, 'csv'))
+    
+    fields = [c for c in mem_df.columns if c not in ['time', 'pid', 'is_parent']]
+    summary_peaks = replay_summary(mem_df, fields)
+    expected = get_expected_peaks(main_mem_mb, child_mem_mb, shared_mem_mb, n_children)
+    overhead_mb = overhead_mb_per_proc * (n_children + 2)
+    failed = []
+    print(f"{'mode':<12} {'expected':>9} {'log':>9} {'summary':>9}   MiB")
+    for aggregation in AGGREGATIONS:
+        log_peak = get_tree_memory(mem_df, aggregation).max() / 2**20
+        summary_peak = summary_peaks[aggregation] / 2**20
+        ok = all(expected[aggregation] * (1 - tolerance) <= peak <= expected[aggregation] * (1 + tolerance) + overhead_mb
+                 for peak in [log_peak, summary_peak])
+        print(f"{aggregation:<12} {expected[aggregation]:>9.0f} {log_peak:>9.0f} {summary_peak:>9.0f}   {'ok' if ok else 'FAILED'}")
+        if not ok:
+            failed.append(aggregation)
+    if failed:
+        print(f"FAILED: {failed}")
+        sys.exit(1)
+    print("OK")
+
 if __name__ == "__main__":
     import fire
-    fire.Fire(main)
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        fire.Fire(check, command=sys.argv[2:])
+    else:
+        fire.Fire(main)
@@ -3,10 +3,180 @@ from glob import glob
 import os
 import re
 
+from _common import read_json_file
+from _pruning import is_oom_failure, OOM
+from _memlog import read_memlog_df, read_memsummary, get_tree_memory, CSV_EXT, BINARY_EXT, SUMMARY_EXT, AGGREGATIONS, SHARED_ONCE
+from _phases import read_phases, PHASE_EXT
+from _pagecache import COLD
+
+# a run is flagged IO if it read this much from the storage (a warm page cache reads nothing),
+# had this many major page faults or spent this share of its wall time waiting on block i/o
+IO_FLAG_READ_BYTES = 100e6
+IO_FLAG_MAJFLT = 1000
+IO_FLAG_BLKIO_SHARE = 0.1
+# result_ok of flagged runs with flagged_not_ok=True
+DISTURBED = 'DISTURBED'
+
+def find_memory_logs(results_dir: str) -> dict[str, str]:
+    """
+    Return {run label: memory log file name} for logs of all formats. 
+    If a run has logs of several formats, the newest one is used.
+    """
+    logs = {}
+    for ext in [CSV_EXT, BINARY_EXT, SUMMARY_EXT]:
+        for file in glob(f'mem_*{ext}', root_dir=results_dir):
+            label = file[len('mem_'):-len(ext)]
+            if label in logs and os.path.getmtime(os.path.join(results_dir, logs[label])) > os.path.getmtime(os.path.join(results_dir, file)):
+                continue
+            logs[label] = file
+    return logs
+
 def get_peak_mem(mem_df: pd.DataFrame, mem_field='uss'):
-    # group and sum by time
-    # find max val
-    return mem_df.groupby('time')[mem_field].sum().max()
+    """
+    :param mem_field: a field or one of _memlog.AGGREGATIONS
+    """
+    return get_tree_memory(mem_df, mem_field).max()
+
+def get_sampled_mem_stats(log_filename: str) -> dict:
+    """
+    Sampled peaks (bytes) and execution time (s) from a memory log of any format:
+    peak_<aggregation> are peaks of the process tree memory (see _memlog.AGGREGATIONS, nan if not logged), 
+    proc_peak_rss is the largest single-process rss
+    """
+    if log_filename.endswith(SUMMARY_EXT):
+        s = read_memsummary(log_filename)
+        stats = {f'peak_{a}': s['peak'].get(a, float('nan')) for a in AGGREGATIONS}
+        stats.update({
+            'proc_peak_rss': s['proc_peak']['rss'],
+            'time': s['duration_s'],
+        })
+        return stats
+    mem_df = read_memlog_df(log_filename)
+    has_uss = 'uss' in mem_df
+    stats = {
+        'peak_uss': get_peak_mem(mem_df, mem_field='uss') if has_uss else float('nan'),
+        'peak_rss': get_peak_mem(mem_df, mem_field='rss'),
+        'peak_pss': get_peak_mem(mem_df, mem_field='pss') if 'pss' in mem_df else float('nan'),
+        f'peak_{SHARED_ONCE}': get_peak_mem(mem_df, mem_field=SHARED_ONCE) if has_uss else float('nan'),
+        'proc_peak_rss': mem_df['rss'].max() if len(mem_df) > 0 else 0,
+        'time': get_execution_time(mem_df),
+    }
+    return stats
+
+def get_kernel_peaks(sampled: dict, summary: dict) -> dict:
+    """
+    Kernel-tracked peaks from the profiler summary next to the sampled ones, in Megabytes.
+    result_sampler_miss is the part of the largest single-process peak that sampling did not see.
+    """
+    def mb(value):
+        return value / 1e6 if value is not None else float('nan')
+    peaks = {
+        'result_mem_rss': sampled['peak_rss'] / 1e6,
+        'result_mem_pss': sampled['peak_pss'] / 1e6,
+        'result_mem_shared_once': sampled[f'peak_{SHARED_ONCE}'] / 1e6,
+        'result_mem_hwm_max': mb(summary.get('hwm_max')),
+        'result_mem_hwm_sum': mb(summary.get('hwm_sum')),
+        'result_mem_maxrss': mb(summary.get('children_maxrss')),
+        'result_mem_cgroup_peak': mb(summary.get('cgroup_peak')),
+    }
+    kernel_single_peak = max(summary.get('hwm_max') or 0, summary.get('children_maxrss') or 0)
+    if kernel_single_peak > 0 and sampled['proc_peak_rss'] > 0:
+        peaks['result_sampler_miss'] = max(1 - sampled['proc_peak_rss'] / kernel_single_peak, 0)
+    return peaks
+
+def get_phase_stats(log_filename: str, phases: list[dict]) -> dict:
+    """
+    Time (s) and peak memory (Megabytes, uss if logged, else rss) of every phase of the run, see _phases.py.
+    For summaries the peak is the max of the timeline buckets that overlap the phase.
+    A phase that did not end lasts until the end of the log.
+    """
+    if log_filename.endswith(SUMMARY_EXT):
+        timeline = read_memsummary(log_filename)['timeline']
+        field = 'uss' if 'uss' in timeline['max'] else 'rss'
+        bucket_s = timeline['bucket_s']
+        starts = pd.Series(timeline['start_s'])
+        total = pd.Series(timeline['max'][field])
+        ends = starts + bucket_s
+        end_of_log = ends.max() if len(ends) else 0
+    else:
+        mem_df = read_memlog_df(log_filename)
+        field = 'uss' if 'uss' in mem_df else 'rss'
+        total = mem_df.groupby('time')[field].sum()
+        starts = ends = pd.Series(total.index)
+        total = total.reset_index(drop=True)
+        end_of_log = starts.max() if len(starts) else 0
+    stats = {}
+    for p in phases:
+        end_s = p['end_s'] if p['end_s'] is not None else end_of_log
+        in_phase = (ends >= p['start_s']) & (starts <= end_s)
+        stats[f"result_phase_{p['phase']}_time"] = end_s - p['start_s']
+        stats[f"result_phase_{p['phase']}_mem"] = total[in_phase].max() / 1e6 if in_phase.any() else float('nan')
+    return stats
+
+def get_cpu_stats(summary: dict, wall_s: float, ncpus: float | None) -> dict:
+    """
+    CPU usage of the process tree from the profiler summary.
+    result_parallel_eff is the share of the requested cores that was actually busy,
+    result_run_wait_share is run-queue wait relative to cpu time (high values mean oversubscription).
+    """
+    if 'cpu_user_s' in summary:
+        cpu_s = summary['cpu_user_s'] + summary['cpu_system_s']
+        ctx_invol = summary['ctx_involuntary']
+    elif 'sampled_cpu_user_s' in summary:
+        cpu_s = summary['sampled_cpu_user_s'] + summary['sampled_cpu_system_s']
+        ctx_invol = summary['sampled_ctx_involuntary']
+    else:
+        return {}
+    wall_s = summary.get('wall_s', wall_s)
+    stats = {
+        'result_cpu_s': cpu_s,
+        'result_avg_cores_busy': cpu_s / wall_s if wall_s else float('nan'),
+        'result_max_cores_busy': summary.get('cores_busy_max', float('nan')),
+        'result_threads_max': summary.get('threads_max', float('nan')),
+        'result_ctx_involuntary': ctx_invol,
+        'result_run_wait_share': summary['run_wait_s'] / cpu_s if cpu_s and 'run_wait_s' in summary else float('nan'),
+    }
+    if ncpus and wall_s:
+        stats['result_parallel_eff'] = cpu_s / (wall_s * ncpus)
+    return stats
+
+def get_io_stats(summary: dict, wall_s: float) -> dict:
+    """
+    Storage i/o (Megabytes), page faults and swapping during the run from the profiler summary.
+    result_io_flags is 'SWAP' if the system swapped while the run was going, 'IO' if the run waited for the storage,
+    or both ('SWAP,IO'). Timings of flagged runs are not comparable to the others.
+    Runs with cache_mode 'cold' read their input from the storage on purpose, so they are not flagged 'IO'.
+    The page-cache state of the input right before the run is added if the profiler prepared it (see _pagecache.py).
+    """
+    if 'sampled_majflt' not in summary:
+        return {}
+    cache_stats = {}
+    if 'cache_mode' in summary:
+        cache_stats = {
+            'result_input_cached_share': summary['input_cached_share'],
+            'result_input_fstype': summary['input_fstype'],
+            'result_cache_prepare_s': summary['cache_prepare_s'],
+        }
+    read_bytes = summary.get('read_bytes', summary['sampled_read_bytes'])
+    majflt = summary.get('majflt', summary['sampled_majflt'])
+    swap_bytes = summary.get('sys_swap_in_bytes', 0) + summary.get('sys_swap_out_bytes', 0)
+    wall_s = summary.get('wall_s', wall_s)
+    flags = []
+    if swap_bytes > 0:
+        flags.append('SWAP')
+    if summary.get('cache_mode') != COLD and (read_bytes >= IO_FLAG_READ_BYTES or majflt >= IO_FLAG_MAJFLT 
+            or (wall_s and summary['blkio_delay_s'] / wall_s >= IO_FLAG_BLKIO_SHARE)):
+        flags.append('IO')
+    return {
+        'result_read_mb': read_bytes / 1e6,
+        'result_write_mb': summary.get('write_bytes', summary['sampled_write_bytes']) / 1e6,
+        'result_majflt': majflt,
+        'result_minflt': summary.get('minflt', summary['sampled_minflt']),
+        'result_blkio_delay_s': summary['blkio_delay_s'],
+        'result_sys_swap_mb': swap_bytes / 1e6,
+        'result_io_flags': ','.join(flags),
+        **cache_stats,
+    }
 
 def get_execution_time(mem_df: pd.DataFrame):
     return mem_df.tail(1)['time'].item()
@@ -27,7 +197,8 @@ def get_execution_status(err_log_file: str):
         return "ERR"
     return "OK"
 
-def main(benchplan_file: str, results_dir: str, skip_unknown_runs: bool =True, inplace: bool = True):
+def main(benchplan_file: str, results_dir: str, skip_unknown_runs: bool =True, inplace: bool = True, flagged_not_ok: bool = False, 
+         mem_aggregation: str = 'uss'):
     """
     Read benchplan, parse results_dir, fill benchplan with results parsed from result_dir.  
     Make sure run labels match log file names in result_dir.
@@ -36,19 +207,38 @@ def main(benchplan_file: str, results_dir: str, skip_unknown_runs: bool =True, i
     @param results_dir: str, search for time and mem results in this dir
     @params skip_unknown_runs: bool, default True, do not add run to the results if it is not in the benchplan
     @params inplace: bool, default True, shall we edit the benchplan, or create a new one? If False, output will be at "results_{benchplan_basename}"
+    @params flagged_not_ok: bool, default False, set result_ok of OK runs that swapped or waited for i/o (see result_io_flags) to DISTURBED.
+        They are then excluded from cost models and executed again by execute_fastlbp_bench with skip_ok (use a fresh journal).
+    @params mem_aggregation: str, default 'uss', how result_mem sums up the memory of the process tree, one of _memlog.AGGREGATIONS.
+        'uss' leaves out memory shared by fastlbp workers, 'pss' or 'shared_once' count it once. 
+        result_mem_rss, result_mem_pss and result_mem_shared_once are always filled.
     """
     print("Parsing ", benchplan_file, " with results directory ", results_dir, ".")
+    assert mem_aggregation in AGGREGATIONS, mem_aggregation
 
     df = pd.read_csv(benchplan_file, index_col='run_label')
     df['result_ok'] = df['result_ok'].astype(str)
-    files = glob('mem_*.log', root_dir=results_dir)
-    offset_l, offset_r = len('mem_'), len('.log')
+    logs = find_memory_logs(results_dir)
+    # runs that were never started (e.g. pruned) only have a json summary
+    summary_only_labels = sorted(set(f[len('mem_'):-len('.json')] for f in glob('mem_*.json', root_dir=results_dir)) 
+                                 - set(logs.keys()))
+
+    print(f"Read {len(df)} runs, found {len(logs)} files")
 
-    print(f"Read {len(df)} runs, found {len(files)} files")
+    for label in summary_only_labels:
+        if skip_unknown_runs and label not in df.index:
+            continue
+        summary = read_json_file(os.path.join(results_dir, f'mem_{label}.json'))
+        if 'status' not in summary:
+            continue
+        print(label, summary['status'])
+        df.loc[label, 'result_ok'] = summary['status']
+        if 'dominated_by' in summary:
+            df.loc[label, 'result_dominated_by'] = summary['dominated_by']
 
-    for file in files:
+    for label, file in logs.items():
         log_filename = os.path.join(results_dir, file)
-        label = file[offset_l:-offset_r]
+        base_filename = os.path.join(results_dir, f'mem_{label}')
         print(label, end='')
 
         if skip_unknown_runs and label not in df.index:
@@ -56,21 +246,47 @@ def main(benchplan_file: str, results_dir: str, skip_unknown_runs: bool =True, i
             continue
 
         try:
-            mem_df = pd.read_csv(log_filename)
+            sampled = get_sampled_mem_stats(log_filename)
             print('.', end='')
-            result_mem = get_peak_mem(mem_df, mem_field='uss') / 1e6    # Megabytes
-            result_time = get_execution_time(mem_df)
+            result_mem = sampled[f'peak_{mem_aggregation}'] / 1e6    # Megabytes
+            result_time = sampled['time']
             print('.', end='')
-            errlog_file = log_filename.replace('.log', '.err')
+            errlog_file = base_filename + '.err'
             result_ok = get_execution_status(errlog_file)
             print('.', end='')
+            summary = read_json_file(base_filename + '.json')
+            if result_ok != 'OK' and is_oom_failure(summary.get('returncode'), [errlog_file]):
+                result_ok = OOM
         except Exception as e:
             print(f"skip - error while parsing {log_filename}: ", e)
             continue
 
+        # the last sample may be a whole poll interval before the end, esp. with adaptive sampling
+        result_time = max(result_time, summary.get('wall_s', 0))
         df.loc[label, 'result_mem'] = result_mem
         df.loc[label, 'result_time'] = result_time
         df.loc[label, 'result_ok'] = result_ok
+        df.loc[label, 'result_cores'] = summary.get('cpu_affinity')
+        for column, value in get_kernel_peaks(sampled, summary).items():
+            df.loc[label, column] = value
+        ncpus = df.loc[label, 'ncpus'] if 'ncpus' in df.columns else None
+        phases = read_phases(base_filename + PHASE_EXT, summary.get('t0_monotonic', 0.0))
+        for column, value in get_phase_stats(log_filename, phases).items():
+            df.loc[label, column] = value
+        io_stats = get_io_stats(summary, result_time)
+        for column, value in io_stats.items():
+            df.loc[label, column] = value
+        if flagged_not_ok and result_ok == 'OK' and io_stats.get('result_io_flags'):
+            df.loc[label, 'result_ok'] = result_ok = DISTURBED
+        for column, value in get_cpu_stats(summary, result_time, ncpus).items():
+            df.loc[label, column] = value
+        if 'status' in summary:
+            # decided by the scheduler, e.g. TIMEOUT. the log stops a bit before the kill
+            df.loc[label, 'result_ok'] = summary['status']
+            df.loc[label, 'result_time'] = max(result_time, summary.get('elapsed_s', 0))
+            if 'mem_gb_at_timeout' in summary:
+                df.loc[label, 'result_mem_at_kill'] = summary['mem_gb_at_timeout'] * 1e3    # Megabytes
+            result_ok = summary['status']
     
         print(result_ok)
 
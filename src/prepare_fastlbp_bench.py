@@ -23,6 +23,12 @@ all_ncpus = [1,2,4]
 
 all_nradii = [5,10]
 
+# containers of the input image, see _inputs.INPUT_FORMATS
+all_inputformat = ['tiff']
+
+# page-cache state of the inputs when a run starts, see _pagecache.CACHE_MODES
+all_cachemode = ['none']
+
 
 """
 END CONFIG
@@ -35,6 +41,8 @@ if __name__ == "__main__":
         all_maskratio,
         all_patchsize,
         all_ncpus,
-        all_nradii
+        all_nradii,
+        inputformat=all_inputformat,
+        cachemode=all_cachemode
     )
     bp.save(bench_plan_path)
@@ -2,90 +2,370 @@
 import psutil
 import subprocess
 import os
+import sys
+import signal
 import time
 import datetime
+import functools
+import shutil
 
 # https://github.com/imbg-ua/fastLBP-sandbox/blob/main/lbp-playground/true-memory-profiling.ipynb
 
 from _config import config
-from _common import Runner, RunnerParams
+from _common import Runner, RunnerParams, read_json_file, update_json_file
+from _affinity import format_cpu_list, get_process_affinity, pin_from_env
+import _procsampler
+from _phases import PHASE_FILE_ENV, PHASE_EXT, read_phases
+from _stacksampler import STACK_DIR_ENV, STACK_INTERVAL_ENV, COLLAPSED_EXT, collect_dir
+from _kernelpeaks import JobCgroup, get_children_maxrss_bytes, get_children_rusage, read_vm_hwm, read_vmstat
+import _pagecache
+from _memlog import open_log_writer, get_log_path, read_memlog_df, read_memsummary, get_tree_memory, CSV_EXT, BINARY_EXT, SUMMARY_EXT
 
 PROFILER_VER = "0.0.1"
 
+SAMPLERS = ['auto', 'psutil', 'proc']
+
+class AdaptivePollInterval:
+    """
+    Poll interval that drops to `min_s` while the process tree changes and backs off exponentially up to `max_s` 
+    while it does not (steady compute).
+
+    The tree changes if its total rss moved by more than `rel_change` (or `abs_change_bytes`, whichever is larger) 
+    since the previous tick, if the number of processes changed, or if the sum of kernel peaks (VmHWM) grew: 
+    then memory went up between two ticks, maybe in a spike that sampling missed.
+    """
+    min_s: float
+    max_s: float
+    rel_change: float
+    abs_change_bytes: int
+    backoff: float
+
+    def __init__(self, min_s: float, max_s: float, rel_change: float = 0.02, abs_change_bytes: int = 16 * 2**20, backoff: float = 2.0):
+        assert 0 < min_s <= max_s, (min_s, max_s)
+        self.min_s = min_s
+        self.max_s = max_s
+        self.rel_change = rel_change
+        self.abs_change_bytes = abs_change_bytes
+        self.backoff = backoff
+        self.interval_s = min_s
+        self._prev = None
+
+    def update(self, total_rss: int, nprocs: int, hwm_sum: int) -> float:
+        """
+        Called after every tick with the tick totals, returns the interval to the next tick
+        """
+        if self._prev is not None:
+            prev_rss, prev_nprocs, prev_hwm_sum = self._prev
+            threshold = max(self.rel_change * prev_rss, self.abs_change_bytes)
+            changed = (abs(total_rss - prev_rss) > threshold or nprocs != prev_nprocs 
+                       or hwm_sum - prev_hwm_sum > self.abs_change_bytes)
+            self.interval_s = self.min_s if changed else min(self.interval_s * self.backoff, self.max_s)
+        self._prev = (total_rss, nprocs, hwm_sum)
+        return self.interval_s
+
+def _wait(p: subprocess.Popen, timeout_s: float) -> None:
+    # return as soon as the process exits
+    try:
+        p.wait(timeout=timeout_s)
+    except subprocess.TimeoutExpired:
+        pass
+
 class Profiler:
     outfile: str
     poll_interval_s: float
+    # adaptive sampling between min_poll_interval_s and poll_interval_s, if set
+    min_poll_interval_s: float | None
+    # python stack sampling interval of the job, if enabled
+    stack_interval_s: float | None
     full_mem_info: bool
+    sampler: str
+    log_format: str
+    # cpu cost of the sampling loop of the last profile_memory_writing
+    stats: dict
 
-    def __init__(self, outfile='./memory', poll_interval_s: float = 0.1, full_mem_info: bool = False):
+    def __init__(self, outfile='./memory', poll_interval_s: float = 0.1, full_mem_info: bool = False, sampler: str = 'auto', log_format: str = 'csv',
+                 min_poll_interval_s: float = None, stack_interval_s: float = None):
+        """
+        :param outfile: memory log path without extension
+        :param min_poll_interval_s: sample adaptively (see AdaptivePollInterval): every min_poll_interval_s 
+            while memory or the number of processes changes, backing off up to poll_interval_s while they do not.
+            Every log row has its own time, so logs stay exactly aligned
+        :param stack_interval_s: sample python stacks of the job and its forked workers at this interval 
+            into {outfile}.collapsed (see _stacksampler.py). The job has to call _stacksampler.start_from_env(), as FastlbpRunner does
+        :param log_format: 'csv' ({outfile}.log), 'binary' ({outfile}.mlog) 
+            or 'summary' ({outfile}.msum, statistics only, see profile_memory_summing and _memlog.py)
+        :param sampler: 'psutil', 'proc' (Linux only, reads /proc directly, see _procsampler.py) 
+            or 'auto' ('proc' where available)
+        """
+        assert sampler in SAMPLERS, sampler
         self.poll_interval_s = poll_interval_s
+        self.min_poll_interval_s = min_poll_interval_s
+        self.stack_interval_s = stack_interval_s
         self.outfile = outfile
         self.full_mem_info = full_mem_info
+        if sampler == 'auto':
+            sampler = 'proc' if _procsampler.is_available() else 'psutil'
+        self.sampler = sampler
+        self.log_format = log_format
+        self.stats = {}
+        self._vmstat0 = None
 
-    def profile_memory_summing(self, *popen_args, **popen_kwargs):
-        import pandas as pd
-        import numpy as np
-        with subprocess.Popen(*popen_args, **popen_kwargs) as p:
-            psp = psutil.Process(p.pid)
-            
-            meminfo = psp.memory_info()
-            memlog = []
-
-            p.poll()
-            while p.returncode is None:
-                # print("a")
-                # calculate real memory usage for all children processes.
-                # sum it up and save peak usage.
-                proc_mem = np.array(psp.memory_info())
-                subproc_mem = np.array([ list(ps_child.memory_info()) for ps_child in psp.children(True) ], dtype=np.int64)
-                total_mem = proc_mem + subproc_mem.sum(axis=0)
-                memlog.append(total_mem)
-                time.sleep(self.poll_interval_s)
-                p.poll() # update p.returncode value
-            print("done")
+    def _write_stats(self, ticks: int, cpu_s: float, wall_s: float, hwm: dict[int, int], cgroup: JobCgroup, tree_cpu: _procsampler.TreeCpuStats, 
+                     tree_io: _procsampler.TreeIoStats, t0_monotonic: float):
+        """
+        :param t0_monotonic: time.monotonic() at the log time 0, to align phase markers of the job
+        :param hwm: pid -> last seen VmHWM
+        :param cgroup: cgroup of the job, the job must be finished and reaped
+        :param tree_cpu: sampled cpu accounting of the job tree
+        :param tree_io: sampled i/o and page faults of the job tree
+        """
+        self.stats = {
+            'sampler': self.sampler,
+            'sampler_ticks': ticks,
+            'sampler_cpu_s': round(cpu_s, 6),
+            'sampler_cpu_ms_per_tick': round(1e3 * cpu_s / max(ticks, 1), 6),
+            # fraction of one core spent on sampling
+            'sampler_cpu_load': round(cpu_s / wall_s, 6) if wall_s > 0 else None,
+            'sampler_adaptive': self.min_poll_interval_s is not None,
+            'sampler_mean_interval_s': round(wall_s / max(ticks, 1), 6),
+            # kernel-tracked peaks, in bytes. 
+            # hwm_sum is an upper bound of the tree peak: processes may peak at different times
+            'hwm_max': max(hwm.values()) if hwm else None,
+            'hwm_sum': sum(hwm.values()) if hwm else None,
+            'hwm_nprocs': len(hwm),
+            # the largest single process of the whole tree, including processes that lived shorter than a tick
+            'children_maxrss': get_children_maxrss_bytes(),
+            'cgroup_peak': cgroup.get_peak_bytes(),
+            'cgroup_path': cgroup.path,
+            'cgroup_unavailable_reason': cgroup.reason,
+            # wall time of the job as seen by the profiler
+            'wall_s': round(wall_s, 3),
+            't0_monotonic': t0_monotonic,
+            # exact totals of the whole tree (cpu times, context switches, page faults, block i/o),
+            # provided every process was waited for by its parent
+            **(get_children_rusage() or {}),
+            # sampled: misses the last tick of every process, but has run-queue wait, threads, the busiest tick and block i/o delay
+            **tree_cpu.get_stats(),
+            **tree_io.get_stats(),
+            # system-wide, over the lifetime of the job. other processes may swap too
+            **self._get_vmstat_deltas(),
+        }
+
+    def _get_vmstat_deltas(self) -> dict:
+        vmstat = read_vmstat()
+        if vmstat is None or self._vmstat0 is None:
+            return {}
+        return {
+            'sys_swap_in_bytes': (vmstat['pswpin'] - self._vmstat0['pswpin']) * _procsampler.PAGE_SIZE,
+            'sys_swap_out_bytes': (vmstat['pswpout'] - self._vmstat0['pswpout']) * _procsampler.PAGE_SIZE,
+            'sys_majflt': vmstat['pgmajfault'] - self._vmstat0['pgmajfault'],
+        }
+
+    @staticmethod
+    def _update_tree_cpu(tree_cpu: _procsampler.TreeCpuStats, ps: psutil.Process):
+        with ps.oneshot():
+            cpu_times = ps.cpu_times()
+            ctx = ps.num_ctx_switches()
+            tree_cpu.update(ps.pid, cpu_times.user, cpu_times.system, ps.num_threads(),
+                            ctx.voluntary, ctx.involuntary, _procsampler.read_schedstat(ps.pid))
 
-            memlog = pd.DataFrame(columns=list(meminfo._fields))
-            memlog.to_csv(self.outfile)
+    @staticmethod
+    def _update_tree_io(tree_io: _procsampler.TreeIoStats, ps: psutil.Process):
+        # psutil has no page faults and block i/o delay, read /proc directly
+        counters = _procsampler.read_io_and_faults(ps.pid)
+        if counters is not None:
+            tree_io.update(ps.pid, *counters)
 
     def profile_memory_writing(self, *popen_args, **popen_kwargs):
-        with \
-            open(self.outfile, 'w', encoding='utf-8') as f, \
-            subprocess.Popen(*popen_args, **popen_kwargs) as p:
+        """
+        Run a process (Popen args) and log memory of its whole process tree in `log_format`
+        """
+        return self._profile(popen_args, popen_kwargs, self.log_format)
+
+    def profile_memory_summing(self, *popen_args, **popen_kwargs):
+        """
+        Same without a raw log: only running statistics summed over the process tree (peaks, their times, process counts)
+        and a downsampled min/max timeline are kept, in {outfile}.msum. Memory use does not grow with the run time.
+        """
+        return self._profile(popen_args, popen_kwargs, 'summary')
+
+    def _get_interval_policy(self) -> AdaptivePollInterval | None:
+        if self.min_poll_interval_s is None:
+            return None
+        return AdaptivePollInterval(self.min_poll_interval_s, self.poll_interval_s)
 
+    def _profile(self, popen_args, popen_kwargs, log_format: str):
+        # phase markers of the job, see _phases.py
+        phase_file = os.path.abspath(self.outfile + PHASE_EXT)
+        if os.path.exists(phase_file):
+            os.remove(phase_file)
+        popen_kwargs = dict(popen_kwargs)
+        popen_kwargs['env'] = {**(popen_kwargs.get('env') or os.environ), PHASE_FILE_ENV: phase_file}
+        stack_dir = None
+        if self.stack_interval_s is not None:
+            stack_dir = os.path.abspath(self.outfile + '.stacks')
+            shutil.rmtree(stack_dir, ignore_errors=True)
+            os.makedirs(stack_dir)
+            popen_kwargs['env'].update({STACK_DIR_ENV: stack_dir, STACK_INTERVAL_ENV: str(self.stack_interval_s)})
+        self._vmstat0 = read_vmstat()
+        if self.sampler == 'proc':
+            returncode = self._profile_proc(popen_args, popen_kwargs, log_format)
+        else:
+            returncode = self._profile_psutil(popen_args, popen_kwargs, log_format)
+        if stack_dir is not None:
+            self.stats.update(collect_dir(stack_dir, self.outfile + COLLAPSED_EXT))
+        return returncode
+
+    @staticmethod
+    def _make_job_cgroup(popen_kwargs: dict) -> tuple[JobCgroup, dict]:
+        # the job enters its cgroup before exec, so that memory.peak sees everything it allocates
+        cgroup = JobCgroup(f'multibench_job_{os.getpid()}')
+        popen_kwargs = {**popen_kwargs, 'preexec_fn': cgroup.wrap_preexec_fn(popen_kwargs.get('preexec_fn'))}
+        return cgroup, popen_kwargs
+
+    def _profile_psutil(self, popen_args, popen_kwargs, log_format: str):
+        cgroup, popen_kwargs = self._make_job_cgroup(popen_kwargs)
+        with subprocess.Popen(*popen_args, **popen_kwargs) as p:
+            cgroup.check_job(p.pid)
             ps_parent = psutil.Process(p.pid)
+            hwm = {}
+            tree_cpu = _procsampler.TreeCpuStats()
+            tree_io = _procsampler.TreeIoStats()
             
             if self.full_mem_info:
                 meminfo = ps_parent.memory_full_info()
             else:
                 meminfo = ps_parent.memory_info()
-            header = "time,pid,is_parent," + ','.join(meminfo._fields) + '\n'
-            f.write(header)
-
-            t0 = time.perf_counter()
-            p.poll()
-            while p.returncode is None:
-                now = time.perf_counter() - t0
-                if self.full_mem_info:
-                    parent_mem = ps_parent.memory_full_info()
-                else:
-                    parent_mem = ps_parent.memory_info() 
-                parent_str = f"{now:.3f},{ps_parent.pid},1," + ','.join(map(str,parent_mem)) + '\n' 
-                f.write(parent_str)
-
-                for ps_child in ps_parent.children(True):
+
+            with open_log_writer(self.outfile, meminfo._fields, log_format) as log:
+                t0 = time.perf_counter()
+                t0_monotonic = time.monotonic()
+                cpu0 = time.process_time()
+                ticks = 0
+                interval = self._get_interval_policy()
+                p.poll()
+                while p.returncode is None:
+                    now = time.perf_counter() - t0
+                    ticks += 1
                     if self.full_mem_info:
-                        child_mem = ps_child.memory_full_info()
+                        parent_mem = ps_parent.memory_full_info()
                     else:
-                        child_mem = ps_child.memory_info() 
-                    child_str = f"{now:.3f},{ps_child.pid},0," + ','.join(map(str,child_mem)) + '\n' 
-                    f.write(child_str)
+                        parent_mem = ps_parent.memory_info() 
+                    tick_rss, tick_nprocs = parent_mem.rss, 1
+                    log.append(now, ps_parent.pid, True, parent_mem)
+                    hwm[ps_parent.pid] = read_vm_hwm(ps_parent.pid) or hwm.get(ps_parent.pid, 0)
+                    self._update_tree_cpu(tree_cpu, ps_parent)
+                    self._update_tree_io(tree_io, ps_parent)
+
+                    for ps_child in ps_parent.children(True):
+                        # e.g. fastlbp pool workers exit between children() and the reads
+                        try:
+                            if self.full_mem_info:
+                                child_mem = ps_child.memory_full_info()
+                            else:
+                                child_mem = ps_child.memory_info() 
+                            tick_rss, tick_nprocs = tick_rss + child_mem.rss, tick_nprocs + 1
+                            log.append(now, ps_child.pid, False, child_mem)
+                            hwm[ps_child.pid] = read_vm_hwm(ps_child.pid) or hwm.get(ps_child.pid, 0)
+                            self._update_tree_cpu(tree_cpu, ps_child)
+                            self._update_tree_io(tree_io, ps_child)
+                        except (psutil.NoSuchProcess, psutil.AccessDenied):
+                            continue
+                    log.end_tick(now)
+                    tree_cpu.end_tick(now)
 
-                time.sleep(self.poll_interval_s)
-                p.poll() # update p.returncode value
+                    if interval is None:
+                        _wait(p, self.poll_interval_s)
+                    else:
+                        _wait(p, interval.update(tick_rss, tick_nprocs, sum(hwm.values())))
+                    p.poll() # update p.returncode value
+            self._write_stats(ticks, time.process_time() - cpu0, time.perf_counter() - t0, hwm, cgroup, tree_cpu, tree_io, t0_monotonic)
+            cgroup.cleanup()
             print("done")
+        return p.returncode
+
+    def _profile_proc(self, popen_args, popen_kwargs, log_format: str):
+        """
+        Same as _profile_psutil, same log formats
+        """
+        cgroup, popen_kwargs = self._make_job_cgroup(popen_kwargs)
+        with \
+            subprocess.Popen(*popen_args, **popen_kwargs) as p, \
+            _procsampler.ProcTreeSampler(p.pid, full=self.full_mem_info) as sampler:
+
+            cgroup.check_job(p.pid)
 
-def plot():
-    pass
+            with open_log_writer(self.outfile, sampler.fields, log_format) as log:
+                t0 = time.perf_counter()
+                t0_monotonic = time.monotonic()
+                cpu0 = time.process_time()
+                ticks = 0
+                next_tick = t0
+                interval = self._get_interval_policy()
+                p.poll()
+                while p.returncode is None:
+                    now = time.perf_counter() - t0
+                    ticks += 1
+                    tick = sampler.sample()
+                    for pid, is_root, values in tick:
+                        log.append(now, pid, is_root, values)
+                    log.end_tick(now)
+
+                    # keep a steady rate: sampling time is not added to the interval
+                    if interval is None:
+                        next_tick += self.poll_interval_s
+                    else:
+                        # rss is the first field
+                        next_tick += interval.update(sum(values[0] for _, _, values in tick), len(tick), sum(sampler.hwm.values()))
+                    _wait(p, max(next_tick - time.perf_counter(), 0))
+                    p.poll() # update p.returncode value
+            self._write_stats(ticks, time.process_time() - cpu0, time.perf_counter() - t0, sampler.hwm, cgroup, sampler.cpu, sampler.io, t0_monotonic)
+            cgroup.cleanup()
+            print("done")
+        return p.returncode
+
+def plot(*log_files: str, mem_field: str = 'uss', outfile: str = None):
+    """
+    Plot memory of the whole process tree over time for one or more memory logs (csv, binary or summary).
+    For summaries the min-max band of every timeline bucket is drawn.
+    Phases of the job (see _phases.py) are drawn as vertical lines at their starts.
+    Needs matplotlib.
+
+    :param mem_field: memory field to plot, summed over all processes at each time, or one of _memlog.AGGREGATIONS
+    :param outfile: save the figure there instead of showing it
+    """
+    import matplotlib
+    if outfile is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for log_file in log_files:
+        prefix = log_file
+        for ext in [CSV_EXT, BINARY_EXT, SUMMARY_EXT]:
+            prefix = prefix.removesuffix(ext)
+        label = os.path.basename(prefix)
+        t0_monotonic = read_json_file(f'{prefix}.json').get('t0_monotonic', 0.0)
+        for p in read_phases(prefix + PHASE_EXT, t0_monotonic):
+            ax.axvline(p['start_s'], color='gray', linestyle=':')
+            ax.text(p['start_s'], 0, p['phase'], rotation=90, va='bottom', fontsize=8)
+        if log_file.endswith(SUMMARY_EXT):
+            timeline = read_memsummary(log_file)['timeline']
+            t = timeline['start_s']
+            lo = [v / 1e9 for v in timeline['min'][mem_field]]
+            hi = [v / 1e9 for v in timeline['max'][mem_field]]
+            ax.fill_between(t, lo, hi, step='post', alpha=0.5, label=label)
+            continue
+        mem_df = read_memlog_df(log_file)
+        total = get_tree_memory(mem_df, mem_field) / 1e9
+        ax.plot(total.index, total.values, label=label)
+    ax.set_xlabel('time, s')
+    ax.set_ylabel(f'{mem_field}, GB')
+    ax.legend()
+    if outfile is not None:
+        fig.savefig(outfile)
+    else:
+        plt.show()
 
 def test():
     from fastlbp_runner import FastlbpRunner, FastlbpRunnerParams
@@ -101,30 +381,78 @@ def test():
     
     print("Exiting main.")
 
-def main(*target_argv: str, outfile:str = None, poll_interval_s: float = 0.1, full_memory_info: bool = True):
+def main(*target_argv: str, outfile:str = None, poll_interval_s: float = 0.1, full_memory_info: bool = True, sampler: str = 'auto', log_format: str = 'csv',
+         min_poll_interval_s: float = None, stack_interval_s: float = None, cache_mode: str = None, cache_files: str = None):
+    """
+    :param cache_mode: bring `cache_files` into this page-cache state before the job starts (see _pagecache.py), outside of the measurement.
+        With 'staged', the files are copied into a tmpfs and replaced by the copies in `target_argv`
+    :param cache_files: input files of the job, separated by os.pathsep
+    """
+    # cpus of the job if the scheduler pinned it. the profiled process inherits them
+    pin_from_env()
+    if outfile is None:
+        outfile = "profile_" + datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+
     print(f"welcome to profiler ver {PROFILER_VER}")
     print(f"profiling {target_argv[0]}")
     print(f"see executable output at {outfile}.out(.err)")
-    print(f"see memory profiling at {outfile}.log")
-    
-    if outfile is None:
-        outfile = "profile_" + datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    print(f"see memory profiling at {get_log_path(outfile, log_format)}")
+
+    # the scheduler stops a job with SIGTERM to its whole process group. 
+    # exit normally then, so that the logs are flushed and the profiled process is waited for.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    # run summary. the profiler has the same cpu affinity as the job.
+    # start it from scratch: a rerun must not inherit e.g. the TIMEOUT status of a previous attempt
+    if os.path.exists(f'{outfile}.json'):
+        os.remove(f'{outfile}.json')
+    cpu_affinity = get_process_affinity()
+    update_json_file(
+        f'{outfile}.json', 
+        profiler_ver=PROFILER_VER,
+        n_cpus_online=os.cpu_count(),
+        cpu_affinity=format_cpu_list(cpu_affinity) if cpu_affinity is not None else None)
     
+    staged = {}
+    if cache_mode is not None:
+        files = [f for f in str(cache_files or '').split(os.pathsep) if f]
+        staged, cache_stats = _pagecache.prepare(files, str(cache_mode))
+        print(f"inputs prepared: {cache_stats}")
+        update_json_file(f'{outfile}.json', **cache_stats)
+        target_argv = [staged.get(str(a), a) for a in target_argv]
+
     with open(f'{outfile}.out', 'w') as outf, \
          open(f'{outfile}.err', 'w') as errf:
         prof = Profiler(
             poll_interval_s=poll_interval_s, 
-            outfile=f'{outfile}.log', 
-            full_mem_info=full_memory_info)
+            outfile=outfile, 
+            full_mem_info=full_memory_info,
+            sampler=sampler,
+            log_format=log_format,
+            min_poll_interval_s=min_poll_interval_s,
+            stack_interval_s=stack_interval_s)
         print("profiling argv: ", target_argv)
         target_argv_str = list(map(str, target_argv))
-        prof.profile_memory_writing(target_argv_str, stdout=outf, stderr=errf)
+        try:
+            returncode = prof.profile_memory_writing(target_argv_str, stdout=outf, stderr=errf)
+        finally:
+            _pagecache.unstage(staged)
+
+    update_json_file(f'{outfile}.json', returncode=returncode, **prof.stats)
+    return returncode
 
 """
 """
 
 from typing import Type
 
+def get_cache_argv(runner_class: Type[Runner], params: RunnerParams) -> list[str]:
+    cache_mode = runner_class.get_cache_mode(params)
+    if cache_mode is None:
+        return []
+    return [f'--cache_mode={cache_mode}', 
+            '--cache_files="' + os.pathsep.join(runner_class.get_input_files(params)) + '"']
+
 def make_profiling_runner(base_runner_class: Type[Runner], profiler_instance: Profiler, results_dir: str = '.'):
     """
     Create a runner that starts a profiler for each job.
@@ -135,12 +463,29 @@ def make_profiling_runner(base_runner_class: Type[Runner], profiler_instance: Pr
         @staticmethod
         def get_argv(params: RunnerParams) -> list[str]:
             # profile_name:str = None, poll_interval_s: float = 0.1, full_memory_info
-            profile_name, poll_interval_s, full_memory_info = \
-                profiler_instance.outfile, profiler_instance.poll_interval_s, profiler_instance.full_mem_info
+            profile_name, poll_interval_s, full_memory_info, sampler, log_format = \
+                profiler_instance.outfile, profiler_instance.poll_interval_s, profiler_instance.full_mem_info, \
+                profiler_instance.sampler, profiler_instance.log_format
             return ['python', os.path.join(config.src_root, 'profiler.py'), 
                     '--outfile="'+os.path.join(results_dir, 'mem_'+params.run_label)+'"', 
                     f'--poll_interval_s={poll_interval_s}', 
-                    f'--full_memory_info={full_memory_info}'] + base_runner_class.get_argv(params)
+                    f'--full_memory_info={full_memory_info}',
+                    f'--sampler={sampler}',
+                    f'--log_format={log_format}'] \
+                + ([f'--min_poll_interval_s={profiler_instance.min_poll_interval_s}'] if profiler_instance.min_poll_interval_s is not None else []) \
+                + ([f'--stack_interval_s={profiler_instance.stack_interval_s}'] if profiler_instance.stack_interval_s is not None else []) \
+                + get_cache_argv(base_runner_class, params) \
+                + base_runner_class.get_argv(params)
+
+        @staticmethod
+        def get_result_files(params: RunnerParams) -> list[str]:
+            outfile = os.path.join(results_dir, 'mem_'+params.run_label)
+            return [f'{outfile}.{ext}' for ext in ['log', 'mlog', 'msum', 'phases', 'collapsed', 'out', 'err', 'json']] + base_runner_class.get_result_files(params)
+
+        @staticmethod
+        def record_status(params: RunnerParams, status: str, **info) -> None:
+            outfile = os.path.join(results_dir, 'mem_'+params.run_label)
+            update_json_file(f'{outfile}.json', status=status, **info)
 
         @staticmethod
         def main(*args, **kwargs):
@@ -152,6 +497,14 @@ def make_profiling_runner(base_runner_class: Type[Runner], profiler_instance: Pr
 """
 
 
+@functools.wraps(main)
+def cli(*target_argv: str, **kwargs):
+    # exit with the return code of the profiled process, so that the scheduler sees failures
+    sys.exit(main(*target_argv, **kwargs))
+
 if __name__ == "__main__":
     import fire
-    fire.Fire(main)
+    if len(sys.argv) > 1 and sys.argv[1] == 'plot':
+        fire.Fire(plot, command=sys.argv[2:])
+    else:
+        fire.Fire(cli)